@@ -7,11 +7,14 @@ Noms et numéros étudiants:
 """
 
 import argparse
+import codecs
 import getpass
 import json
+import select
 import socket
 import sys
 
+import glocodec
 import glosocket
 import gloutils
 import datetime
@@ -19,22 +22,190 @@ import datetime
 class Client:
     """Client pour le serveur mail @glo2000.ca."""
 
-    def __init__(self, destination: str) -> None:
+    def __init__(self, destination: str, codec: str = glocodec.BINARY,
+                 compress: bool = True) -> None:
         """
-        Prépare et connecte le socket du client `_socket`.
+        Prépare et connecte le socket du client `_socket` (voir `_connect`).
 
         Prépare un attribut `_username` pour stocker le nom d'utilisateur
         courant. Laissé vide quand l'utilisateur n'est pas connecté.
+        `_token` conserve le jeton de sa session, qui permet de se
+        reconnecter sans renvoyer ses identifiants (voir `_reconnect`).
+        `_inbox` conserve les entêtes des courriels déjà reçus, par numéro,
+        et `_inbox_seqs` leurs numéros dans l'ordre (voir `_sync_inbox`).
         """
+        self._destination = destination
+        self._options = (codec, compress)
+        self._username = ""
+        self._token = ""
+        self._inbox = {}
+        self._inbox_seqs = []
         try:
-            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._socket.connect((destination, gloutils.APP_PORT))
-            self._username = ""
+            self._connect()
             print(f"Connecté au serveur à {destination}:{gloutils.APP_PORT}")
         except (socket.error, glosocket.GLOSocketError) as e:
             print(f"Erreur lors de la connexion au serveur : {e}")
             sys.exit(1)
 
+    def _connect(self) -> None:
+        """
+        Connecte le socket du client au serveur, puis négocie l'encodage
+        `_codec` des messages et, si demandé, leur compression `_compress`.
+        """
+        codec, compress = self._options
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.connect((self._destination, gloutils.APP_PORT))
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._codec = glocodec.JSON
+        self._compress = False
+        if codec != glocodec.JSON or compress:
+            self._negotiate(codec, compress)
+
+    def _reconnect(self) -> bool:
+        """
+        Rétablit la connexion au serveur après une coupure et reprend la
+        session de l'utilisateur avec l'entête `AUTH_RESUME`. Retourne vrai
+        si l'utilisateur est toujours connecté.
+
+        Lève une exception GLOSocketError si le serveur est injoignable.
+        """
+        self._socket.close()
+        try:
+            self._connect()
+        except OSError as e:
+            raise glosocket.GLOSocketError(f"Reconnexion impossible : {e}") from e
+        if not self._token:
+            return False
+        self._send({
+            "header": gloutils.Headers.AUTH_RESUME,
+            "payload": {"token": self._token}
+        })
+        if self._recv()["header"] == gloutils.Headers.OK:
+            self._subscribe()
+            return True
+        print("Session expirée, veuillez vous reconnecter.")
+        self._username = ""
+        self._token = ""
+        self._clear_inbox()
+        return False
+
+    def _request(self, message: gloutils.GloMessage,
+                 retry: bool = True) -> gloutils.GloMessage:
+        """
+        Transmet une requête et retourne la réponse du serveur.
+
+        Si la connexion est coupée, le client se reconnecte et reprend sa
+        session, puis transmet à nouveau la requête si elle n'avait pas pu
+        être envoyée ou si `retry` est vrai. Ce n'est pas le cas des
+        requêtes qui modifient des données, que le serveur a pu traiter
+        avant la coupure.
+
+        Lève une exception GLOSocketError si la requête n'a pas abouti.
+        """
+        sent = False
+        try:
+            self._send(message)
+            sent = True
+            return self._recv()
+        except glosocket.GLOSocketError as e:
+            if not self._reconnect() or (sent and not retry):
+                raise glosocket.GLOSocketError(
+                    f"Connexion rétablie, requête interrompue : {e}") from e
+        self._send(message)
+        return self._recv()
+
+    def _negotiate(self, codec: str, compress: bool) -> None:
+        """
+        Propose l'encodage `codec` au serveur avec l'entête `HELLO`, ainsi
+        que la compression des messages si `compress` est vrai.
+
+        Un serveur qui ne connaît pas cet entête répond par une erreur :
+        le client conserve alors l'encodage JSON, sans compression.
+        """
+        payload = {"codecs": [codec, glocodec.JSON]}
+        if compress:
+            payload["compressions"] = [glosocket.COMPRESSION]
+        self._send({
+            "header": gloutils.Headers.HELLO,
+            "payload": payload
+        })
+        response = self._recv()
+        if response["header"] == gloutils.Headers.OK:
+            self._codec = response["payload"]["codec"]
+            self._compress = (response["payload"].get("compression")
+                              == glosocket.COMPRESSION)
+
+    def _send(self, message: gloutils.GloMessage) -> None:
+        """
+        Encode le message avec l'encodage négocié, le compresse s'il y a
+        lieu et le transmet.
+        """
+        glosocket.snd_mesg_bytes(self._socket, self._encode(message))
+
+    def _encode(self, message: gloutils.GloMessage) -> bytes:
+        """Encode le message avec l'encodage et la compression négociés."""
+        data = glocodec.encode(message, self._codec)
+        return glosocket.compress_mesg(data) if self._compress else data
+
+    def _recv(self) -> gloutils.GloMessage:
+        """
+        Reçoit la réponse du serveur à une requête. Les notifications
+        poussées entre-temps par le serveur sont affichées au passage.
+
+        Lève une exception GLOSocketError si le message est indécodable.
+        """
+        while True:
+            message = self._recv_message()
+            if message.get("header") != gloutils.Headers.NEW_EMAIL:
+                return message
+            self._show_notification(message["payload"])
+
+    def _recv_message(self) -> gloutils.GloMessage:
+        """
+        Reçoit un message du serveur et le décode avec l'encodage négocié.
+
+        Lève une exception GLOSocketError si le message est indécodable.
+        """
+        # Les réponses du serveur peuvent contenir des courriels entiers
+        # (INBOX_READING_BATCH) : leur longueur n'est pas bornée.
+        data = glosocket.recv_mesg_bytes(self._socket, max_size=None)
+        try:
+            return glocodec.decode(data, self._codec)
+        except glocodec.CodecError as ex:
+            raise glosocket.GLOSocketError(str(ex)) from ex
+
+    def _subscribe(self) -> None:
+        """
+        Inscrit la connexion aux notifications de nouveaux courriels avec
+        l'entête `SUBSCRIBE`. Un serveur qui ne connaît pas cet entête
+        répond par une erreur : le client s'en passe alors.
+        """
+        self._send({"header": gloutils.Headers.SUBSCRIBE})
+        self._recv()
+
+    def _check_notifications(self) -> None:
+        """
+        Affiche les notifications de nouveaux courriels déjà reçues, sans
+        attendre ni solliciter le serveur. Une coupure de la connexion est
+        laissée à la requête suivante, qui se reconnectera.
+        """
+        try:
+            while select.select([self._socket], [], [], 0)[0]:
+                message = self._recv_message()
+                if message.get("header") == gloutils.Headers.NEW_EMAIL:
+                    self._show_notification(message["payload"])
+        except (OSError, ValueError, glosocket.GLOSocketError):
+            pass
+
+    @staticmethod
+    def _show_notification(payload: gloutils.NotificationPayload) -> None:
+        """Affiche une notification à l'aide du gabarit `NEW_EMAIL_DISPLAY`."""
+        print(gloutils.NEW_EMAIL_DISPLAY.format(
+            sender=payload["sender"],
+            subject=payload["subject"],
+            date=payload["date"]
+        ))
+
     def _register(self) -> None:
         """
         Demande un nom d'utilisateur et un mot de passe et les transmet au
@@ -48,15 +219,18 @@ class Client:
 
         payload = {"username": username, "password": password}
         try:
-            glosocket.snd_mesg(self._socket, json.dumps({
+            self._send({
                 "header": gloutils.Headers.AUTH_REGISTER,
                 "payload": payload
-            }))
-            response = json.loads(glosocket.recv_mesg(self._socket))
+            })
+            response = self._recv()
 
             if response["header"] == gloutils.Headers.OK:
                 print("Compte créé avec succès.")
+                self._clear_inbox()
                 self._username = username
+                self._token = response.get("payload", {}).get("token", "")
+                self._subscribe()
             else:
                 print(f"Erreur : {response['payload']['error_message']}")
         except glosocket.GLOSocketError as e:
@@ -68,22 +242,26 @@ class Client:
         serveur avec l'entête `AUTH_LOGIN`.
 
         Si la connexion est effectuée avec succès, l'attribut `_username`
-        est mis à jour, sinon l'erreur est affichée.
+        est mis à jour et le client s'inscrit aux notifications de nouveaux
+        courriels, sinon l'erreur est affichée.
         """
         username = input("Entrez votre nom d'utilisateur : ")
         password = getpass.getpass("Entrez votre mot de passe : ")
 
         payload = {"username": username, "password": password}
         try:
-            glosocket.snd_mesg(self._socket, json.dumps({
+            self._send({
                 "header": gloutils.Headers.AUTH_LOGIN,
                 "payload": payload
-            }))
-            response = json.loads(glosocket.recv_mesg(self._socket))
+            })
+            response = self._recv()
 
             if response["header"] == gloutils.Headers.OK:
                 print("Connexion réussie.")
+                self._clear_inbox()
                 self._username = username
+                self._token = response.get("payload", {}).get("token", "")
+                self._subscribe()
             else:
                 print(f"Erreur : {response['payload']['error_message']}")
         except glosocket.GLOSocketError as e:
@@ -95,9 +273,9 @@ class Client:
         socket du client.
         """
         try:
-            glosocket.snd_mesg(self._socket, json.dumps({
+            self._send({
                 "header": gloutils.Headers.BYE
-            }))
+            })
             print("Déconnexion du serveur...")
         except glosocket.GLOSocketError as e:
             print(f"Erreur lors de la déconnexion : {e}")
@@ -106,109 +284,361 @@ class Client:
             print("Client déconnecté. Au revoir !")
             sys.exit(0)
 
+    def _clear_inbox(self) -> None:
+        """Oublie les entêtes des courriels reçus pour l'utilisateur précédent."""
+        self._inbox.clear()
+        self._inbox_seqs.clear()
+
+    def _sync_inbox(self) -> bool:
+        """
+        Complète `_inbox` avec les entêtes des courriels arrivés depuis la
+        dernière synchronisation, demandés avec l'entête `INBOX_SYNC` par
+        lots de `INBOX_SYNC_BATCH`. Seuls les nouveaux courriels sont ainsi
+        transférés. Retourne faux, après avoir affiché l'erreur, si le
+        serveur refuse la requête.
+
+        Lève une exception GLOSocketError si la requête n'a pas abouti.
+        """
+        while True:
+            after = self._inbox_seqs[-1] if self._inbox_seqs else 0
+            response = self._request({
+                "header": gloutils.Headers.INBOX_SYNC,
+                "payload": {"after": after, "limit": gloutils.INBOX_SYNC_BATCH}
+            })
+            if response["header"] != gloutils.Headers.OK:
+                print(f"Erreur : {response['payload']['error_message']}")
+                return False
+            payload = response["payload"]
+            if payload["last_seq"] < after:
+                # Le dossier a été recréé sur le serveur : tout est à reprendre.
+                self._clear_inbox()
+                continue
+            for seq, sender, subject, date in zip(payload["seqs"], payload["senders"],
+                                                  payload["subjects"], payload["dates"]):
+                self._inbox[seq] = (sender, subject, date)
+                self._inbox_seqs.append(seq)
+            if not payload["seqs"] or payload["seqs"][-1] >= payload["last_seq"]:
+                return True
+
     def _read_email(self) -> None:
         """
-        Demande au serveur la liste de ses courriels avec l'entête
-        `INBOX_READING_REQUEST`.
+        Met à jour les entêtes des courriels conservés par le client (voir
+        `_sync_inbox`) et en affiche une page de `INBOX_PAGE_SIZE` à l'aide
+        du gabarit `SUBJECT_DISPLAY`, du plus récent au plus ancien.
 
-        Affiche la liste des courriels puis transmet le choix de l'utilisateur
-        avec l'entête `INBOX_READING_CHOICE`.
+        Selon la saisie de l'utilisateur, affiche la page suivante ou
+        précédente ou transmet son choix avec l'entête
+        `INBOX_READING_CHOICE`, en demandant une transmission en continu.
 
-        Affiche le courriel à l'aide du gabarit `EMAIL_DISPLAY`.
+        Affiche le courriel à l'aide du gabarit `EMAIL_DISPLAY`, au fil de
+        sa réception (voir `_show_email_stream`).
 
         S'il n'y a pas de courriel à lire, l'utilisateur est averti avant de
         retourner au menu principal.
         """
         try:
-            glosocket.snd_mesg(self._socket, json.dumps({
-                "header": gloutils.Headers.INBOX_READING_REQUEST
-            }))
-            response = json.loads(glosocket.recv_mesg(self._socket))
-
-            if response["header"] == gloutils.Headers.OK:
-                email_list = response["payload"]["email_list"]
-                if not email_list:
+            if not self._sync_inbox():
+                return
+            offset = 0
+            while True:
+                total = len(self._inbox_seqs)
+                if not total:
                     print("Aucun courriel à afficher.")
                     return
 
-                print("\nListe des courriels :")
-                for email in email_list:
-                    print(email)
-
-                choice = input("Entrez le numéro du courriel à lire : ").strip()
-                if not choice.isdigit():
+                end = total - offset
+                page = self._inbox_seqs[max(end - gloutils.INBOX_PAGE_SIZE, 0):end]
+                print(f"\nListe des courriels ({offset + 1}-"
+                      f"{offset + len(page)} sur {total}) :")
+                for number, seq in enumerate(reversed(page), start=offset + 1):
+                    sender, subject, date = self._inbox[seq]
+                    print(gloutils.SUBJECT_DISPLAY.format(
+                        number=number, sender=sender, subject=subject, date=date))
+
+                choice = input(gloutils.INBOX_PAGE_PROMPT).strip().lower()
+                if choice == "s":
+                    if offset + len(page) < total:
+                        offset += gloutils.INBOX_PAGE_SIZE
+                    else:
+                        print("Vous êtes déjà à la dernière page.")
+                elif choice == "p":
+                    if offset > 0:
+                        offset = max(offset - gloutils.INBOX_PAGE_SIZE, 0)
+                    else:
+                        print("Vous êtes déjà à la première page.")
+                elif choice.isdigit() and 1 <= int(choice) <= total:
+                    break
+                else:
                     print("Entrée invalide.")
                     return
 
-                payload = {"choice": int(choice)}
-                glosocket.snd_mesg(self._socket, json.dumps({
-                    "header": gloutils.Headers.INBOX_READING_CHOICE,
-                    "payload": payload
-                }))
-
-                response = json.loads(glosocket.recv_mesg(self._socket))
-                if response["header"] == gloutils.Headers.OK:
-                    email_data = response["payload"]
-                    print("\n" + gloutils.EMAIL_DISPLAY.format(
-                        sender=email_data["sender"],
-                        to=email_data["destination"],
-                        subject=email_data["subject"],
-                        date=email_data["date"],
-                        body=email_data["content"]
-                    ))
-                else:
+            # Le choix est numéroté à partir du plus récent courriel : ceux
+            # arrivés pendant la saisie le décalent.
+            if not self._sync_inbox():
+                return
+            payload = {"choice": int(choice) + len(self._inbox_seqs) - total,
+                       "stream": True, "raw": True}
+            response = self._request({
+                "header": gloutils.Headers.INBOX_READING_CHOICE,
+                "payload": payload
+            })
+            if response["header"] != gloutils.Headers.OK:
+                print(f"Erreur : {response['payload']['error_message']}")
+            elif "content" in response["payload"]:
+                # Serveur sans transmission en continu : le courriel est complet.
+                self._show_email(response["payload"])
+            else:
+                self._show_email_stream(response["payload"])
+
+        except glosocket.GLOSocketError as e:
+            print(f"Erreur lors de la consultation des courriels : {e}")
+
+    @staticmethod
+    def _show_email(email_data: gloutils.EmailContentPayload) -> None:
+        """Affiche un courriel à l'aide du gabarit `EMAIL_DISPLAY`."""
+        print("\n" + gloutils.EMAIL_DISPLAY.format(
+            sender=email_data["sender"],
+            to=email_data["destination"],
+            subject=email_data["subject"],
+            date=email_data["date"],
+            body=email_data["content"]
+        ))
+
+    def _show_email_stream(self, email_data: dict) -> None:
+        """
+        Affiche un courriel transmis en continu : ses champs `email_data`,
+        puis son corps au fil des messages `EMAIL_CHUNK`, sans jamais le
+        conserver en entier, jusqu'à `EMAIL_STREAM_END`. Avec `raw`, le
+        corps suit plutôt en messages bruts, jusqu'à un message vide.
+
+        Lève une exception GLOSocketError si la connexion est coupée.
+        """
+        # Le gabarit se termine par le corps, suivi d'un saut de ligne.
+        print("\n" + gloutils.EMAIL_DISPLAY.format(
+            sender=email_data["sender"],
+            to=email_data["destination"],
+            subject=email_data["subject"],
+            date=email_data["date"],
+            body=""
+        )[:-1], end="")
+        if email_data.get("raw"):
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            while data := glosocket.recv_mesg_bytes(self._socket):
+                print(decoder.decode(data), end="")
+            print(decoder.decode(b"", final=True) + "\n")
+            return
+        while True:
+            message = self._recv()
+            if message["header"] == gloutils.Headers.EMAIL_CHUNK:
+                print(message["payload"]["data"], end="")
+            elif message["header"] == gloutils.Headers.EMAIL_STREAM_END:
+                print("\n")
+                return
+            else:
+                print(f"\nErreur : {message['payload']['error_message']}")
+                return
+
+    def _search_emails(self) -> None:
+        """
+        Demande les mots à rechercher et les transmet avec l'entête `SEARCH`,
+        une page de `INBOX_PAGE_SIZE` résultats à la fois. Les résultats sont
+        affichés à l'aide du gabarit `SUBJECT_DISPLAY`, avec les entêtes
+        conservés par le client (voir `_sync_inbox`).
+
+        Selon la saisie de l'utilisateur, affiche la page suivante ou
+        précédente ou demande le courriel choisi avec l'entête
+        `INBOX_READING_BATCH`, puis l'affiche.
+        """
+        query = input("Entrez les mots à rechercher : ").strip()
+        if not query:
+            print("Recherche vide.")
+            return
+        try:
+            offset = 0
+            while True:
+                response = self._request({
+                    "header": gloutils.Headers.SEARCH,
+                    "payload": {"query": query, "offset": offset,
+                                "limit": gloutils.INBOX_PAGE_SIZE}
+                })
+                if response["header"] != gloutils.Headers.OK:
                     print(f"Erreur : {response['payload']['error_message']}")
+                    return
+                seqs = response["payload"]["seqs"]
+                total = response["payload"]["total"]
+                if not total:
+                    print("Aucun courriel trouvé.")
+                    return
+                if any(seq not in self._inbox for seq in seqs) and not self._sync_inbox():
+                    return
+
+                print(f"\nRésultats de la recherche ({offset + 1}-"
+                      f"{offset + len(seqs)} sur {total}) :")
+                for number, seq in enumerate(seqs, start=offset + 1):
+                    sender, subject, date = self._inbox[seq]
+                    print(gloutils.SUBJECT_DISPLAY.format(
+                        number=number, sender=sender, subject=subject, date=date))
+
+                choice = input(gloutils.INBOX_PAGE_PROMPT).strip().lower()
+                if choice == "s":
+                    if offset + len(seqs) < total:
+                        offset += gloutils.INBOX_PAGE_SIZE
+                    else:
+                        print("Vous êtes déjà à la dernière page.")
+                elif choice == "p":
+                    if offset > 0:
+                        offset = max(offset - gloutils.INBOX_PAGE_SIZE, 0)
+                    else:
+                        print("Vous êtes déjà à la première page.")
+                elif choice.isdigit() and offset < int(choice) <= offset + len(seqs):
+                    break
+                else:
+                    print("Entrée invalide.")
+                    return
+
+            response = self._request({
+                "header": gloutils.Headers.INBOX_READING_BATCH,
+                "payload": {"seqs": [seqs[int(choice) - offset - 1]]}
+            })
+            if response["header"] == gloutils.Headers.OK:
+                batch = response["payload"]
+                self._show_email({
+                    "sender": batch["senders"][0],
+                    "destination": batch["destinations"][0],
+                    "subject": batch["subjects"][0],
+                    "date": batch["dates"][0],
+                    "content": batch["contents"][0]
+                })
             else:
                 print(f"Erreur : {response['payload']['error_message']}")
 
         except glosocket.GLOSocketError as e:
-            print(f"Erreur lors de la consultation des courriels : {e}")
+            print(f"Erreur lors de la recherche : {e}")
 
     def _send_email(self) -> None:
         """
         Demande à l'utilisateur respectivement:
-        - l'adresse email du destinataire,
+        - l'adresse email du destinataire, ou plusieurs séparées par des
+          virgules,
         - le sujet du message,
         - le corps du message.
 
         La saisie du corps se termine par un point seul sur une ligne.
 
-        Transmet ces informations avec l'entête `EMAIL_SENDING`.
+        Transmet ces informations avec l'entête `EMAIL_SENDING`, en une
+        seule requête pour tous les destinataires, puis affiche le résultat
+        de l'envoi pour chacun. Un corps de plus de `EMAIL_CHUNK_SIZE`
+        caractères est plutôt transmis en continu au fil de la saisie
+        (entêtes `EMAIL_STREAM_START`, `EMAIL_CHUNK` et `EMAIL_STREAM_END`),
+        sans être conservé en entier.
         """
         try:
-            destination = input("Entrez l'adresse email du destinataire : ").strip()
+            destinations = [destination.strip() for destination in input(
+                "Entrez l'adresse email du destinataire : ").split(",")
+                if destination.strip()]
+            if not destinations:
+                print("Aucun destinataire.")
+                return
             subject = input("Entrez le sujet du courriel : ").strip()
             print("Entrez le contenu du courriel. Terminez avec un '.' seul sur une ligne :")
 
-            content_lines = []
+            payload = {
+                "sender": f"{self._username}@{gloutils.SERVER_DOMAIN}",
+                "destination": ", ".join(destinations),
+                "destinations": destinations,
+                "subject": subject
+            }
+            content = None
+            streaming = False
             while True:
                 line = input()
                 if line == ".":
                     break
-                content_lines.append(line)
-            content = "\n".join(content_lines)
-
-            payload = {
-                "sender": f"{self._username}@{gloutils.SERVER_DOMAIN}",
-                "destination": destination,
-                "subject": subject,
-                "date": gloutils.get_current_utc_time(),
-                "content": content
-            }
-            glosocket.snd_mesg(self._socket, json.dumps({
-                "header": gloutils.Headers.EMAIL_SENDING,
-                "payload": payload
-            }))
-
-            response = json.loads(glosocket.recv_mesg(self._socket))
-            if response["header"] == gloutils.Headers.OK:
-                print("Courriel envoyé avec succès.")
+                content = line if content is None else content + "\n" + line
+                while len(content) > gloutils.EMAIL_CHUNK_SIZE:
+                    if not streaming:
+                        payload["date"] = gloutils.get_current_utc_time()
+                        self._send({
+                            "header": gloutils.Headers.EMAIL_STREAM_START,
+                            "payload": payload
+                        })
+                        streaming = True
+                    self._send({
+                        "header": gloutils.Headers.EMAIL_CHUNK,
+                        "payload": {"data": content[:gloutils.EMAIL_CHUNK_SIZE]}
+                    })
+                    content = content[gloutils.EMAIL_CHUNK_SIZE:]
+
+            if streaming:
+                if content:
+                    self._send({
+                        "header": gloutils.Headers.EMAIL_CHUNK,
+                        "payload": {"data": content}
+                    })
+                response = self._request({"header": gloutils.Headers.EMAIL_STREAM_END},
+                                         retry=False)
             else:
+                payload["date"] = gloutils.get_current_utc_time()
+                payload["content"] = content or ""
+                response = self._request({
+                    "header": gloutils.Headers.EMAIL_SENDING,
+                    "payload": payload
+                }, retry=False)
+            if response["header"] != gloutils.Headers.OK:
                 print(f"Erreur : {response['payload']['error_message']}")
+                return
+
+            for destination, error in zip(destinations, response["payload"]["results"]):
+                if error:
+                    print(f"Erreur ({destination}) : {error}")
+                else:
+                    print(f"Courriel envoyé avec succès à {destination}.")
 
         except glosocket.GLOSocketError as e:
             print(f"Erreur lors de l'envoi du courriel : {e}")
 
+    def _export_emails(self) -> None:
+        """
+        Demande le nom d'un fichier et y exporte tous les courriels de
+        l'utilisateur, un objet JSON par ligne, du plus ancien au plus
+        récent.
+
+        Les courriels sont demandés par lots avec l'entête
+        `INBOX_READING_BATCH`, chaque lot reprenant après le dernier
+        courriel du précédent.
+        """
+        filename = input("Entrez le nom du fichier d'export : ").strip()
+        if not filename:
+            print("Nom de fichier invalide.")
+            return
+        fields = ("seq", "sender", "destination", "subject", "date", "content")
+        try:
+            count = 0
+            with open(filename, 'w', encoding='utf-8') as f:
+                after = 0
+                while True:
+                    response = self._request({
+                        "header": gloutils.Headers.INBOX_READING_BATCH,
+                        "payload": {"after": after}
+                    })
+                    if response["header"] != gloutils.Headers.OK:
+                        print(f"Erreur : {response['payload']['error_message']}")
+                        return
+                    batch = response["payload"]
+                    for values in zip(batch["seqs"], batch["senders"], batch["destinations"],
+                                      batch["subjects"], batch["dates"], batch["contents"]):
+                        f.write(json.dumps(dict(zip(fields, values)), ensure_ascii=False))
+                        f.write("\n")
+                    count += len(batch["seqs"])
+                    if not batch["seqs"] or batch["seqs"][-1] >= batch["last_seq"]:
+                        break
+                    after = batch["seqs"][-1]
+            print(f"{count} courriels exportés dans {filename}.")
+        except OSError as e:
+            print(f"Erreur lors de l'écriture du fichier d'export : {e}")
+        except glosocket.GLOSocketError as e:
+            print(f"Erreur lors de l'export des courriels : {e}")
+
     def _check_stats(self) -> None:
         """
         Demande les statistiques au serveur avec l'entête `STATS_REQUEST`.
@@ -216,16 +646,16 @@ class Client:
         Affiche les statistiques à l'aide du gabarit `STATS_DISPLAY`.
         """
         try:
-            glosocket.snd_mesg(self._socket, json.dumps({
+            response = self._request({
                 "header": gloutils.Headers.STATS_REQUEST
-            }))
-            response = json.loads(glosocket.recv_mesg(self._socket))
+            })
 
             if response["header"] == gloutils.Headers.OK:
                 stats = response["payload"]
                 print(gloutils.STATS_DISPLAY.format(
                     count=stats["count"],
-                    size=stats["size"]
+                    size=stats["size"],
+                    stored_size=stats["stored_size"]
                 ))
             else:
                 print(f"Erreur : {response['payload']['error_message']}")
@@ -235,15 +665,18 @@ class Client:
 
     def _logout(self) -> None:
         """
-        Préviens le serveur avec l'entête `AUTH_LOGOUT`.
+        Préviens le serveur avec l'entête `AUTH_LOGOUT`, qui ferme aussi la
+        session.
 
-        Met à jour l'attribut `_username`.
+        Met à jour les attributs `_username` et `_token`.
         """
         try:
-            glosocket.snd_mesg(self._socket, json.dumps({
+            self._request({
                 "header": gloutils.Headers.AUTH_LOGOUT
-            }))
+            })
             self._username = ""
+            self._token = ""
+            self._clear_inbox()
             print("Déconnexion réussie.")
         except glosocket.GLOSocketError as e:
             print(f"Erreur lors de la déconnexion : {e}")
@@ -267,8 +700,9 @@ class Client:
                     else:
                         print("Choix invalide.")
                 else:
+                    self._check_notifications()
                     print(gloutils.CLIENT_USE_CHOICE)
-                    choice = input("Entrez votre choix [1-4] : ").strip()
+                    choice = input("Entrez votre choix [1-6] : ").strip()
                     if choice == "1":
                         self._read_email()
                     elif choice == "2":
@@ -277,6 +711,10 @@ class Client:
                         self._check_stats()
                     elif choice == "4":
                         self._logout()
+                    elif choice == "5":
+                        self._export_emails()
+                    elif choice == "6":
+                        self._search_emails()
                     else:
                         print("Choix invalide.")
             except KeyboardInterrupt:
@@ -291,8 +729,14 @@ def _main() -> int:
     parser.add_argument("-d", "--destination", action="store",
                         dest="dest", required=True,
                         help="Adresse IP/URL du serveur.")
+    parser.add_argument("-c", "--codec", action="store",
+                        choices=glocodec.CODECS, default=glocodec.BINARY,
+                        help="Encodage des messages proposé au serveur.")
+    parser.add_argument("--no-compression", action="store_false",
+                        dest="compress",
+                        help="Ne propose pas au serveur de compresser les messages.")
     args = parser.parse_args(sys.argv[1:])
-    client = Client(args.dest)
+    client = Client(args.dest, args.codec, args.compress)
     client.run()
     return 0
 
@@ -6,84 +6,458 @@ Noms et numéros étudiants:
 - Maude Beaulieu-Laliberté  537167666
 """
 
+import argparse
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import functools
 import hashlib
 import hmac
+import itertools
 import json
 import os
-import select
+import queue
+import secrets
+import selectors
+import signal
 import socket
 import sys
+import threading
+import time
+import traceback
+import types
 
+import glocodec
 import glosocket
+import glostorage
 import gloutils
-import datetime
 
+try:
+    import fcntl
+except ImportError:  # Windows : pas de mode multiprocessus.
+    fcntl = None
+
+DEFAULT_WORKERS = 4
+DEFAULT_COMMIT_BATCH = 64
+DEFAULT_COMMIT_DELAY = 0.0
+DELIVERY_THREADS = 8
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+METRICS_INTERVAL = 5.0
+SESSION_LIFETIME = 24 * 60 * 60
+PEER_DATAGRAM_SIZE = 256 * 1024
+BATCH_MAX_SIZE = 4 * 1024 * 1024
+SEARCH_INDEX_BATCH = 1000
+MAX_PENDING_REQUESTS = 64  # Au-delà, un client n'est plus lu jusqu'à la fin de son lot.
+_HEADER_FIELDS = ("sender", "destination", "subject", "date")
+_EMAIL_FIELDS = _HEADER_FIELDS + ("content",)
+_NO_RESPONSE = object()  # Réponse des messages qui n'en reçoivent pas (EMAIL_CHUNK).
+
+
+class _UserLock:
+    """
+    Verrou réentrant du dossier d'un utilisateur.
+
+    Il exclut les autres fils du processus et, en mode partagé, les autres
+    processus serveurs grâce à un verrou fcntl.flock sur le fichier
+    LOCK_FILENAME du dossier. Son chemin est donné par la fonction
+    `lock_path`, appelée à chaque acquisition : `glostorage.py shard` peut
+    déplacer le dossier pendant que le serveur tourne.
+    """
+
+    def __init__(self, lock_path) -> None:
+        self._lock = threading.RLock()
+        self._lock_path = lock_path
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self) -> "_UserLock":
+        self._lock.acquire()
+        if self._depth == 0 and self._lock_path is not None:
+            try:
+                self._fd = os.open(self._lock_path(), os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except OSError:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            # Fermer le descripteur libère le verrou fcntl.flock.
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
 
-class Server:
-    """Serveur mail @glo2000.ca."""
 
-    def __init__(self) -> None:
+class _DeliveryWriter:
+    """
+    Étape d'écriture des livraisons, avec validation groupée.
+
+    Les courriels acceptés par `_send_email` sont placés dans une file que
+    vide un fil dédié : il attend au plus `delay` secondes que d'autres
+    arrivent, jusqu'à `batch_size` courriels, puis écrit le lot avec
+    `write`, soit une seule synchronisation du disque (fsync) par dossier
+    et par lot. Chaque livraison n'est confirmée, par le Future retourné
+    par `submit`, qu'une fois son lot synchronisé.
+
+    `write` reçoit aussi un bassin de DELIVERY_THREADS fils pour écrire
+    les dossiers d'un lot en parallèle : les attentes du disque d'un envoi
+    à de nombreux destinataires se recouvrent alors.
+
+    Sans délai, un lot regroupe les courriels arrivés pendant l'écriture du
+    lot précédent : la charge forme elle-même les lots, sans ajouter de
+    latence quand le serveur est peu sollicité.
+    """
+
+    def __init__(self, write, batch_size: int, delay: float) -> None:
+        self._write = write
+        self._batch_size = max(batch_size, 1)
+        self._delay = max(delay, 0.0)
+        self._queue = queue.SimpleQueue()
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=DELIVERY_THREADS, thread_name_prefix="delivery")
+        self._thread = threading.Thread(target=self._run, name="delivery-writer",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, usernames: list[str], email: gloutils.EmailContentPayload
+               ) -> concurrent.futures.Future:
         """
-        Prépare le socket du serveur `_server_socket`
-        et le met en mode écoute.
+        Place un courriel destiné aux dossiers `usernames` dans la file
+        d'écriture et retourne un Future résolu par le dictionnaire des
+        erreurs de livraison de chaque dossier (chaîne vide si livré).
+        """
+        future = concurrent.futures.Future()
+        self._queue.put((usernames, email, future))
+        return future
+
+    def close(self) -> None:
+        """Écrit les livraisons encore en file puis arrête les fils."""
+        self._queue.put(None)
+        self._thread.join()
+        self._pool.shutdown()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self._delay
+            while len(batch) < self._batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch: list) -> None:
+        """Écrit un lot et confirme ses livraisons."""
+        try:
+            results = self._write([(usernames, email) for usernames, email, _ in batch],
+                                  self._pool)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+class _EmailCache:
+    """
+    Cache LRU des courriels décodés, commun à tous les clients.
+
+    La taille d'un courriel est estimée par celle de ses données encodées ;
+    les courriels les moins récemment lus sont évincés dès que le total
+    dépasserait `budget` octets. Un courriel plus gros que le budget n'est
+    jamais conservé. Les courriels retournés sont partagés : ils ne doivent
+    pas être modifiés.
+    """
+
+    def __init__(self, budget: int) -> None:
+        self._budget = budget
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._counters = {"cache_hits": 0, "cache_misses": 0, "cache_evictions": 0}
+        self._lock = threading.Lock()
+
+    def get(self, key) -> dict | None:
+        """Retourne le courriel associé à `key`, ou None s'il est absent."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['cache_misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['cache_hits'] += 1
+            return entry[0]
+
+    def put(self, key, email: dict, size: int) -> None:
+        """Conserve un courriel de `size` octets, en évinçant au besoin."""
+        if size > self._budget:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (email, size)
+            self._size += size
+            while self._size > self._budget:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+                self._counters['cache_evictions'] += 1
+
+    def discard(self, key) -> None:
+        """Retire un courriel qui a changé ou disparu."""
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def stats(self) -> dict:
+        """Retourne les compteurs de succès, d'échecs et d'évictions."""
+        with self._lock:
+            return dict(self._counters)
+
+
+class _EmailUpload:
+    """
+    Courriel en cours de réception en continu (entête EMAIL_STREAM_START) :
+    `payload` est le payload de son début et `writer` l'écriture de son
+    corps dans `_blobs`. Après un échec, `writer` est None et `error` le
+    message d'erreur retourné à la fin de l'envoi (EMAIL_STREAM_END).
+    """
+
+    def __init__(self, payload: gloutils.EmailStreamPayload) -> None:
+        self.payload = payload
+        self.writer = None
+        self.error = ""
+
+    def fail(self, error: str) -> None:
+        """Abandonne le corps reçu ; les morceaux suivants seront ignorés."""
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+        self.error = self.error or error
 
+
+class _MailService:
+    """
+    Traitement des requêtes du serveur mail @glo2000.ca, indépendant de la
+    boucle d'événements qui transporte les messages.
+    """
+
+    def __init__(self, shared: bool = False,
+                 storage: str = glostorage.DEFAULT_STORE,
+                 commit_batch: int = DEFAULT_COMMIT_BATCH,
+                 commit_delay: float = DEFAULT_COMMIT_DELAY,
+                 compress_threshold: int = glostorage.COMPRESS_THRESHOLD,
+                 cache_size: int = DEFAULT_CACHE_SIZE) -> None:
+        """
         Prépare les attributs suivants:
-        - `_client_socs` une liste des sockets clients.
+        - `_shared` vrai lorsque plusieurs processus serveurs partagent le
+            dossier de données. Les dossiers sont alors aussi verrouillés
+            entre processus et les index et compteurs en mémoire sont
+            revalidés contre le disque avant chaque usage.
+        - `_store` le moteur `storage` de glostorage qui conserve les
+            courriels des dossiers, compressés à partir de
+            `compress_threshold` octets (0 : jamais).
+        - `_blobs` le stockage des courriels livrés à plusieurs dossiers,
+            conservés une seule fois (voir `_write_deliveries`).
+        - `_deliveries` l'étape d'écriture des livraisons, qui valide
+            ensemble jusqu'à `commit_batch` courriels arrivés dans un délai
+            de `commit_delay` secondes (voir `_DeliveryWriter`).
+        - `_email_cache` le cache des courriels lus, d'au plus `cache_size`
+            octets (voir `_read_email`).
+        - `_metrics` les métriques du processus (voir `_publish_metrics`).
+        - `_accounts` le registre des comptes, associant chaque nom
+            d'utilisateur à l'empreinte de son mot de passe (voir
+            `_get_account`).
         - `_logged_users` un dictionnaire associant chaque
             socket client à un nom d'utilisateur.
+        - `_sessions` les sessions ouvertes, de la plus ancienne à la plus
+            récente, et `_client_sessions` la session de chaque socket
+            client (voir `_open_session`).
+        - `_client_codecs` un dictionnaire associant chaque socket client
+            à l'encodage négocié avec l'entête HELLO (JSON par défaut).
+        - `_compressed_clients` l'ensemble des sockets clients qui ont
+            accepté la compression des messages avec l'entête HELLO.
+        - `_uploads` un dictionnaire associant chaque socket client au
+            courriel qu'il transmet en continu (voir `_start_upload`).
+        - `_subscribers` un dictionnaire associant chaque nom d'utilisateur
+            aux sockets inscrits aux notifications de son dossier (voir
+            `_subscribe`).
+        - `_peer_socket` en mode partagé, le socket par lequel les autres
+            processus serveurs relaient les notifications (voir `_notify`).
+        - `_mailboxes` un dictionnaire associant chaque nom d'utilisateur
+            à l'index en mémoire de son dossier (voir `_get_mailbox`).
+        - `_counters` un dictionnaire associant chaque nom d'utilisateur
+            aux compteurs de son dossier (voir `_get_counters`).
+        - `_search_indexes` un dictionnaire associant chaque nom
+            d'utilisateur à l'index de recherche de son dossier, chargé à
+            sa première recherche (voir `_get_search_index`).
+        - `_user_locks` un dictionnaire associant chaque nom d'utilisateur
+            au verrou de son dossier (voir `_user_lock`).
 
-        S'assure que les dossiers de données du serveur existent.
+        S'assure que les dossiers de données du serveur existent, charge
+        le registre des comptes et supprime les sessions expirées.
         """
-        # self._server_socket
-        # self._client_socs
-        # self._logged_users
-        # ...
+        self._shared = shared
+        self._store = glostorage.STORES[storage](gloutils.SERVER_DATA_DIR, shared,
+                                                 compress_threshold)
+        self._blobs = glostorage.BlobStore(gloutils.SERVER_DATA_DIR, shared,
+                                           compress_threshold)
+        self._deliveries = _DeliveryWriter(self._write_deliveries, commit_batch,
+                                           commit_delay)
+        self._email_cache = _EmailCache(cache_size)
+        self._metrics = {"accepted": 0, "requests": 0}
+        self._accounts = {}
+        self._logged_users = {}
+        self._sessions = collections.OrderedDict()
+        self._client_sessions = {}
+        self._sessions_guard = threading.Lock()
+        self._client_codecs = {}
+        self._compressed_clients = set()
+        self._uploads = {}
+        self._subscribers = {}
+        self._subscribers_guard = threading.Lock()
+        self._peer_socket = None
+        self._mailboxes = {}
+        self._counters = {}
+        self._search_indexes = {}
+        self._user_locks = {}
+        self._user_locks_guard = threading.Lock()
+
+        os.makedirs(gloutils.SERVER_DATA_DIR, exist_ok=True)
+        lost_dir = os.path.join(gloutils.SERVER_DATA_DIR, gloutils.SERVER_LOST_DIR)
+        os.makedirs(lost_dir, exist_ok=True)
+        workers_dir = os.path.join(gloutils.SERVER_DATA_DIR, gloutils.SERVER_WORKERS_DIR)
+        os.makedirs(workers_dir, exist_ok=True)
+        sessions_dir = os.path.join(gloutils.SERVER_DATA_DIR, gloutils.SERVER_SESSIONS_DIR)
+        os.makedirs(sessions_dir, exist_ok=True)
+        if shared and hasattr(socket, "AF_UNIX"):
+            self._open_peer_socket()
+        self._load_accounts()
+        self._purge_sessions()
+
+    def _publish_metrics(self, connections: int) -> None:
+        """
+        Écrit les métriques du processus dans le fichier `<pid>.json` du
+        dossier SERVER_WORKERS_DIR, où `aggregate_worker_stats` les
+        additionne pour l'ensemble des processus serveurs. Les compteurs du
+        cache des courriels en font partie.
+        """
+        metrics_file = os.path.join(gloutils.SERVER_DATA_DIR,
+                                    gloutils.SERVER_WORKERS_DIR, f"{os.getpid()}.json")
         try:
-            self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self._server_socket.bind(('', gloutils.APP_PORT))
-            self._server_socket.listen()
+            with open(metrics_file + ".tmp", 'w') as f:
+                json.dump(dict(self._metrics, connections=connections,
+                               **self._email_cache.stats()), f)
+            os.replace(metrics_file + ".tmp", metrics_file)
+        except OSError as e:
+            print(f"Erreur lors de la publication des métriques : {e}")
 
-            self._client_socs = []
-            self._logged_users = {}
+    def _unpublish_metrics(self) -> None:
+        """Retire le fichier de métriques du processus."""
+        try:
+            os.remove(os.path.join(gloutils.SERVER_DATA_DIR,
+                                   gloutils.SERVER_WORKERS_DIR, f"{os.getpid()}.json"))
+        except OSError:
+            pass
 
-            os.makedirs(gloutils.SERVER_DATA_DIR, exist_ok=True)
-            lost_dir = os.path.join(gloutils.SERVER_DATA_DIR, gloutils.SERVER_LOST_DIR)
-            os.makedirs(lost_dir, exist_ok=True)
+    def _forget_client(self, client_soc: socket.socket) -> None:
+        """
+        Oublie l'utilisateur, l'encodage, la compression et l'inscription
+        aux notifications associés à un client qui se déconnecte, et
+        abandonne le courriel qu'il transmettait en continu. Sa session
+        reste ouverte : une nouvelle connexion peut la reprendre avec
+        l'entête AUTH_RESUME.
+        """
+        self._abort_upload(client_soc)
+        self._unsubscribe(client_soc)
+        self._logged_users.pop(client_soc, None)
+        self._client_sessions.pop(client_soc, None)
+        self._client_codecs.pop(client_soc, None)
+        self._compressed_clients.discard(client_soc)
 
-            print(f"Serveur démarré sur le port {gloutils.APP_PORT}")
-        except glosocket.GLOSocketError as e:
-            print(f"Erreur lors de l'initialisation du serveur : {e}")
-            sys.exit(1)
+    @staticmethod
+    def _user_file(username: str, filename: str) -> str:
+        """Retourne le chemin d'un fichier du dossier de l'utilisateur."""
+        return os.path.join(glostorage.user_dir(gloutils.SERVER_DATA_DIR, username),
+                            filename)
 
-    def cleanup(self) -> None:
-        """Ferme toutes les connexions résiduelles."""
-        for client_soc in self._client_socs:
-            client_soc.close()
-        self._server_socket.close()
+    def _user_lock(self, username: str) -> _UserLock:
+        """
+        Retourne le verrou du dossier de l'utilisateur.
 
-    def _accept_client(self) -> None:
-        """Accepte un nouveau client."""
-        try:
-            client_soc, client_addr = self._server_socket.accept()
-            self._client_socs.append(client_soc)
-            print(f"Client connecté : {client_addr}")
-        except OSError as e:
-            print(f"Erreur lors de l'acceptation d'un client : {e}")
-            raise glosocket.GLOSocketError("Erreur d'acceptation du client") from e
+        Les requêtes de clients différents sont traitées en parallèle par
+        plusieurs fils, voire plusieurs processus : toute modification de
+        l'index ou des compteurs d'un dossier doit se faire sous ce verrou.
+        """
+        with self._user_locks_guard:
+            lock = self._user_locks.get(username)
+            if lock is None:
+                lock_path = None
+                if self._shared:
+                    lock_path = functools.partial(self._user_file, username,
+                                                  gloutils.LOCK_FILENAME)
+                lock = self._user_locks[username] = _UserLock(lock_path)
+            return lock
 
-    def _remove_client(self, client_soc: socket.socket) -> None:
-        """Retire le client des structures de données et ferme sa connexion."""
+    def _load_accounts(self) -> None:
+        """
+        Remplit le registre des comptes à partir des dossiers utilisateurs.
+        Les connexions et la résolution des destinataires se font ensuite
+        en mémoire, sans accès au disque.
+        """
+        for username in glostorage.list_users(gloutils.SERVER_DATA_DIR):
+            digest = self._read_password(username)
+            if digest is not None:
+                self._accounts[username] = digest
+
+    def _read_password(self, username: str) -> bytes | None:
+        """
+        Lit l'empreinte du mot de passe dans le dossier de l'utilisateur.
+        Retourne None si le compte n'existe pas ou est illisible.
+        """
         try:
-            if client_soc in self._logged_users:
-                del self._logged_users[client_soc]
-            if client_soc in self._client_socs:
-                self._client_socs.remove(client_soc)
-            client_soc.close()
-            print("Client déconnecté et retiré.")
-        except OSError as e:
-            print(f"Erreur lors de la suppression du client : {e}")
-            raise glosocket.GLOSocketError("Erreur lors de la suppression du client") from e
+            with open(self._user_file(username, gloutils.PASSWORD_FILENAME), 'r') as f:
+                stored_password_hash = f.read().strip()
+        except OSError:
+            return None
+        try:
+            return bytes.fromhex(stored_password_hash)
+        except ValueError:
+            # Empreinte corrompue : le compte existe, la connexion échoue.
+            return b""
+
+    def _get_account(self, username: str) -> bytes | None:
+        """
+        Retourne l'empreinte du mot de passe du compte, ou None s'il
+        n'existe pas, à partir du registre `_accounts`.
+
+        En mode partagé, un compte absent du registre a pu être créé par un
+        autre processus : il est alors cherché sur le disque, puis retenu.
+        """
+        digest = self._accounts.get(username)
+        if digest is None and self._shared:
+            digest = self._read_password(username)
+            if digest is not None:
+                self._accounts[username] = digest
+        return digest
 
     def _create_account(self, client_soc: socket.socket,
                         payload: gloutils.AuthPayload
@@ -110,20 +484,34 @@ class Server:
                 payload={"error_message": "Mot de passe non sécurisé."}
             )
 
-        user_dir = os.path.join(gloutils.SERVER_DATA_DIR, username.lower())
-        if os.path.exists(user_dir):
+        user_dir = glostorage.user_dir(gloutils.SERVER_DATA_DIR, username.lower())
+        try:
+            # os.mkdir échoue si le dossier existe : la vérification et la
+            # création forment une seule opération, même entre plusieurs fils.
+            # Seul un compte pas encore réparti est vérifié à part.
+            if os.path.lexists(user_dir):
+                raise FileExistsError(user_dir)
+            os.makedirs(os.path.dirname(user_dir), exist_ok=True)
+            os.mkdir(user_dir)
+        except FileExistsError:
             return gloutils.GloMessage(
                 header=gloutils.Headers.ERROR,
                 payload={"error_message": "Nom d'utilisateur déjà pris."}
             )
+        except OSError as e:
+            print(f"Erreur lors de la création du compte : {e}")
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Erreur système lors de la création du compte."}
+            )
 
         try:
-            os.makedirs(user_dir)
             hashed_password = hashlib.sha3_512(password.encode('utf-8')).hexdigest()
             with open(os.path.join(user_dir, gloutils.PASSWORD_FILENAME), 'w') as f:
                 f.write(hashed_password)
-            self._logged_users[client_soc] = username.lower()
-            return gloutils.GloMessage(header=gloutils.Headers.OK)
+            self._save_counters(username.lower(), {"count": 0, "size": 0, "stored": 0})
+            self._accounts[username.lower()] = bytes.fromhex(hashed_password)
+            return self._open_session(client_soc, username.lower())
         except OSError as e:
             print(f"Erreur lors de la création du compte : {e}")
             return gloutils.GloMessage(
@@ -134,46 +522,148 @@ class Server:
     def _login(self, client_soc: socket.socket, payload: gloutils.AuthPayload
                ) -> gloutils.GloMessage:
         """
-        Vérifie que les données fournies correspondent à un compte existant.
+        Vérifie que les données fournies correspondent à un compte existant
+        du registre des comptes.
 
-        Si les identifiants sont valides, associe le socket à l'utilisateur et
-        retourne un succès, sinon retourne un message d'erreur.
+        Si les identifiants sont valides, ouvre une session pour
+        l'utilisateur et la retourne (voir `_open_session`), sinon retourne
+        un message d'erreur.
         """
         username = payload['username'].lower()
         password = payload['password']
 
-        user_dir = os.path.join(gloutils.SERVER_DATA_DIR, username)
-        password_file = os.path.join(user_dir, gloutils.PASSWORD_FILENAME)
+        stored_password_hash = self._get_account(username)
+        input_password_hash = hashlib.sha3_512(password.encode('utf-8')).digest()
 
-        if not os.path.exists(user_dir) or not os.path.isfile(password_file):
+        if stored_password_hash is None \
+                or not hmac.compare_digest(stored_password_hash, input_password_hash):
             return gloutils.GloMessage(
                 header=gloutils.Headers.ERROR,
                 payload={"error_message": "Nom d'utilisateur ou mot de passe invalide."}
             )
 
+        return self._open_session(client_soc, username)
+
+    def _open_session(self, client_soc: socket.socket,
+                      username: str) -> gloutils.GloMessage:
+        """
+        Associe le socket à l'utilisateur et lui ouvre une session valable
+        SESSION_LIFETIME secondes. Retourne un succès accompagné du jeton
+        de la session (voir SessionPayload).
+
+        Seule l'empreinte SHA-256 du jeton est conservée, en mémoire et dans
+        un fichier du dossier SERVER_SESSIONS_DIR, pour que la session
+        survive à un redémarrage et soit reconnue des autres processus. Le
+        fichier est écrit à côté puis renommé, pour qu'un arrêt brutal ne
+        laisse jamais un fichier à moitié écrit.
+        """
+        token = secrets.token_urlsafe(32)
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        expires = int(time.time()) + SESSION_LIFETIME
+        session_file = self._session_file(key)
         try:
-            with open(password_file, 'r') as f:
-                stored_password_hash = f.read().strip()
-            input_password_hash = hashlib.sha3_512(password.encode('utf-8')).hexdigest()
+            with open(session_file + ".tmp", 'w') as f:
+                json.dump({"username": username, "expires": expires}, f)
+            os.replace(session_file + ".tmp", session_file)
+        except OSError as e:
+            # La connexion reste valide, seule sa reprise sera impossible.
+            print(f"Erreur lors de l'enregistrement de la session : {e}")
+        with self._sessions_guard:
+            self._sessions[key] = (username, expires)
+            # Les sessions ont toutes la même durée : les plus anciennes,
+            # en tête, sont les premières à expirer.
+            now = time.time()
+            while self._sessions:
+                oldest = next(iter(self._sessions.values()))
+                if oldest[1] > now:
+                    break
+                self._sessions.popitem(last=False)
+        self._unsubscribe(client_soc)
+        self._logged_users[client_soc] = username
+        self._client_sessions[client_soc] = key
+        return gloutils.GloMessage(
+            header=gloutils.Headers.OK,
+            payload={"token": token, "expires": expires}
+        )
 
-            if not hmac.compare_digest(stored_password_hash, input_password_hash):
-                return gloutils.GloMessage(
-                    header=gloutils.Headers.ERROR,
-                    payload={"error_message": "Nom d'utilisateur ou mot de passe invalide."}
-                )
+    @staticmethod
+    def _session_file(key: str) -> str:
+        """Retourne le chemin du fichier de la session d'empreinte `key`."""
+        return os.path.join(gloutils.SERVER_DATA_DIR, gloutils.SERVER_SESSIONS_DIR, key)
 
-            self._logged_users[client_soc] = username
-            return gloutils.GloMessage(header=gloutils.Headers.OK)
+    def _get_session(self, key: str) -> str | None:
+        """
+        Retourne l'utilisateur de la session d'empreinte `key`, ou None si
+        elle n'existe pas, a expiré ou a été révoquée.
+
+        Hors mode partagé, la session est cherchée en mémoire, puis sur le
+        disque si le serveur a redémarré depuis son ouverture. En mode
+        partagé, le fichier est toujours relu : un autre processus a pu
+        révoquer la session.
+        """
+        with self._sessions_guard:
+            session = self._sessions.get(key)
+        if session is None or self._shared:
+            try:
+                with open(self._session_file(key), 'r') as f:
+                    stored = json.load(f)
+                session = (str(stored['username']), int(stored['expires']))
+            except (OSError, ValueError, TypeError, KeyError):
+                return None
+        if session[1] <= time.time():
+            self._revoke_session(key)
+            return None
+        return session[0]
 
+    def _revoke_session(self, key: str) -> None:
+        """Ferme la session d'empreinte `key`."""
+        with self._sessions_guard:
+            self._sessions.pop(key, None)
+        try:
+            os.remove(self._session_file(key))
+        except FileNotFoundError:
+            pass
         except OSError as e:
-            print(f"Erreur lors de la connexion : {e}")
+            print(f"Erreur lors de la fermeture de la session : {e}")
+
+    def _purge_sessions(self) -> None:
+        """Supprime les fichiers des sessions expirées."""
+        sessions_dir = os.path.join(gloutils.SERVER_DATA_DIR, gloutils.SERVER_SESSIONS_DIR)
+        now = time.time()
+        for entry in os.scandir(sessions_dir):
+            try:
+                with open(entry.path, 'r') as f:
+                    expired = json.load(f)['expires'] <= now
+            except (OSError, ValueError, TypeError, KeyError):
+                expired = True
+            if expired:
+                self._revoke_session(entry.name)
+
+    def _resume(self, client_soc: socket.socket,
+                payload: gloutils.ResumePayload) -> gloutils.GloMessage:
+        """
+        Rattache le socket à la session dont le client présente le jeton,
+        sans vérifier à nouveau ses identifiants. Retourne un succès, ou un
+        message d'erreur si la session n'est plus valide.
+        """
+        key = hashlib.sha256(payload['token'].encode('utf-8')).hexdigest()
+        username = self._get_session(key)
+        if username is None:
             return gloutils.GloMessage(
                 header=gloutils.Headers.ERROR,
-                payload={"error_message": "Erreur système lors de la connexion."}
+                payload={"error_message": "Session expirée ou invalide."}
             )
+        self._unsubscribe(client_soc)
+        self._logged_users[client_soc] = username
+        self._client_sessions[client_soc] = key
+        return gloutils.GloMessage(header=gloutils.Headers.OK)
 
     def _logout(self, client_soc: socket.socket) -> None:
         try:
+            key = self._client_sessions.pop(client_soc, None)
+            if key is not None:
+                self._revoke_session(key)
+            self._unsubscribe(client_soc)
             if client_soc in self._logged_users:
                 del self._logged_users[client_soc]
                 print(f"Utilisateur déconnecté : {client_soc.getpeername()}")
@@ -181,13 +671,161 @@ class Server:
             print(f"Erreur lors de la déconnexion : {e}")
             raise glosocket.GLOSocketError("Erreur lors de la déconnexion") from e
 
-    def _get_email_list(self, client_soc: socket.socket
+    def _get_mailbox(self, username: str) -> list[dict]:
+        """
+        Retourne l'index en mémoire du dossier de l'utilisateur.
+
+        L'index est construit au premier accès en lisant une seule fois les
+        courriels du dossier, puis maintenu à jour par `_send_email`. Chaque
+        entrée contient l'expéditeur, le sujet, la date, le numéro de
+        séquence du courriel et sa taille. Les entrées sont ordonnées du
+        plus ancien au plus récent.
+
+        En mode partagé, l'index est complété par les courriels livrés par
+        les autres processus dès que les compteurs du dossier en annoncent.
+
+        Lève OSError ou json.JSONDecodeError si le dossier est illisible.
+        """
+        mailbox = self._mailboxes.get(username)
+        if mailbox is not None and not self._shared:
+            return mailbox
+
+        with self._user_lock(username):
+            mailbox = self._mailboxes.get(username)
+            if mailbox is not None and (
+                    not self._shared
+                    or len(mailbox) == self._get_counters(username)['count']):
+                return mailbox
+
+            if mailbox is None:
+                self._store.recover(username)
+            # Seuls les courriels absents de l'index sont lus.
+            mailbox = list(mailbox or [])
+            after = mailbox[-1]['seq'] if mailbox else 0
+            for seq, data in self._store.scan(username, after):
+                email_data = json.loads(data)
+                mailbox.append(self._make_index_entry(
+                    seq, email_data, self._email_size(email_data, data)))
+            self._mailboxes[username] = mailbox
+
+            # Le dossier vient d'être parcouru : on en profite pour corriger
+            # des compteurs qui n'auraient pas suivi (arrêt brutal, ajout manuel).
+            counters = {
+                "count": len(mailbox),
+                "size": sum(entry['size'] for entry in mailbox)
+            }
+            current = self._counters.get(username)
+            if current is None or any(current[key] != counters[key] for key in counters):
+                counters['stored'] = self._store.usage(username)[1]
+                self._save_counters(username, counters)
+            return mailbox
+
+    @staticmethod
+    def _make_index_entry(seq: int,
+                          email_data: gloutils.EmailContentPayload,
+                          size: int) -> dict:
+        """Construit une entrée de l'index d'un dossier."""
+        return {
+            "sender": email_data['sender'],
+            "subject": email_data['subject'],
+            "date": email_data['date'],
+            "seq": seq,
+            "size": size
+        }
+
+    @staticmethod
+    def _email_size(email_data: dict, data: bytes) -> int:
+        """
+        Retourne la taille d'un courriel lu d'un dossier : celle de ses
+        données, ou celle du corps partagé auquel elles font référence.
+        """
+        if glostorage.BLOB_FIELD in email_data:
+            return email_data['size']
+        return len(data)
+
+    def _get_counters(self, username: str) -> dict:
+        """
+        Retourne les compteurs du dossier de l'utilisateur : `count`, le
+        nombre de courriels, `size`, leur taille, et `stored`, la place
+        qu'ils occupent dans le dossier (voir StatsPayload).
+
+        Les compteurs sont lus une seule fois depuis le fichier STATS_FILENAME
+        du dossier, puis gardés en mémoire. S'ils sont absents ou illisibles,
+        ils sont reconstruits par un parcours du dossier. En mode partagé,
+        le fichier est relu à chaque appel, un autre processus ayant pu le
+        modifier.
+
+        Lève OSError si le dossier est illisible.
+        """
+        counters = self._counters.get(username)
+        if counters is not None and not self._shared:
+            return counters
+
+        with self._user_lock(username):
+            counters = self._counters.get(username)
+            if counters is not None and not self._shared:
+                return counters
+
+            try:
+                with open(self._user_file(username, gloutils.STATS_FILENAME), 'r') as f:
+                    stored = json.load(f)
+                counters = {key: int(stored[key]) for key in ("count", "size", "stored")}
+                self._counters[username] = counters
+                return counters
+            except (OSError, ValueError, TypeError, KeyError):
+                return self._reconcile_counters(username)
+
+    def _reconcile_counters(self, username: str) -> dict:
+        """
+        Reconstruit et sauvegarde les compteurs du dossier de l'utilisateur
+        à partir des courriels présents sur le disque.
+        """
+        self._store.recover(username)
+        counters = {"count": 0, "size": 0, "stored": self._store.usage(username)[1]}
+        for _, data in self._store.scan(username):
+            counters['count'] += 1
+            counters['size'] += self._email_size(json.loads(data), data)
+        self._save_counters(username, counters)
+        return counters
+
+    def _update_counters(self, username: str, count: int, size: int,
+                         stored: int) -> None:
+        """
+        Ajoute `count` courriels, `size` octets et `stored` octets sur le
+        disque aux compteurs du dossier de l'utilisateur. Les valeurs
+        négatives correspondent à une suppression.
+        """
+        counters = dict(self._get_counters(username))
+        counters['count'] += count
+        counters['size'] += size
+        counters['stored'] += stored
+        self._save_counters(username, counters)
+
+    def _save_counters(self, username: str, counters: dict) -> None:
+        """
+        Écrit les compteurs dans le fichier STATS_FILENAME du dossier de
+        l'utilisateur, à côté du fichier PASSWORD_FILENAME, et les garde
+        en mémoire. L'écriture passe par un fichier temporaire pour qu'un
+        arrêt brutal ne laisse jamais un fichier à moitié écrit.
+        """
+        stats_file = self._user_file(username, gloutils.STATS_FILENAME)
+        with open(stats_file + ".tmp", 'w') as f:
+            json.dump(counters, f)
+        os.replace(stats_file + ".tmp", stats_file)
+        self._counters[username] = counters
+
+    def _get_email_list(self, client_soc: socket.socket,
+                        payload: gloutils.EmailListRequestPayload
                         ) -> gloutils.GloMessage:
         """
         Récupère la liste des courriels de l'utilisateur associé au socket.
         Les éléments de la liste sont construits à l'aide du gabarit
         SUBJECT_DISPLAY et sont ordonnés du plus récent au plus ancien.
 
+        Seule la fenêtre décrite par `offset` et `limit` est construite,
+        accompagnée du nombre total de courriels. Sans `limit`, tous les
+        courriels à partir de `offset` sont retournés.
+
         Une absence de courriel n'est pas une erreur, mais une liste vide.
         """
         username = self._logged_users.get(client_soc)
@@ -197,42 +835,103 @@ class Server:
                 payload={"error_message": "Utilisateur non connecté."}
             )
 
-        user_dir = os.path.join(gloutils.SERVER_DATA_DIR, username)
-        try:
-            email_files = sorted(
-                [f for f in os.listdir(user_dir) if f.endswith('.json')],
-                reverse=True
+        offset = payload.get('offset', 0)
+        limit = payload.get('limit')
+        if type(offset) is not int or offset < 0 \
+                or (limit is not None and (type(limit) is not int or limit < 0)):
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Fenêtre de consultation invalide."}
             )
+
+        try:
+            mailbox = self._get_mailbox(username)
+            total = len(mailbox)
+            end = max(total - offset, 0)
+            start = 0 if limit is None else max(end - limit, 0)
             email_list = []
-            for i, email_file in enumerate(email_files, start=1):
-                with open(os.path.join(user_dir, email_file), 'r') as f:
-                    email_data = json.load(f)
+            for i, entry in enumerate(reversed(mailbox[start:end]), start=offset + 1):
                 email_list.append(
                     gloutils.SUBJECT_DISPLAY.format(
                         number=i,
-                        sender=email_data['sender'],
-                        subject=email_data['subject'],
-                        date=email_data['date']
+                        sender=entry['sender'],
+                        subject=entry['subject'],
+                        date=entry['date']
                     )
                 )
 
             return gloutils.GloMessage(
                 header=gloutils.Headers.OK,
-                payload={"email_list": email_list}
+                payload={
+                    "email_list": email_list,
+                    "offset": offset,
+                    "total": total
+                }
             )
-        except OSError as e:
+        except (OSError, json.JSONDecodeError) as e:
             print(f"Erreur lors de la récupération de la liste des courriels : {e}")
             return gloutils.GloMessage(
                 header=gloutils.Headers.ERROR,
                 payload={"error_message": "Erreur système lors de la récupération des courriels."}
             )
 
+    def _sync_inbox(self, client_soc: socket.socket,
+                    payload: gloutils.SyncRequestPayload
+                    ) -> gloutils.GloMessage:
+        """
+        Retourne les entêtes des courriels de l'utilisateur associé au
+        socket dont le numéro dépasse `after`, au plus `limit`, ainsi que
+        le numéro du plus récent (voir SyncPayload). Un client qui conserve
+        les entêtes déjà reçus ne transfère ainsi que les nouveaux.
+        """
+        username = self._logged_users.get(client_soc)
+        if not username:
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Utilisateur non connecté."}
+            )
+
+        after = payload.get('after', 0)
+        limit = payload.get('limit')
+        if type(after) is not int or after < 0 \
+                or (limit is not None and (type(limit) is not int or limit < 0)):
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Synchronisation invalide."}
+            )
+
+        try:
+            mailbox = self._get_mailbox(username)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Erreur lors de la synchronisation des courriels : {e}")
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Erreur système lors de la récupération des courriels."}
+            )
+        # L'index est ordonné par numéro croissant.
+        start = bisect.bisect_right(mailbox, after, key=lambda entry: entry['seq'])
+        window = mailbox[start:] if limit is None else mailbox[start:start + limit]
+        return gloutils.GloMessage(
+            header=gloutils.Headers.OK,
+            payload={
+                "seqs": [entry['seq'] for entry in window],
+                "senders": [entry['sender'] for entry in window],
+                "subjects": [entry['subject'] for entry in window],
+                "dates": [entry['date'] for entry in window],
+                "last_seq": mailbox[-1]['seq'] if mailbox else 0
+            }
+        )
+
     def _get_email(self, client_soc: socket.socket,
-                   payload: gloutils.EmailChoicePayload
-                   ) -> gloutils.GloMessage:
+                   payload: gloutils.EmailChoicePayload):
         """
         Récupère le contenu de l'email dans le dossier de l'utilisateur associé
         au socket.
+
+        Avec `stream`, retourne plutôt un itérateur sur les messages de sa
+        transmission en continu (voir `_stream_email`), et avec `raw` son
+        corps tel qu'il est conservé, si c'est possible et que le client a
+        accepté la compression des messages.
         """
         username = self._logged_users.get(client_soc)
         if not username:
@@ -241,35 +940,216 @@ class Server:
                 payload={"error_message": "Utilisateur non connecté."}
             )
 
-        user_dir = os.path.join(gloutils.SERVER_DATA_DIR, username)
         try:
-            email_files = sorted(
-                [f for f in os.listdir(user_dir) if f.endswith('.json')],
-                reverse=True
-            )
+            mailbox = self._get_mailbox(username)
 
             choice = payload.get('choice')
-            if not 1 <= choice <= len(email_files):
+            if type(choice) is not int or not 1 <= choice <= len(mailbox):
                 return gloutils.GloMessage(
                     header=gloutils.Headers.ERROR,
                     payload={"error_message": "Choix invalide."}
                 )
 
-            email_file = email_files[choice - 1]
-            with open(os.path.join(user_dir, email_file), 'r') as f:
-                email_data = json.load(f)
+            seq = mailbox[len(mailbox) - choice]['seq']
+            if payload.get('stream'):
+                raw = bool(payload.get('raw')) and client_soc in self._compressed_clients
+                return self._stream_email(*self._open_email(username, seq, raw))
+            email_data = self._read_email(username, seq)
 
             return gloutils.GloMessage(
                 header=gloutils.Headers.OK,
                 payload=email_data
             )
-        except (OSError, json.JSONDecodeError) as e:
+        except (OSError, ValueError) as e:
             print(f"Erreur lors de la récupération du courriel : {e}")
             return gloutils.GloMessage(
                 header=gloutils.Headers.ERROR,
                 payload={"error_message": "Erreur système lors de la récupération du courriel."}
             )
 
+    def _read_email(self, username: str, seq: int) -> dict:
+        """
+        Retourne le courriel `seq` du dossier de l'utilisateur, lu dans
+        `_email_cache` si possible, sinon sur le disque puis mis en cache.
+
+        Un courriel partagé entre plusieurs dossiers est mis en cache sous
+        l'empreinte de son corps : il n'est lu qu'une fois pour tous ses
+        destinataires (voir `_read_record`).
+
+        Lève OSError ou json.JSONDecodeError si le courriel est illisible.
+        """
+        return self._resolve_blob(self._read_record(username, seq))
+
+    def _read_record(self, username: str, seq: int) -> dict:
+        """
+        Retourne le courriel `seq` tel qu'il est conservé dans le dossier de
+        l'utilisateur, lu dans `_email_cache` si possible, sinon sur le
+        disque puis mis en cache.
+
+        Le courriel d'un dossier qui fait référence à un corps partagé n'est
+        que cette référence : le cache ne conserve sous `(username, seq)`
+        que la référence, dont il compte la taille, et le courriel partagé
+        une seule fois sous son empreinte (voir `_resolve_blob`).
+
+        Lève OSError ou json.JSONDecodeError si le courriel est illisible.
+        """
+        key = (username, seq)
+        email_data = self._email_cache.get(key)
+        if email_data is None:
+            data = self._store.read(username, seq)
+            email_data = json.loads(data)
+            self._email_cache.put(key, email_data, len(data))
+        return email_data
+
+    def _open_email(self, username: str, seq: int, raw: bool = False) -> tuple:
+        """
+        Retourne les champs, sans `content`, du courriel `seq` du dossier de
+        l'utilisateur et un itérateur sur son corps, en morceaux d'au plus
+        EMAIL_CHUNK_SIZE caractères.
+
+        Un corps conservé dans `_blobs` et absent de `_email_cache` est lu
+        au fil de l'itération, sans être chargé en entier ; les autres
+        courriels sont lus par `_read_record`. Avec `raw`, un corps conservé
+        sous forme de messages (voir glostorage.BlobWriter) est plutôt
+        retourné tel quel, en glosocket.FileFrames.
+
+        Lève OSError ou ValueError si le courriel est illisible.
+        """
+        email_data = self._read_record(username, seq)
+        blob = email_data.get(glostorage.BLOB_FIELD)
+        if blob is not None:
+            shared = self._email_cache.get(blob)
+            if shared is None:
+                opened = self._blobs.open_frames(blob) if raw else None
+                return opened or self._blobs.open_email(blob)
+            email_data = shared
+        return ({field: email_data[field] for field in _HEADER_FIELDS},
+                glostorage.text_chunks(email_data['content']))
+
+    @staticmethod
+    def _stream_email(fields: dict, body):
+        """
+        Produit les messages de la transmission en continu d'un courriel :
+        une réponse OK avec ses champs `fields`, un message EMAIL_CHUNK par
+        morceau du corps `body`, puis EMAIL_STREAM_END. Le corps n'est lu
+        qu'au fil de la transmission ; si sa lecture échoue, la transmission
+        se termine par une erreur.
+
+        Un corps déjà sous forme de messages (glosocket.FileFrames) est
+        produit tel quel après la réponse OK, qui l'annonce par `raw`.
+        """
+        if isinstance(body, glosocket.FileFrames):
+            sent = False
+            try:
+                yield gloutils.GloMessage(header=gloutils.Headers.OK,
+                                          payload=dict(fields, raw=True))
+                sent = True
+                yield body
+            finally:
+                if not sent:
+                    body.close()
+            return
+        yield gloutils.GloMessage(header=gloutils.Headers.OK, payload=fields)
+        try:
+            for chunk in body:
+                yield gloutils.GloMessage(header=gloutils.Headers.EMAIL_CHUNK,
+                                          payload=gloutils.ChunkPayload(data=chunk))
+        except (OSError, ValueError) as e:
+            print(f"Erreur lors de la récupération du courriel : {e}")
+            yield gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Erreur système lors de la récupération du courriel."}
+            )
+            return
+        finally:
+            body.close()
+        yield gloutils.GloMessage(header=gloutils.Headers.EMAIL_STREAM_END)
+
+    def _resolve_blob(self, email_data: dict) -> dict:
+        """
+        Retourne le courriel lu d'un dossier, ou le courriel partagé auquel
+        il fait référence, lu dans `_email_cache` si possible.
+
+        Lève OSError ou json.JSONDecodeError si le courriel est illisible.
+        """
+        blob = email_data.get(glostorage.BLOB_FIELD)
+        if blob is None:
+            return email_data
+        shared = self._email_cache.get(blob)
+        if shared is None:
+            shared = glostorage.load_email(self._blobs.read(blob))
+            self._email_cache.put(blob, shared, email_data['size'])
+        return shared
+
+    def _get_emails(self, client_soc: socket.socket,
+                    payload: gloutils.EmailBatchRequestPayload
+                    ) -> gloutils.GloMessage:
+        """
+        Retourne en une seule réponse le contenu de plusieurs courriels de
+        l'utilisateur associé au socket (voir EmailBatchPayload).
+
+        Les courriels qui suivent `after` sont lus en un seul parcours du
+        dossier, sans passer par `_email_cache` qu'un export entier
+        viderait. Ceux de `seqs` y sont cherchés un à un. La réponse
+        s'arrête dès que les champs des courriels retournés dépassent
+        BATCH_MAX_SIZE caractères ; le client demande alors la suite.
+        """
+        username = self._logged_users.get(client_soc)
+        if not username:
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Utilisateur non connecté."}
+            )
+
+        seqs = payload.get('seqs')
+        after = payload.get('after', 0)
+        limit = payload.get('limit')
+        if (seqs is not None and (not isinstance(seqs, list)
+                                  or any(type(seq) is not int for seq in seqs))) \
+                or type(after) is not int or after < 0 \
+                or (limit is not None and (type(limit) is not int or limit < 0)):
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Lot de courriels invalide."}
+            )
+
+        try:
+            mailbox = self._get_mailbox(username)
+            last_seq = mailbox[-1]['seq'] if mailbox else 0
+            if seqs is not None:
+                known = {entry['seq'] for entry in mailbox} if seqs else set()
+                if any(seq not in known for seq in seqs):
+                    return gloutils.GloMessage(
+                        header=gloutils.Headers.ERROR,
+                        payload={"error_message": "Choix invalide."}
+                    )
+                emails = ((seq, self._read_email(username, seq)) for seq in seqs)
+            else:
+                emails = ((seq, self._resolve_blob(json.loads(data)))
+                          for seq, data in self._store.scan(username, after))
+                if limit is not None:
+                    emails = itertools.islice(emails, limit)
+
+            batch = {"seqs": [], "senders": [], "destinations": [], "subjects": [],
+                     "dates": [], "contents": [], "last_seq": last_seq}
+            size = 0
+            for seq, email_data in emails:
+                batch["seqs"].append(seq)
+                for field, name in (("sender", "senders"), ("destination", "destinations"),
+                                    ("subject", "subjects"), ("date", "dates"),
+                                    ("content", "contents")):
+                    batch[name].append(email_data[field])
+                    size += len(email_data[field])
+                if size >= BATCH_MAX_SIZE:
+                    break
+            return gloutils.GloMessage(header=gloutils.Headers.OK, payload=batch)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Erreur lors de la récupération des courriels : {e}")
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Erreur système lors de la récupération des courriels."}
+            )
+
     def _get_stats(self, client_soc: socket.socket) -> gloutils.GloMessage:
         """
         Récupère le nombre de courriels et la taille du dossier et des fichiers
@@ -282,18 +1162,14 @@ class Server:
                 payload={"error_message": "Utilisateur non connecté."}
             )
 
-        user_dir = os.path.join(gloutils.SERVER_DATA_DIR, username)
         try:
-            email_files = [f for f in os.listdir(user_dir) if f.endswith('.json')]
-            total_size = sum(
-                os.path.getsize(os.path.join(user_dir, f)) for f in email_files
-            )
-
+            counters = self._get_counters(username)
             return gloutils.GloMessage(
                 header=gloutils.Headers.OK,
                 payload={
-                    "count": len(email_files),
-                    "size": total_size
+                    "count": counters['count'],
+                    "size": counters['size'],
+                    "stored_size": counters['stored']
                 }
             )
         except OSError as e:
@@ -303,106 +1179,1138 @@ class Server:
                 payload={"error_message": "Erreur système lors de la récupération des statistiques."}
             )
 
-    def _send_email(self, payload: gloutils.EmailContentPayload
-                    ) -> gloutils.GloMessage:
+    def _send_email(self, payload: gloutils.EmailSendingPayload,
+                    body: glostorage.BlobWriter | None = None
+                    ) -> gloutils.GloMessage | concurrent.futures.Future:
         """
-        Détermine si l'envoi est interne ou externe et:
-        - Si l'envoi est interne, écris le message tel quel dans le dossier
-        du destinataire.
+        Livre le courriel à chacun de ses destinataires, ceux de la liste
+        `destinations` si elle est présente, sinon `destination`. Pour
+        chacun, détermine si l'envoi est interne ou externe et:
+        - Si l'envoi est interne, confie le message à l'étape d'écriture
+        `_deliveries`, une seule fois pour tous les destinataires internes.
         - Si le destinataire n'existe pas, place le message dans le dossier
         SERVER_LOST_DIR et considère l'envoi comme un échec.
         - Si le destinataire est externe, considère l'envoi comme un échec.
 
-        Retourne un messange indiquant le succès ou l'échec de l'opération.
+        Sans `destinations`, retourne un messange indiquant le succès ou
+        l'échec de l'opération ; avec, retourne un succès accompagné de
+        l'erreur de chaque destinataire (voir DeliveryReportPayload). S'il y
+        a des livraisons internes, la réponse est un Future résolu une fois
+        le courriel écrit et synchronisé sur le disque.
+
+        Le corps d'un courriel reçu en continu est déjà écrit par `body`
+        (voir `_start_upload`) et `payload` n'a pas de `content` : le corps
+        est conservé une seule fois dans `_blobs` et les dossiers n'en
+        reçoivent que la référence, comme pour un courriel partagé.
         """
-        destination = payload['destination']
-        if not destination.endswith(f"@{gloutils.SERVER_DOMAIN}"):
+        email = {field: payload[field]
+                 for field in (_EMAIL_FIELDS if body is None else _HEADER_FIELDS)}
+        destinations = payload.get('destinations')
+        multiple = destinations is not None
+        if not multiple:
+            destinations = [payload['destination']]
+        elif not isinstance(destinations, list) or not destinations \
+                or not all(isinstance(d, str) for d in destinations):
+            if body is not None:
+                body.abort()
             return gloutils.GloMessage(
                 header=gloutils.Headers.ERROR,
-                payload={"error_message": "Destinataire externe non autorisé."}
+                payload={"error_message": "Liste de destinataires invalide."}
             )
 
-        username = destination.split('@')[0].lower()
-        user_dir = os.path.join(gloutils.SERVER_DATA_DIR, username)
+        errors = {}
+        recipients = {}
+        lost = []
+        for destination in dict.fromkeys(destinations):
+            if not destination.endswith(f"@{gloutils.SERVER_DOMAIN}"):
+                errors[destination] = "Destinataire externe non autorisé."
+                continue
+            username = destination.split('@')[0].lower()
+            if self._get_account(username) is not None:
+                recipients[destination] = username
+            else:
+                lost.append(destination)
+        usernames = list(dict.fromkeys(recipients.values()))
 
-        try:
-            if os.path.exists(user_dir):
-                email_filename = os.path.join(
-                    user_dir, f"email_{int(datetime.datetime.now().timestamp())}.json"
-                )
-                with open(email_filename, 'w') as f:
-                    json.dump(payload, f)
-                return gloutils.GloMessage(header=gloutils.Headers.OK)
+        if body is not None:
+            if not usernames and not lost:
+                body.abort()
             else:
+                # Une référence de plus est retenue le temps de la copie
+                # dans SERVER_LOST_DIR.
+                try:
+                    key = body.commit(len(usernames) + bool(lost), sync=True)
+                    email.update({glostorage.BLOB_FIELD: key, "size": body.size})
+                except OSError as e:
+                    print(f"Erreur lors de l'envoi du courriel : {e}")
+                    errors.update(dict.fromkeys(
+                        [*recipients, *lost], "Erreur système lors de l'envoi du courriel."))
+                    recipients.clear()
+                    usernames.clear()
+                    lost.clear()
+
+        if lost:
+            try:
                 lost_dir = os.path.join(gloutils.SERVER_DATA_DIR, gloutils.SERVER_LOST_DIR)
-                email_filename = os.path.join(
-                    lost_dir, f"lost_email_{int(datetime.datetime.now().timestamp())}.json"
+                glostorage.write_unique_file(lost_dir, "lost_email",
+                                             json.dumps(email).encode('utf-8') if body is None
+                                             else self._lost_email_data(email))
+                error = "Destinataire introuvable. Courriel perdu."
+            except (OSError, ValueError) as e:
+                print(f"Erreur lors de l'envoi du courriel : {e}")
+                error = "Erreur système lors de l'envoi du courriel."
+            errors.update(dict.fromkeys(lost, error))
+            if body is not None:
+                try:
+                    self._blobs.release([email[glostorage.BLOB_FIELD]])
+                except OSError as e:
+                    print(f"Erreur lors de la libération d'un courriel partagé : {e}")
+
+        def report(failures: dict) -> gloutils.GloMessage:
+            results = [errors[destination] if destination in errors
+                       else failures[recipients[destination]]
+                       for destination in destinations]
+            if multiple:
+                return gloutils.GloMessage(
+                    header=gloutils.Headers.OK,
+                    payload=gloutils.DeliveryReportPayload(results=results)
                 )
-                with open(email_filename, 'w') as f:
-                    json.dump(payload, f)
+            if results[0]:
                 return gloutils.GloMessage(
                     header=gloutils.Headers.ERROR,
-                    payload={"error_message": "Destinataire introuvable. Courriel perdu."}
+                    payload={"error_message": results[0]}
                 )
+            return gloutils.GloMessage(header=gloutils.Headers.OK)
+
+        if not recipients:
+            return report({})
+        return _chain(self._deliveries.submit(usernames, email), report)
+
+    def _lost_email_data(self, email: dict):
+        """
+        Produit par morceaux les données, au format JSON des autres courriels
+        perdus, d'un courriel reçu en continu, dont le corps est lu dans
+        `_blobs` sans être chargé en entier.
+        """
+        fields, body = self._blobs.open_email(email[glostorage.BLOB_FIELD])
+        # Les caractères d'une chaîne JSON sont échappés un à un : le corps
+        # peut l'être morceau par morceau.
+        yield json.dumps(fields)[:-1].encode('utf-8') + b', "content": "'
+        for chunk in body:
+            yield json.dumps(chunk)[1:-1].encode('utf-8')
+        yield b'"}'
+
+    def _start_upload(self, client_soc: socket.socket,
+                      payload: gloutils.EmailStreamPayload) -> None:
+        """
+        Commence la réception en continu d'un courriel (voir
+        EmailStreamPayload) : son corps, transmis ensuite avec l'entête
+        EMAIL_CHUNK, est écrit dans `_blobs` au fil des morceaux, si bien
+        que la mémoire occupée ne dépend pas de sa taille. Un envoi
+        précédent inachevé est abandonné.
+
+        Ne retourne rien : une erreur n'est signalée qu'en réponse à
+        EMAIL_STREAM_END, le client transmettant tout le courriel sans
+        attendre.
+        """
+        self._abort_upload(client_soc)
+        upload = self._uploads[client_soc] = _EmailUpload(payload)
+        fields = {field: payload.get(field) for field in _HEADER_FIELDS}
+        if not all(isinstance(value, str) for value in fields.values()):
+            upload.fail("Requête invalide.")
+            return
+        try:
+            upload.writer = self._blobs.writer(fields)
         except OSError as e:
             print(f"Erreur lors de l'envoi du courriel : {e}")
-            return gloutils.GloMessage(
-                header=gloutils.Headers.ERROR,
-                payload={"error_message": "Erreur système lors de l'envoi du courriel."}
-            )
+            upload.fail("Erreur système lors de l'envoi du courriel.")
+
+    def _receive_chunk(self, client_soc: socket.socket,
+                       payload: gloutils.ChunkPayload) -> None:
+        """Ajoute un morceau au corps du courriel reçu en continu du client."""
+        upload = self._uploads.get(client_soc)
+        if upload is None or upload.writer is None:
+            return
+        data = payload.get('data')
+        if not isinstance(data, str) or len(data) > gloutils.EMAIL_CHUNK_SIZE:
+            upload.fail("Requête invalide.")
+            return
+        try:
+            upload.writer.write(data.encode('utf-8'))
+        except (OSError, ValueError) as e:
+            print(f"Erreur lors de l'envoi du courriel : {e}")
+            upload.fail("Erreur système lors de l'envoi du courriel.")
+
+    def _finish_upload(self, client_soc: socket.socket
+                       ) -> gloutils.GloMessage | concurrent.futures.Future:
+        """
+        Termine la réception en continu du courriel du client et le livre
+        avec `_send_email`, dont la réponse est retournée.
+        """
+        upload = self._uploads.pop(client_soc, None)
+        if upload is None:
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Aucun envoi en cours."}
+            )
+        if upload.writer is None:
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": upload.error}
+            )
+        return self._send_email(upload.payload, upload.writer)
+
+    def _abort_upload(self, client_soc: socket.socket) -> None:
+        """Abandonne le courriel que le client transmettait en continu."""
+        upload = self._uploads.pop(client_soc, None)
+        if upload is not None:
+            upload.fail("")
+
+    def _write_deliveries(self, deliveries: list[tuple[list[str], dict]],
+                          executor: concurrent.futures.Executor) -> list[dict]:
+        """
+        Écrit un lot de livraisons (dossiers destinataires, courriel), un
+        dossier par tâche confiée à `executor`, et retourne, pour chacune,
+        le dictionnaire des erreurs de chaque dossier (chaîne vide si le
+        courriel y est livré). Appelée par l'étape d'écriture `_deliveries`.
+
+        L'échec de l'écriture d'un dossier n'est reporté qu'à ses propres
+        livraisons.
+
+        Un courriel livré à plusieurs dossiers est conservé une seule fois
+        dans `_blobs` et chaque dossier n'en reçoit que l'empreinte ; les
+        références des dossiers dont l'écriture échoue sont libérées. Les
+        courriels plus petits que BLOB_THRESHOLD sont copiés dans chaque
+        dossier, une référence coûtant alors autant qu'une copie. Un
+        courriel reçu en continu n'est déjà qu'une référence à son corps.
+
+        Les termes de recherche de chaque courriel sont extraits une seule
+        fois, pour tous ses dossiers (voir `_index_search`).
+        """
+        datas = [json.dumps(email).encode('utf-8') for _, email in deliveries]
+        records = list(datas)
+        keys = {i: email[glostorage.BLOB_FIELD] for i, (_, email) in enumerate(deliveries)
+                if glostorage.BLOB_FIELD in email}
+        sizes = [email['size'] if i in keys else len(datas[i])
+                 for i, (_, email) in enumerate(deliveries)]
+        shared = [i for i, (usernames, _) in enumerate(deliveries)
+                  if len(usernames) > 1 and i not in keys
+                  and len(datas[i]) >= glostorage.BLOB_THRESHOLD]
+        if shared:
+            created = {}
+            try:
+                blobs = [(datas[i], len(deliveries[i][0])) for i in shared]
+                created = dict(zip(shared, self._blobs.put(blobs, sync=True)))
+            except OSError as e:
+                # Les courriels sont alors copiés dans chaque dossier.
+                print(f"Erreur lors de l'écriture d'un courriel partagé : {e}")
+            for i, key in created.items():
+                email = deliveries[i][1]
+                records[i] = json.dumps({
+                    "sender": email['sender'],
+                    "subject": email['subject'],
+                    "date": email['date'],
+                    glostorage.BLOB_FIELD: key,
+                    "size": len(datas[i])
+                }).encode('utf-8')
+            keys.update(created)
+        terms = []
+        for _, email in deliveries:
+            try:
+                terms.append(self._email_terms(email))
+            except (OSError, ValueError) as e:
+                # Le courriel sera indexé à la prochaine recherche.
+                print(f"Erreur lors de l'indexation d'un courriel : {e}")
+                terms.append(None)
+
+        mailboxes = {}
+        for i, (usernames, _) in enumerate(deliveries):
+            for username in usernames:
+                mailboxes.setdefault(username, []).append(i)
+
+        def write(username: str, items: list[int]) -> str:
+            # Toute erreur est propre au dossier (compteurs ou journal
+            # corrompus, par exemple) : elle ne doit pas faire échouer les
+            # livraisons du lot aux autres dossiers.
+            try:
+                self._deliver(username, [(records[i], deliveries[i][1], sizes[i], terms[i])
+                                         for i in items])
+                return ""
+            except Exception as e:
+                print(f"Erreur lors de l'envoi du courriel : {e!r}")
+                return "Erreur système lors de l'envoi du courriel."
+
+        failures = [{} for _ in deliveries]
+        released = []
+        errors = executor.map(write, mailboxes.keys(), mailboxes.values())
+        for (username, items), error in zip(mailboxes.items(), errors):
+            for i in items:
+                failures[i][username] = error
+            if error:
+                released.extend(keys[i] for i in items if i in keys)
+        if released:
+            try:
+                self._blobs.release(released)
+            except OSError as e:
+                print(f"Erreur lors de la libération d'un courriel partagé : {e}")
+        return failures
+
+    def _deliver(self, username: str,
+                 emails: list[tuple[bytes, dict, int, set | None]]) -> None:
+        """
+        Ajoute les courriels (données à écrire, courriel, taille, termes de
+        recherche) au dossier de l'utilisateur en une seule écriture
+        synchronisée sur le disque, puis met à jour les index et les
+        compteurs.
+
+        Lève OSError si l'écriture échoue.
+        """
+        with self._user_lock(username):
+            # Les compteurs doivent être chargés avant l'écriture, sinon
+            # une reconstruction compterait deux fois les nouveaux courriels.
+            self._get_counters(username)
+            appended = self._store.append(username, [data for data, _, _, _ in emails],
+                                          sync=True)
+            for (seq, _), (_, email, size, _) in zip(appended, emails):
+                # Un numéro peut être réattribué après l'échec d'une écriture.
+                self._email_cache.discard((username, seq))
+                self._index_delivery(username, seq, email, size)
+            self._update_counters(username, len(emails),
+                                  sum(size for _, _, size, _ in emails),
+                                  sum(stored for _, stored in appended))
+            self._index_search(username, [(seq, email['date'], terms)
+                                          for (seq, _), (_, email, _, terms)
+                                          in zip(appended, emails) if terms is not None])
+        self._notify(username, [
+            gloutils.NotificationPayload(seq=seq, sender=email['sender'],
+                                         subject=email['subject'], date=email['date'])
+            for (seq, _), (_, email, _, _) in zip(appended, emails)])
+
+    def _index_delivery(self, username: str, seq: int,
+                        payload: gloutils.EmailContentPayload,
+                        size: int) -> None:
+        """
+        Ajoute un courriel livré à l'index du destinataire, si celui-ci
+        est déjà chargé et à jour. En mode partagé, un index en retard sur
+        les livraisons des autres processus est complété par `_get_mailbox`.
+        """
+        mailbox = self._mailboxes.get(username)
+        if mailbox is not None and (mailbox[-1]['seq'] if mailbox else 0) == seq - 1:
+            mailbox.append(self._make_index_entry(seq, payload, size))
+
+    def _index_search(self, username: str, emails: list[tuple[int, str, set]]) -> None:
+        """
+        Ajoute les courriels livrés (numéro, date, termes) à l'index de
+        recherche de l'utilisateur : à son journal, et à l'index en mémoire
+        s'il est chargé. Doit être appelée sous le verrou du dossier.
+
+        Un échec n'empêche pas la livraison : `_get_search_index` indexera
+        les courriels manquants à la prochaine recherche.
+        """
+        if not emails:
+            return
+        try:
+            index = self._search_indexes.get(username)
+            if index is not None:
+                index.add(emails)
+            else:
+                glostorage.SearchIndex.append(
+                    self._user_file(username, gloutils.SEARCH_FILENAME), emails)
+        except OSError as e:
+            print(f"Erreur lors de l'indexation d'un courriel : {e}")
+
+    def _email_terms(self, email_data: dict) -> set[str]:
+        """
+        Retourne les termes de recherche d'un courriel (voir
+        glostorage.email_terms). Le corps conservé dans `_blobs` auquel il
+        fait référence est lu par morceaux, sans être chargé en entier.
+
+        Lève OSError ou ValueError si ce corps est illisible.
+        """
+        blob = email_data.get(glostorage.BLOB_FIELD)
+        if blob is None:
+            return glostorage.email_terms(email_data)
+        fields, body = self._blobs.open_email(blob)
+        return glostorage.email_terms(fields, body)
+
+    def _get_search_index(self, username: str) -> glostorage.SearchIndex:
+        """
+        Retourne l'index de recherche du dossier de l'utilisateur, chargé
+        depuis son journal au premier accès. Doit être appelée sous le
+        verrou du dossier.
+
+        En mode partagé, l'index est complété par les courriels indexés par
+        les autres processus. Les courriels du dossier qui manquent encore à
+        l'index (dossier antérieur à l'index, écriture interrompue) sont lus
+        en un seul parcours et indexés.
+
+        Lève OSError ou ValueError si le dossier est illisible.
+        """
+        index = self._search_indexes.get(username)
+        if index is None or self._shared:
+            if index is None:
+                index = glostorage.SearchIndex(
+                    self._user_file(username, gloutils.SEARCH_FILENAME))
+            index.refresh()
+            self._search_indexes[username] = index
+        mailbox = self._get_mailbox(username)
+        if len(index) < len(mailbox):
+            missing = {entry['seq'] for entry in mailbox if entry['seq'] not in index}
+            emails = ((seq, json.loads(data))
+                      for seq, data in self._store.scan(username, min(missing) - 1)
+                      if seq in missing)
+            entries = ((seq, email_data['date'], self._email_terms(email_data))
+                       for seq, email_data in emails)
+            while batch := list(itertools.islice(entries, SEARCH_INDEX_BATCH)):
+                index.add(batch)
+        return index
+
+    def _search(self, client_soc: socket.socket,
+                payload: gloutils.SearchRequestPayload) -> gloutils.GloMessage:
+        """
+        Recherche les mots de `query` dans les courriels de l'utilisateur
+        associé au socket et retourne les numéros de ceux qui les contiennent
+        tous, du plus récent au plus ancien, dans la fenêtre décrite par
+        `offset` et `limit` (voir SearchPayload).
+        """
+        username = self._logged_users.get(client_soc)
+        if not username:
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Utilisateur non connecté."}
+            )
+
+        query = payload['query']
+        offset = payload.get('offset', 0)
+        limit = payload.get('limit')
+        if not isinstance(query, str) or type(offset) is not int or offset < 0 \
+                or (limit is not None and (type(limit) is not int or limit < 0)):
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Recherche invalide."}
+            )
+
+        try:
+            with self._user_lock(username):
+                seqs, total = self._get_search_index(username).search(query, offset, limit)
+        except (OSError, ValueError) as e:
+            print(f"Erreur lors de la recherche : {e}")
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Erreur système lors de la recherche."}
+            )
+        return gloutils.GloMessage(
+            header=gloutils.Headers.OK,
+            payload={"seqs": seqs, "total": total}
+        )
+
+    def _subscribe(self, client_soc: socket.socket) -> gloutils.GloMessage:
+        """
+        Inscrit le socket aux notifications du dossier de son utilisateur :
+        chaque courriel qui y est ensuite livré lui est poussé avec l'entête
+        NEW_EMAIL (voir NotificationPayload), ce qui dispense le client de
+        redemander la liste de ses courriels. L'inscription prend fin à la
+        déconnexion du socket ou de l'utilisateur.
+        """
+        username = self._logged_users.get(client_soc)
+        if not username:
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Utilisateur non connecté."}
+            )
+        with self._subscribers_guard:
+            self._subscribers.setdefault(username, set()).add(client_soc)
+        return gloutils.GloMessage(header=gloutils.Headers.OK)
+
+    def _unsubscribe(self, client_soc: socket.socket) -> None:
+        """Retire le socket des notifications du dossier de son utilisateur."""
+        username = self._logged_users.get(client_soc)
+        with self._subscribers_guard:
+            subscribers = self._subscribers.get(username)
+            if subscribers is not None:
+                subscribers.discard(client_soc)
+                if not subscribers:
+                    del self._subscribers[username]
+
+    def _notify(self, username: str,
+                notifications: list[gloutils.NotificationPayload],
+                relay: bool = True) -> None:
+        """
+        Pousse les notifications de courriels livrés au dossier de
+        l'utilisateur à chacun de ses sockets inscrits, avec l'encodage et
+        la compression négociés par chacun. Peut être appelée depuis
+        n'importe quel fil.
+
+        En mode partagé, les notifications sont aussi relayées aux autres
+        processus serveurs, qui les poussent à leurs propres sockets
+        inscrits, sauf si `relay` est faux. Le relais est sans garantie :
+        un processus arrêté ou débordé perd la notification, et son client
+        la rattrapera à sa prochaine consultation.
+        """
+        with self._subscribers_guard:
+            subscribers = list(self._subscribers.get(username, ()))
+        for client_soc in subscribers:
+            codec = self._client_codecs.get(client_soc, glocodec.JSON)
+            compress = client_soc in self._compressed_clients
+            for notification in notifications:
+                self._push(client_soc, self._encode_response(
+                    {}, codec, compress,
+                    gloutils.GloMessage(header=gloutils.Headers.NEW_EMAIL,
+                                        payload=notification)))
+        if relay and self._peer_socket is not None:
+            self._relay(username, notifications)
+
+    def _push(self, client_soc: socket.socket, data: bytes) -> None:
+        """
+        Transmet au client un message encodé qu'il n'a pas demandé. Fournie
+        par la boucle d'événements ; peut être appelée depuis n'importe quel
+        fil.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _peer_socket_path(pid: int) -> str:
+        """Retourne le chemin du socket de relais du processus `pid`."""
+        return os.path.join(gloutils.SERVER_DATA_DIR, gloutils.SERVER_WORKERS_DIR,
+                            f"{pid}.sock")
+
+    def _open_peer_socket(self) -> None:
+        """
+        Ouvre le socket de datagrammes `<pid>.sock` du dossier
+        SERVER_WORKERS_DIR, par lequel ce processus reçoit les notifications
+        relayées par les autres processus serveurs.
+        """
+        path = self._peer_socket_path(os.getpid())
+        try:
+            if os.path.lexists(path):
+                os.remove(path)
+            peer_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            peer_socket.bind(path)
+            peer_socket.setblocking(False)
+            self._peer_socket = peer_socket
+        except OSError as e:
+            print(f"Erreur lors de l'ouverture du relais des notifications : {e}")
+
+    def _close_peer_socket(self) -> None:
+        """Ferme le socket de relais des notifications et retire son fichier."""
+        if self._peer_socket is None:
+            return
+        self._peer_socket.close()
+        try:
+            os.remove(self._peer_socket_path(os.getpid()))
+        except OSError:
+            pass
+
+    def _relay(self, username: str,
+               notifications: list[gloutils.NotificationPayload]) -> None:
+        """
+        Envoie les notifications, en un seul datagramme, aux sockets de
+        relais des autres processus serveurs.
+        """
+        datagram = json.dumps({"username": username,
+                               "notifications": notifications}).encode('utf-8')
+        workers_dir = os.path.join(gloutils.SERVER_DATA_DIR, gloutils.SERVER_WORKERS_DIR)
+        own = f"{os.getpid()}.sock"
+        try:
+            names = os.listdir(workers_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".sock") and name != own:
+                try:
+                    self._peer_socket.sendto(datagram, os.path.join(workers_dir, name))
+                except OSError:
+                    # Processus arrêté, tampon plein ou datagramme trop grand.
+                    pass
+
+    def _receive_notifications(self) -> None:
+        """
+        Pousse aux sockets inscrits les notifications relayées par les autres
+        processus serveurs. Appelée par la boucle d'événements lorsque le
+        socket de relais est prêt en lecture.
+        """
+        while True:
+            try:
+                datagram = self._peer_socket.recv(PEER_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"Erreur lors de la réception d'une notification : {e}")
+                return
+            try:
+                relayed = json.loads(datagram)
+                self._notify(relayed['username'], relayed['notifications'], relay=False)
+            except (ValueError, TypeError, KeyError) as e:
+                print(f"Notification relayée invalide : {e!r}")
+
+    def _negotiate(self, client_soc: socket.socket,
+                   payload: gloutils.CodecPayload) -> gloutils.GloMessage:
+        """
+        Retient l'encodage préféré parmi ceux proposés par le client, ainsi
+        que la compression des messages s'il la propose, et les lui indique.
+        La réponse est transmise avec l'encodage et sans la compression
+        précédents ; les nouveaux s'appliquent dès le message suivant.
+
+        `codecs` et `compressions` doivent être des listes de chaînes : une
+        chaîne seule serait sinon comparée par sous-chaîne.
+        """
+        offers = (payload.get("codecs"), payload.get("compressions", []))
+        if not all(isinstance(offer, list) and all(isinstance(name, str) for name in offer)
+                   for offer in offers):
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Requête invalide."}
+            )
+        codec = glocodec.choose(payload["codecs"])
+        self._client_codecs[client_soc] = codec
+        response = gloutils.CodecPayload(codec=codec)
+        if glosocket.COMPRESSION in payload.get("compressions", []):
+            self._compressed_clients.add(client_soc)
+            response["compression"] = glosocket.COMPRESSION
+        return gloutils.GloMessage(
+            header=gloutils.Headers.OK,
+            payload=response
+        )
+
+    def _process_frame(self, client_soc: socket.socket, data: bytes):
+        """
+        Décode un message reçu du client avec l'encodage négocié, le traite
+        et retourne la réponse encodée, compressée si le client l'accepte,
+        ou None si le client doit être retiré (`BYE` ou message
+        indécodable), ou `_NO_RESPONSE`. Peut être appelée depuis
+        n'importe quel fil.
+
+        Les messages sont reçus sans être décompressés (voir
+        glosocket.decompress_mesg) : un message compressé n'est accepté que
+        d'un client qui a négocié la compression, et sa taille décompressée
+        est bornée.
+
+        Une transmission en continu (voir `_stream_email`) est retournée
+        sous la forme d'un générateur de réponses encodées, que la boucle
+        d'événements consomme au rythme où le client les reçoit. Un corps
+        conservé sous forme de messages y figure tel quel, en
+        glosocket.FileFrames.
+        """
+        codec = self._client_codecs.get(client_soc, glocodec.JSON)
+        compress = client_soc in self._compressed_clients
+        if isinstance(data, glosocket.CompressedMesg):
+            if not compress:
+                print("Message compressé d'un client qui ne l'a pas négocié.")
+                return None
+            try:
+                data = glosocket.decompress_mesg(data)
+            except glosocket.GLOSocketError as e:
+                print(f"Erreur de format du message : {e}")
+                return None
+        try:
+            message_data = glocodec.decode(data, codec)
+        except glocodec.CodecError as e:
+            print(f"Erreur de format du message : {e}")
+            return None
+        try:
+            response = self._process_request(client_soc, message_data)
+        except Exception as e:
+            print(f"Erreur lors du traitement d'une requête : {e!r}")
+            response = gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Erreur interne du serveur."}
+            )
+        if response is None or response is _NO_RESPONSE:
+            return response
+        if isinstance(response, types.GeneratorType):
+            return (message if isinstance(message, glosocket.FileFrames)
+                    else self._encode_response(message_data, codec, compress, message)
+                    for message in response)
+        if isinstance(response, concurrent.futures.Future):
+            # Livraison en attente de sa validation groupée : la réponse
+            # est encodée à sa confirmation.
+            return _chain(response, functools.partial(
+                self._encode_response, message_data, codec, compress))
+        return self._encode_response(message_data, codec, compress, response)
+
+    @staticmethod
+    def _encode_response(message_data: dict, codec: str, compress: bool,
+                         response: gloutils.GloMessage) -> bytes:
+        """
+        Encode la réponse à un message, avec son `request_id` s'il y a lieu,
+        et la compresse si `compress` est vrai.
+        """
+        if "request_id" in message_data:
+            response = dict(response, request_id=message_data["request_id"])
+        data = glocodec.encode(response, codec)
+        return glosocket.compress_mesg(data) if compress else data
+
+    def _process_batch(self, client_soc: socket.socket, frames: list[bytes]) -> list:
+        """
+        Traite dans l'ordre les messages reçus d'un client et retourne leurs
+        réponses encodées (voir `_process_frame`), sans les messages qui
+        n'en reçoivent pas. Le traitement s'arrête au premier message qui
+        entraîne le retrait du client, dont la réponse est None.
+
+        Les livraisons du lot sont toutes confiées à l'étape d'écriture
+        avant d'attendre leur confirmation, pour être validées ensemble.
+        """
+        responses = []
+        for data in frames:
+            response = self._process_frame(client_soc, data)
+            if response is _NO_RESPONSE:
+                continue
+            responses.append(response)
+            if response is None:
+                break
+        return [response.result() if isinstance(response, concurrent.futures.Future)
+                else response for response in responses]
+
+    def _process_request(self, client_soc: socket.socket,
+                         message_data: dict) -> gloutils.GloMessage | None:
+        """
+        Appelle `_handle_message` en transformant un payload mal formé en
+        message d'erreur plutôt qu'en exception. Peut être appelée depuis
+        n'importe quel fil.
+        """
+        try:
+            return self._handle_message(client_soc, message_data)
+        except (KeyError, TypeError, AttributeError, ValueError) as e:
+            print(f"Requête mal formée : {e!r}")
+            return gloutils.GloMessage(
+                header=gloutils.Headers.ERROR,
+                payload={"error_message": "Requête invalide."}
+            )
+
+    def _handle_message(self, client_soc: socket.socket,
+                        message_data: dict) -> gloutils.GloMessage | None:
+        """
+        Traite un message reçu du client et retourne la réponse à lui
+        transmettre, ou None si le client annonce sa déconnexion (`BYE`).
+        Les messages d'un envoi en continu, sauf le dernier, ne reçoivent
+        pas de réponse (`_NO_RESPONSE`).
+        """
+        header = message_data.get("header")
+        payload = message_data.get("payload", {})
+
+        if header == gloutils.Headers.AUTH_REGISTER:
+            return self._create_account(client_soc, payload)
+        if header == gloutils.Headers.AUTH_LOGIN:
+            return self._login(client_soc, payload)
+        if header == gloutils.Headers.AUTH_RESUME:
+            return self._resume(client_soc, payload)
+        if header == gloutils.Headers.AUTH_LOGOUT:
+            self._logout(client_soc)
+            return gloutils.GloMessage(header=gloutils.Headers.OK)
+        if header == gloutils.Headers.INBOX_READING_REQUEST:
+            return self._get_email_list(client_soc, payload)
+        if header == gloutils.Headers.INBOX_SYNC:
+            return self._sync_inbox(client_soc, payload)
+        if header == gloutils.Headers.INBOX_READING_CHOICE:
+            return self._get_email(client_soc, payload)
+        if header == gloutils.Headers.INBOX_READING_BATCH:
+            return self._get_emails(client_soc, payload)
+        if header == gloutils.Headers.EMAIL_SENDING:
+            return self._send_email(payload)
+        if header == gloutils.Headers.EMAIL_STREAM_START:
+            self._start_upload(client_soc, payload)
+            return _NO_RESPONSE
+        if header == gloutils.Headers.EMAIL_CHUNK:
+            self._receive_chunk(client_soc, payload)
+            return _NO_RESPONSE
+        if header == gloutils.Headers.EMAIL_STREAM_END:
+            return self._finish_upload(client_soc)
+        if header == gloutils.Headers.SEARCH:
+            return self._search(client_soc, payload)
+        if header == gloutils.Headers.STATS_REQUEST:
+            return self._get_stats(client_soc)
+        if header == gloutils.Headers.HELLO:
+            return self._negotiate(client_soc, payload)
+        if header == gloutils.Headers.SUBSCRIBE:
+            return self._subscribe(client_soc)
+        if header == gloutils.Headers.BYE:
+            return None
+        return gloutils.GloMessage(
+            header=gloutils.Headers.ERROR,
+            payload={"error_message": "Requête invalide."}
+        )
+
+
+class Server(_MailService):
+    """Serveur mail @glo2000.ca."""
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, shared: bool = False,
+                 **options) -> None:
+        """
+        Prépare le socket du serveur `_server_socket`
+        et le met en mode écoute. En mode partagé, le port est ouvert avec
+        SO_REUSEPORT et le noyau répartit les connexions entre les processus.
+
+        Prépare les attributs suivants:
+        - `_client_socs` l'ensemble des sockets clients.
+        - `_selector` le sélecteur (epoll/kqueue selon la plateforme) auprès
+            duquel le socket serveur et les sockets clients sont inscrits
+            une fois pour toutes.
+        - `_readers` et `_writers` des dictionnaires associant chaque socket
+            client à son décodeur de messages et à son tampon d'envoi.
+        - `_outboxes` un dictionnaire associant chaque socket client qui
+            reçoit une transmission en continu aux réponses et aux messages
+            poussés qui attendent leur tour derrière elle (voir `_respond`).
+        - `_executor` le bassin de `workers` fils auquel le traitement des
+            requêtes est confié, ou None pour les traiter dans la boucle.
+        - `_requests` un dictionnaire associant chaque socket client à la
+            file de ses requêtes en attente de traitement, et `_busy`
+            l'ensemble des clients dont un lot de requêtes est en cours de
+            traitement : un seul à la fois par client, pour préserver
+            l'ordre des réponses.
+        - `_paused` l'ensemble des clients qui ne sont plus lus, parce
+            qu'ils ont MAX_PENDING_REQUESTS requêtes en attente (voir
+            `_read_client`), et `_closing` celui des clients qui ont envoyé
+            `BYE` et ne sont plus lus en attendant d'être retirés (voir
+            `_respond`).
+        - `_completed` la file des traitements terminés, que la boucle
+            récupère lorsque les fils l'en avertissent par `_wakeup_w`.
+        - `_pushes` la file des messages à pousser aux clients (voir
+            `_push`), récupérée de la même façon.
+
+        Les attributs communs sont préparés par `_MailService`, qui reçoit
+        les autres `options` (stockage, validation groupée).
+        """
+        # self._server_socket
+        # self._client_socs
+        # self._logged_users
+        # ...
+        super().__init__(shared, **options)
+        try:
+            self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if shared:
+                self._server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self._server_socket.bind(('', gloutils.APP_PORT))
+            self._server_socket.listen(socket.SOMAXCONN)
+            _raise_open_files_limit()
+
+            self._client_socs = set()
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self._server_socket, selectors.EVENT_READ)
+            self._readers = {}
+            self._writers = {}
+            self._outboxes = {}
+
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers) if workers > 0 else None
+            self._requests = {}
+            self._busy = set()
+            self._paused = set()
+            self._closing = set()
+            self._completed = queue.SimpleQueue()
+            self._pushes = queue.SimpleQueue()
+            self._wakeup_r, self._wakeup_w = socket.socketpair()
+            self._wakeup_r.setblocking(False)
+            self._wakeup_w.setblocking(False)
+            self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+            if self._peer_socket is not None:
+                self._selector.register(self._peer_socket, selectors.EVENT_READ)
+
+            print(f"Serveur démarré sur le port {gloutils.APP_PORT}")
+        except glosocket.GLOSocketError as e:
+            print(f"Erreur lors de l'initialisation du serveur : {e}")
+            sys.exit(1)
+
+    def cleanup(self) -> None:
+        """Ferme toutes les connexions résiduelles."""
+        for client_soc in self._client_socs:
+            client_soc.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self._deliveries.close()
+        self._selector.close()
+        self._unpublish_metrics()
+        self._close_peer_socket()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+        self._server_socket.close()
+
+    def _accept_client(self) -> None:
+        """Accepte un nouveau client."""
+        try:
+            client_soc, client_addr = self._server_socket.accept()
+            client_soc.setblocking(False)
+            # Les réponses d'un lot partent en plusieurs envois : sans
+            # TCP_NODELAY, l'algorithme de Nagle retarderait les suivants.
+            client_soc.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._client_socs.add(client_soc)
+            self._selector.register(client_soc, selectors.EVENT_READ)
+            self._readers[client_soc] = glosocket.MessageReader(client_soc, decompress=False)
+            self._writers[client_soc] = glosocket.MessageWriter(client_soc)
+            self._requests[client_soc] = collections.deque()
+            self._metrics['accepted'] += 1
+            print(f"Client connecté : {client_addr}")
+        except OSError as e:
+            print(f"Erreur lors de l'acceptation d'un client : {e}")
+            raise glosocket.GLOSocketError("Erreur d'acceptation du client") from e
+
+    def _remove_client(self, client_soc: socket.socket) -> None:
+        """Retire le client des structures de données et ferme sa connexion."""
+        try:
+            self._forget_client(client_soc)
+            if client_soc in self._client_socs:
+                self._client_socs.discard(client_soc)
+                if client_soc in self._selector.get_map():
+                    self._selector.unregister(client_soc)
+            self._paused.discard(client_soc)
+            self._closing.discard(client_soc)
+            self._readers.pop(client_soc, None)
+            writer = self._writers.pop(client_soc, None)
+            if writer is not None:
+                writer.close()
+            self._requests.pop(client_soc, None)
+            for response in self._outboxes.pop(client_soc, ()):
+                if isinstance(response, types.GeneratorType):
+                    response.close()
+            client_soc.close()
+            print("Client déconnecté et retiré.")
+        except OSError as e:
+            print(f"Erreur lors de la suppression du client : {e}")
+            raise glosocket.GLOSocketError("Erreur lors de la suppression du client") from e
+
+    def _read_client(self, client_soc: socket.socket) -> None:
+        """
+        Lit les octets disponibles sur le socket client, place chaque message
+        complet, encore encodé, dans la file de ses requêtes et en lance le
+        traitement.
+
+        Un client dont MAX_PENDING_REQUESTS requêtes attendent déjà n'est
+        plus lu jusqu'à la fin du lot en cours : ses messages restent dans
+        les tampons du noyau, qui le ralentit, plutôt qu'en mémoire (par
+        exemple les morceaux d'un courriel transmis en continu plus vite
+        qu'ils ne sont écrits).
+        """
+        try:
+            self._requests[client_soc].extend(self._readers[client_soc].read())
+            self._dispatch(client_soc)
+            if len(self._requests[client_soc]) >= MAX_PENDING_REQUESTS:
+                self._paused.add(client_soc)
+                self._watch(client_soc)
+        except glosocket.GLOSocketError as e:
+            print(f"Erreur de communication avec un client : {e}")
+            self._remove_client(client_soc)
+
+    def _dispatch(self, client_soc: socket.socket) -> None:
+        """
+        Lance en un seul lot le traitement de toutes les requêtes en attente
+        du client, sauf si un autre lot est déjà en cours. Sans bassin de
+        fils, les requêtes sont traitées directement dans la boucle.
+        """
+        if not self._requests.get(client_soc) or client_soc in self._busy:
+            return
+        frames = list(self._requests[client_soc])
+        self._requests[client_soc].clear()
+        self._metrics['requests'] += len(frames)
+        if self._executor is None:
+            self._respond(client_soc, self._process_batch(client_soc, frames))
+        else:
+            self._busy.add(client_soc)
+            future = self._executor.submit(self._process_batch, client_soc, frames)
+            future.add_done_callback(
+                functools.partial(self._on_request_done, client_soc))
+
+    def _on_request_done(self, client_soc: socket.socket,
+                         future: concurrent.futures.Future) -> None:
+        """
+        Appelée dans le fil ayant traité un lot de requêtes : transmet le
+        résultat à la boucle et la réveille. Les réponses ne sont jamais
+        écrites depuis ce fil, les sockets clients appartenant à la boucle.
+        """
+        self._completed.put((client_soc, future))
+        self._wake()
+
+    def _push(self, client_soc: socket.socket, data: bytes) -> None:
+        """
+        Confie à la boucle un message à pousser au client et la réveille,
+        pour la même raison que `_on_request_done`.
+        """
+        self._pushes.put((client_soc, data))
+        self._wake()
+
+    def _wake(self) -> None:
+        """Réveille la boucle pour qu'elle appelle `_collect_completed`."""
+        try:
+            self._wakeup_w.send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            # Le tampon est plein : la boucle a déjà un réveil en attente.
+            pass
+
+    def _collect_completed(self) -> None:
+        """
+        Transmet aux clients les messages poussés, puis les réponses des
+        traitements terminés.
+
+        Un message poussé à un client qui reçoit une transmission en continu
+        attend la fin de celle-ci : il ne doit pas s'intercaler entre les
+        messages d'un corps transmis tel qu'il est conservé.
+        """
+        try:
+            while self._wakeup_r.recv(glosocket.CHUNK_SIZE):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        pushed = set()
+        while not self._pushes.empty():
+            client_soc, data = self._pushes.get()
+            if client_soc in self._outboxes:
+                self._outboxes[client_soc].append(data)
+            elif client_soc in self._writers:
+                self._writers[client_soc].queue_bytes(data)
+                pushed.add(client_soc)
+        for client_soc in pushed:
+            if client_soc in self._writers:
+                self._write_client(client_soc)
+        while not self._completed.empty():
+            client_soc, future = self._completed.get()
+            self._busy.discard(client_soc)
+            try:
+                responses = future.result()
+            except Exception as e:
+                print(f"Erreur lors du traitement d'une requête : {e!r}")
+                responses = [None]
+            self._respond(client_soc, responses)
+            self._dispatch(client_soc)
+            if client_soc in self._paused and client_soc in self._writers \
+                    and len(self._requests[client_soc]) < MAX_PENDING_REQUESTS:
+                self._paused.discard(client_soc)
+                self._watch(client_soc)
+
+    def _respond(self, client_soc: socket.socket, responses: list) -> None:
+        """
+        Place les réponses encodées dans le tampon d'envoi du client et le
+        vide autant que possible.
+
+        À la première réponse None (`BYE`), le client n'est plus lu et ses
+        requêtes en attente sont abandonnées ; il est retiré par
+        `_flush_client` une fois les réponses qui précèdent transmises,
+        même si son tampon d'envoi est plein.
+
+        Une transmission en continu n'est pas placée d'un bloc dans le
+        tampon : elle est mise, avec les réponses qui la suivent, dans la
+        file `_outboxes` du client, que `_flush_client` vide à mesure que
+        le client reçoit. Le tampon ne contient ainsi jamais plus d'un
+        morceau de la transmission.
+        """
+        if client_soc not in self._writers:
+            # Le client est parti pendant le traitement de ses requêtes.
+            self._forget_client(client_soc)
+            for response in responses:
+                if isinstance(response, types.GeneratorType):
+                    response.close()
+            return
+        for response in responses:
+            if response is None:
+                self._outboxes.setdefault(client_soc, collections.deque()).append(None)
+                self._requests[client_soc].clear()
+                self._closing.add(client_soc)
+                break
+            if client_soc in self._outboxes or isinstance(response, types.GeneratorType):
+                self._outboxes.setdefault(client_soc, collections.deque()).append(response)
+                continue
+            self._writers[client_soc].queue_bytes(response)
+        try:
+            self._flush_client(client_soc)
+        except glosocket.GLOSocketError as e:
+            print(f"Erreur de communication avec un client : {e}")
+            self._remove_client(client_soc)
+
+    def _flush_client(self, client_soc: socket.socket) -> None:
+        """
+        Vide autant que possible le tampon d'envoi du client, en le
+        complétant au fur et à mesure avec sa file `_outboxes`, puis ajuste
+        son inscription au sélecteur (voir `_watch`).
+
+        Les morceaux d'une transmission en continu sont lus dans la boucle,
+        un à la fois, lorsque le tampon est vide ; un corps conservé sous
+        forme de messages est transmis du fichier au socket.
+        """
+        writer = self._writers[client_soc]
+        outbox = self._outboxes.get(client_soc)
+        flushed = writer.flush()
+        while flushed and outbox:
+            response = outbox[0]
+            if response is None:
+                self._remove_client(client_soc)
+                return
+            if isinstance(response, bytes):
+                outbox.popleft()
+            else:
+                try:
+                    response = next(response, None)
+                except Exception as e:
+                    print(f"Erreur lors d'une transmission en continu : {e!r}")
+                    self._remove_client(client_soc)
+                    return
+                if response is None:
+                    outbox.popleft()
+                    continue
+            if isinstance(response, glosocket.FileFrames):
+                writer.queue_file(response)
+            else:
+                writer.queue_bytes(response)
+            flushed = writer.flush()
+        if outbox is not None and not outbox:
+            del self._outboxes[client_soc]
+        self._watch(client_soc)
+
+    def _watch(self, client_soc: socket.socket) -> None:
+        """
+        Ajuste l'inscription du client au sélecteur : il est surveillé en
+        lecture sauf s'il est suspendu (`_paused`) ou sur le départ
+        (`_closing`), et en écriture tant qu'il reste des octets à lui
+        transmettre.
+        """
+        events = (0 if client_soc in self._paused or client_soc in self._closing
+                  else selectors.EVENT_READ)
+        if self._writers[client_soc].pending:
+            events |= selectors.EVENT_WRITE
+        key = self._selector.get_map().get(client_soc)
+        if key is None:
+            if events:
+                self._selector.register(client_soc, events)
+        elif not events:
+            self._selector.unregister(client_soc)
+        elif key.events != events:
+            self._selector.modify(client_soc, events)
+
+    def _write_client(self, client_soc: socket.socket) -> None:
+        """Transmet la suite du tampon d'envoi d'un client prêt en écriture."""
+        try:
+            self._flush_client(client_soc)
+        except glosocket.GLOSocketError as e:
+            print(f"Erreur de communication avec un client : {e}")
+            self._remove_client(client_soc)
 
     def run(self):
         """Point d'entrée du serveur."""
         try:
             print("Le serveur est prêt à accepter des connexions.")
+            next_publish = time.monotonic()
             while True:
-                readable, _, _ = select.select(
-                    [self._server_socket] + self._client_socs, [], []
-                )
-
-                for soc in readable:
+                if time.monotonic() >= next_publish:
+                    self._publish_metrics(len(self._client_socs))
+                    next_publish = time.monotonic() + METRICS_INTERVAL
+                for key, events in self._selector.select(METRICS_INTERVAL):
+                    soc = key.fileobj
                     if soc is self._server_socket:
-                        self._accept_client()
-                    else:
+                        # Une erreur d'acceptation (ex. trop de descripteurs
+                        # ouverts) ne doit pas arrêter le serveur.
                         try:
-                            message = glosocket.recv_mesg(soc)
-                            message_data = json.loads(message)
-
-                            header = message_data.get("header")
-                            payload = message_data.get("payload", {})
-
-                            if header == gloutils.Headers.AUTH_REGISTER:
-                                response = self._create_account(soc, payload)
-                            elif header == gloutils.Headers.AUTH_LOGIN:
-                                response = self._login(soc, payload)
-                            elif header == gloutils.Headers.AUTH_LOGOUT:
-                                self._logout(soc)
-                                response = gloutils.GloMessage(header=gloutils.Headers.OK)
-                            elif header == gloutils.Headers.INBOX_READING_REQUEST:
-                                response = self._get_email_list(soc)
-                            elif header == gloutils.Headers.INBOX_READING_CHOICE:
-                                response = self._get_email(soc, payload)
-                            elif header == gloutils.Headers.EMAIL_SENDING:
-                                response = self._send_email(payload)
-                            elif header == gloutils.Headers.STATS_REQUEST:
-                                response = self._get_stats(soc)
-                            elif header == gloutils.Headers.BYE:
-                                self._remove_client(soc)
-                                continue
-                            else:
-                                response = gloutils.GloMessage(
-                                    header=gloutils.Headers.ERROR,
-                                    payload={"error_message": "Requête invalide."}
-                                )
-
-                            glosocket.snd_mesg(soc, json.dumps(response))
-
-                        except glosocket.GLOSocketError as e:
-                            print(f"Erreur de communication avec un client : {e}")
-                            self._remove_client(soc)
-                        except json.JSONDecodeError as e:
-                            print(f"Erreur de format JSON : {e}")
-                            self._remove_client(soc)
+                            self._accept_client()
+                        except glosocket.GLOSocketError:
+                            pass
+                        continue
+                    if soc is self._wakeup_r:
+                        self._collect_completed()
+                        continue
+                    if soc is self._peer_socket:
+                        self._receive_notifications()
+                        continue
+                    if events & selectors.EVENT_WRITE and soc in self._writers:
+                        self._write_client(soc)
+                    if events & selectors.EVENT_READ and soc in self._readers:
+                        self._read_client(soc)
 
         except KeyboardInterrupt:
             print("\nArrêt du serveur demandé.")
@@ -410,8 +2318,395 @@ class Server:
             self.cleanup()
 
 
+class AsyncServer(_MailService):
+    """
+    Serveur mail @glo2000.ca basé sur les flux asyncio.
+
+    Chaque connexion est traitée par sa propre coroutine et le traitement
+    des requêtes, qui accède au disque, est confié à un bassin de fils
+    pour ne jamais bloquer la boucle d'événements. Le protocole
+    (entêtes, payloads et cadrage de glosocket) est celui de `Server`.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, shared: bool = False,
+                 **options) -> None:
+        """
+        Prépare les attributs suivants:
+        - `_client_socs` un dictionnaire associant chaque socket client au
+            flux d'écriture de sa connexion.
+        - `_executor` le bassin de `workers` fils auquel le traitement des
+            requêtes est confié. Chaque coroutine attend les réponses d'un
+            lot de requêtes avant de traiter le suivant, ce qui préserve
+            l'ordre.
+        - `_loop` la boucle d'événements, une fois lancée, à laquelle les
+            autres fils confient les messages à pousser (voir `_push`).
+        - `_deferred_pushes` un dictionnaire associant chaque socket client
+            qui reçoit une transmission en continu aux messages poussés qui
+            attendent sa fin (voir `_send_responses`).
+
+        Les attributs communs sont préparés par `_MailService`, qui reçoit
+        les autres `options` (stockage, validation groupée).
+        """
+        super().__init__(shared, **options)
+        self._client_socs = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(workers, 1))
+        self._loop = None
+        self._deferred_pushes = {}
+
+    @staticmethod
+    async def _receive_frames(reader: asyncio.StreamReader,
+                              inbox: asyncio.Queue) -> None:
+        """
+        Place dans `inbox` les messages reçus du client, puis None lorsque
+        la connexion est fermée. Lorsque `inbox` est pleine, le client n'est
+        plus lu jusqu'à ce que ses requêtes soient traitées.
+        """
+        try:
+            while True:
+                await inbox.put(await glosocket.async_recv_mesg_bytes(
+                    reader, decompress=False))
+        except glosocket.GLOSocketError as e:
+            print(f"Erreur de communication avec un client : {e}")
+        await inbox.put(None)
+
+    async def _handle_client(self, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter) -> None:
+        """
+        Coroutine servant un client jusqu'à sa déconnexion.
+
+        Les messages sont reçus par une tâche distincte, si bien que ceux
+        qui arrivent pendant un traitement sont ensuite traités en un seul
+        lot, et leurs réponses transmises ensemble.
+        """
+        client_soc = writer.get_extra_info('socket')
+        self._client_socs[client_soc] = writer
+        self._metrics['accepted'] += 1
+        print(f"Client connecté : {writer.get_extra_info('peername')}")
+        loop = asyncio.get_running_loop()
+        inbox = asyncio.Queue(MAX_PENDING_REQUESTS)
+        receiver = asyncio.create_task(self._receive_frames(reader, inbox))
+        try:
+            closed = False
+            while not closed:
+                frames = [await inbox.get()]
+                while not inbox.empty():
+                    frames.append(inbox.get_nowait())
+                closed = frames[-1] is None
+                if closed:
+                    frames.pop()
+                if not frames:
+                    break
+                self._metrics['requests'] += len(frames)
+                responses = await loop.run_in_executor(
+                    self._executor, self._process_batch, client_soc, frames)
+                if responses and responses[-1] is None:
+                    responses.pop()
+                    closed = True
+                await self._send_responses(writer, responses)
+        except glosocket.GLOSocketError as e:
+            print(f"Erreur de communication avec un client : {e}")
+        finally:
+            receiver.cancel()
+            self._forget_client(client_soc)
+            del self._client_socs[client_soc]
+            writer.close()
+            print("Client déconnecté et retiré.")
+
+    async def _send_responses(self, writer: asyncio.StreamWriter,
+                              responses: list) -> None:
+        """
+        Transmet les réponses encodées d'un lot, en un seul envoi pour
+        celles qui se suivent. Les morceaux d'une transmission en continu
+        sont lus dans le bassin de fils, un à la fois, chacun une fois le
+        précédent transmis ; un corps conservé sous forme de messages est
+        transmis du fichier au socket. Les messages poussés au client
+        pendant la transmission attendent sa fin.
+        """
+        loop = asyncio.get_running_loop()
+        client_soc = writer.get_extra_info('socket')
+        pending = []
+        for response in responses:
+            if isinstance(response, bytes):
+                pending.append(response)
+                continue
+            await glosocket.async_snd_mesgs_bytes(writer, pending)
+            pending = []
+            self._deferred_pushes[client_soc] = []
+            try:
+                while (data := await loop.run_in_executor(
+                        self._executor, next, response, None)) is not None:
+                    if isinstance(data, glosocket.FileFrames):
+                        await glosocket.async_snd_file(writer, data)
+                    else:
+                        await glosocket.async_snd_mesgs_bytes(writer, [data])
+            finally:
+                response.close()
+                pending = self._deferred_pushes.pop(client_soc)
+        await glosocket.async_snd_mesgs_bytes(writer, pending)
+
+    def _push(self, client_soc: socket.socket, data: bytes) -> None:
+        """
+        Confie à la boucle l'écriture d'un message à pousser au client, les
+        flux n'étant pas utilisables depuis les autres fils.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._write_push, client_soc, data)
+
+    def _write_push(self, client_soc: socket.socket, data: bytes) -> None:
+        """
+        Ajoute le message poussé au flux d'écriture du client, sans attendre
+        qu'il soit transmis : la coroutine du client attend de toute façon
+        la vidange du flux avant chacune de ses réponses. Pendant une
+        transmission en continu, le message attend plutôt sa fin.
+        """
+        deferred = self._deferred_pushes.get(client_soc)
+        if deferred is not None:
+            deferred.append(data)
+            return
+        writer = self._client_socs.get(client_soc)
+        if writer is not None and not writer.is_closing():
+            glosocket.write_mesg_bytes(writer, data)
+
+    async def _serve(self) -> None:
+        """
+        Accepte les clients jusqu'à l'annulation de la tâche, qui est aussi
+        déclenchée par SIGTERM.
+        """
+        self._loop = asyncio.get_running_loop()
+        try:
+            self._loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass
+        if self._peer_socket is not None:
+            self._loop.add_reader(self._peer_socket, self._receive_notifications)
+        server = await asyncio.start_server(
+            self._handle_client, '', gloutils.APP_PORT,
+            reuse_address=True, reuse_port=self._shared or None,
+            backlog=socket.SOMAXCONN)
+        print(f"Serveur démarré sur le port {gloutils.APP_PORT}")
+        print("Le serveur est prêt à accepter des connexions.")
+        publisher = asyncio.create_task(self._publish_metrics_forever())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            publisher.cancel()
+            # Arrêt gracieux : plus de nouveaux clients, puis fermeture des
+            # connexions en cours une fois leurs réponses transmises.
+            for writer in list(self._client_socs.values()):
+                writer.close()
+            await asyncio.gather(
+                *(writer.wait_closed() for writer in list(self._client_socs.values())),
+                return_exceptions=True)
+
+    async def _publish_metrics_forever(self) -> None:
+        """Publie les métriques du processus toutes les METRICS_INTERVAL secondes."""
+        while True:
+            self._publish_metrics(len(self._client_socs))
+            await asyncio.sleep(METRICS_INTERVAL)
+
+    def cleanup(self) -> None:
+        """
+        Libère le bassin de fils de traitement des requêtes et termine les
+        livraisons en cours.
+        """
+        self._executor.shutdown(wait=True)
+        self._deliveries.close()
+        self._unpublish_metrics()
+        self._close_peer_socket()
+
+    def run(self) -> None:
+        """Point d'entrée du serveur."""
+        _raise_open_files_limit()
+        try:
+            asyncio.run(self._serve())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            print("\nArrêt du serveur demandé.")
+        finally:
+            self.cleanup()
+
+
+def _chain(future: concurrent.futures.Future, func) -> concurrent.futures.Future:
+    """Retourne un Future résolu par `func` appliquée au résultat de `future`."""
+    chained = concurrent.futures.Future()
+
+    def resolve(done: concurrent.futures.Future) -> None:
+        try:
+            chained.set_result(func(done.result()))
+        except Exception as e:
+            chained.set_exception(e)
+
+    future.add_done_callback(resolve)
+    return chained
+
+
+def _raise_open_files_limit() -> None:
+    """
+    Relève la limite souple de descripteurs de fichiers du processus à sa
+    limite dure, chaque client connecté consommant un descripteur.
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def aggregate_worker_stats() -> dict:
+    """
+    Additionne les métriques publiées par les processus serveurs en cours
+    d'exécution dans le dossier SERVER_WORKERS_DIR.
+    """
+    workers_dir = os.path.join(gloutils.SERVER_DATA_DIR, gloutils.SERVER_WORKERS_DIR)
+    keys = ("connections", "accepted", "requests",
+            "cache_hits", "cache_misses", "cache_evictions")
+    totals = dict.fromkeys(keys, 0)
+    totals['workers'] = 0
+    try:
+        metrics_files = [f for f in os.listdir(workers_dir) if f.endswith('.json')]
+    except FileNotFoundError:
+        return totals
+    for metrics_file in metrics_files:
+        try:
+            with open(os.path.join(workers_dir, metrics_file), 'r') as f:
+                metrics = json.load(f)
+        except (OSError, ValueError):
+            continue
+        totals['workers'] += 1
+        for key in keys:
+            totals[key] += metrics.get(key, 0)
+    return totals
+
+
+def _make_server(engine: str, workers: int, shared: bool = False,
+                 **options) -> _MailService:
+    """Construit le serveur du moteur demandé."""
+    if engine == "asyncio":
+        return AsyncServer(workers, shared, **options)
+    return Server(workers, shared, **options)
+
+
+def _run_worker(engine: str, workers: int, options: dict) -> None:
+    """Corps d'un processus serveur lancé par `_supervise`. Ne retourne pas."""
+    status = 1
+    try:
+        _make_server(engine, workers, True, **options).run()
+        status = 0
+    except Exception:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        os._exit(status)
+
+
+def _supervise(processes: int, engine: str, workers: int, options: dict) -> int:
+    """
+    Lance `processes` processus serveurs partageant APP_PORT grâce à
+    SO_REUSEPORT, puis relance ceux qui s'arrêtent anormalement jusqu'à
+    l'arrêt du superviseur (Ctrl-C ou SIGTERM).
+    """
+    if not hasattr(os, "fork") or not hasattr(socket, "SO_REUSEPORT") or fcntl is None:
+        print("Le mode multiprocessus n'est pas disponible sur ce système.")
+        return 1
+
+    def spawn() -> int:
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(engine, workers, options)
+        return pid
+
+    def stop(signum, frame) -> None:
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    children = {spawn() for _ in range(processes)}
+    print(f"Superviseur : {processes} processus serveurs lancés.")
+    try:
+        while children:
+            pid, status = os.wait()
+            children.discard(pid)
+            for leftover in (f"{pid}.json", f"{pid}.sock"):
+                try:
+                    os.remove(os.path.join(gloutils.SERVER_DATA_DIR,
+                                           gloutils.SERVER_WORKERS_DIR, leftover))
+                except OSError:
+                    pass
+            if os.waitstatus_to_exitcode(status) != 0:
+                print(f"Processus {pid} arrêté anormalement, relance.")
+                time.sleep(1)
+                children.add(spawn())
+    except KeyboardInterrupt:
+        print("\nArrêt des processus serveurs.")
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+    return 0
+
+
 def _main() -> int:
-    server = Server()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e", "--engine", action="store", dest="engine",
+                        choices=("selectors", "asyncio"), default="selectors",
+                        help="Boucle d'événements du serveur.")
+    parser.add_argument("-w", "--workers", action="store", dest="workers",
+                        type=int, default=DEFAULT_WORKERS,
+                        help="Nombre de fils traitant les requêtes "
+                             "(0 : dans la boucle, moteur selectors seulement).")
+    parser.add_argument("-p", "--processes", action="store", dest="processes",
+                        type=int, default=1,
+                        help="Nombre de processus serveurs partageant le port "
+                             "(SO_REUSEPORT).")
+    parser.add_argument("--storage", action="store", dest="storage",
+                        choices=tuple(glostorage.STORES),
+                        default=glostorage.DEFAULT_STORE,
+                        help="Stockage des courriels : journal de segments "
+                             "ou un fichier par courriel (format historique).")
+    parser.add_argument("--commit-batch", action="store", dest="commit_batch",
+                        type=int, default=DEFAULT_COMMIT_BATCH,
+                        help="Nombre maximal de courriels écrits et synchronisés "
+                             "sur le disque ensemble.")
+    parser.add_argument("--commit-delay", action="store", dest="commit_delay",
+                        type=float, default=DEFAULT_COMMIT_DELAY * 1000,
+                        help="Délai maximal, en millisecondes, pendant lequel "
+                             "une livraison attend d'autres courriels à "
+                             "synchroniser avec elle.")
+    parser.add_argument("--cache-size", action="store", dest="cache_size",
+                        type=float, default=DEFAULT_CACHE_SIZE / (1024 * 1024),
+                        help="Taille maximale, en Mio, du cache des courriels "
+                             "lus (0 : pas de cache).")
+    parser.add_argument("--compress-threshold", action="store",
+                        dest="compress_threshold", type=int,
+                        default=glostorage.COMPRESS_THRESHOLD,
+                        help="Taille, en octets, à partir de laquelle les "
+                             "courriels sont compressés sur le disque "
+                             "(0 : jamais).")
+    parser.add_argument("-s", "--stats", action="store_true", dest="stats",
+                        help="Affiche les statistiques cumulées des processus "
+                             "serveurs en cours d'exécution puis quitte.")
+    args = parser.parse_args(sys.argv[1:])
+    if args.stats:
+        print(gloutils.SERVER_STATS_DISPLAY.format(**aggregate_worker_stats()))
+        return 0
+    options = {"storage": args.storage, "commit_batch": args.commit_batch,
+               "commit_delay": args.commit_delay / 1000,
+               "compress_threshold": args.compress_threshold,
+               "cache_size": int(args.cache_size * 1024 * 1024)}
+    if args.processes > 1:
+        return _supervise(args.processes, args.engine, args.workers, options)
+    server = _make_server(args.engine, args.workers, **options)
     try:
         server.run()
     except KeyboardInterrupt:
@@ -0,0 +1,254 @@
+"""\
+Module fournissant les encodages des GloMessage transportés par glosocket.
+
+Deux encodages sont disponibles :
+- JSON, l'encodage historique, toujours accepté ;
+- BINARY, un encodage compact négocié par l'entête HELLO : l'entête est un
+  entier, suivi s'il y a lieu de l'identifiant de requête, les champs de
+  chaque payload connu suivent un ordre fixe et les chaînes sont préfixées
+  de leur longueur en octets (UTF-8). Les éléments d'une liste de chaînes
+  sont séparés par un caractère nul, pour être décodés en une seule fois.
+
+Un payload qui ne correspond à aucun gabarit connu (champ facultatif absent,
+type inattendu, caractère nul dans une liste) est transporté en JSON à
+l'intérieur d'un message BINARY.
+
+Exécuter ce module lance un banc d'essai comparant les deux encodages.
+"""
+import json
+import struct
+import sys
+import timeit
+
+JSON = "json"
+BINARY = "binary"
+CODECS = (BINARY, JSON)  # Par ordre de préférence.
+
+_ENVELOPE = struct.Struct("!BB")  # Entête, gabarit du payload.
+_REQUEST_ID = struct.Struct("!I")
+_HAS_REQUEST_ID = 0x80  # Bit de l'entête annonçant un identifiant de requête.
+_NO_PAYLOAD = 0
+_JSON_PAYLOAD = 255
+
+# Gabarits des payloads, dans l'ordre de gloutils ; les gabarits ajoutés
+# depuis sont placés à la fin pour ne pas renuméroter. Chaque champ est une
+# chaîne ('s'), un entier signé sur 64 bits ('q'), une liste de chaînes
+# ('S', précédée de son nombre d'éléments) ou une liste d'entiers signés sur
+# 64 bits ('Q', de même). Le numéro d'un gabarit est sa position dans la
+# liste, plus un.
+_SCHEMAS = [
+    (("error_message", 's'),),
+    (("username", 's'), ("password", 's')),
+    (("sender", 's'), ("destination", 's'), ("subject", 's'),
+     ("date", 's'), ("content", 's')),
+    (("offset", 'q'), ("limit", 'q')),
+    (("email_list", 'S'), ("offset", 'q'), ("total", 'q')),
+    (("choice", 'q'),),
+    (("count", 'q'), ("size", 'q')),
+    (("codecs", 'S'),),
+    (("codec", 's'),),
+    (("sender", 's'), ("destination", 's'), ("destinations", 'S'),
+     ("subject", 's'), ("date", 's'), ("content", 's')),
+    (("results", 'S'),),
+    (("count", 'q'), ("size", 'q'), ("stored_size", 'q')),
+    (("token", 's'), ("expires", 'q')),
+    (("token", 's'),),
+    (("seq", 'q'), ("sender", 's'), ("subject", 's'), ("date", 's')),
+    (("after", 'q'),),
+    (("after", 'q'), ("limit", 'q')),
+    (("seqs", 'Q'), ("senders", 'S'), ("subjects", 'S'), ("dates", 'S'),
+     ("last_seq", 'q')),
+    (("seqs", 'Q'),),
+    (("seqs", 'Q'), ("senders", 'S'), ("destinations", 'S'), ("subjects", 'S'),
+     ("dates", 'S'), ("contents", 'S'), ("last_seq", 'q')),
+    (("query", 's'),),
+    (("query", 's'), ("offset", 'q'), ("limit", 'q')),
+    (("seqs", 'Q'), ("total", 'q')),
+    (("sender", 's'), ("destination", 's'), ("subject", 's'), ("date", 's')),
+    (("sender", 's'), ("destination", 's'), ("destinations", 'S'),
+     ("subject", 's'), ("date", 's')),
+    (("data", 's'),),
+]
+
+
+class CodecError(ValueError):
+    """Erreur levée lorsqu'un message reçu ne peut pas être décodé."""
+
+
+class _Schema:
+    """
+    Gabarit compilé d'un payload : les entiers et les longueurs des chaînes
+    et des listes sont regroupés dans une seule structure d'entête, suivie
+    des chaînes et des listes d'entiers.
+    """
+
+    def __init__(self, tag: int, fields: tuple) -> None:
+        self.tag = tag
+        self.names = tuple(name for name, _ in fields)
+        self.kinds = tuple(kind for _, kind in fields)
+        self.fixed = struct.Struct("!" + "".join(
+            {'q': 'q', 's': 'I', 'S': 'II', 'Q': 'I'}[kind] for kind in self.kinds))
+
+    def encode(self, payload: dict, chunks: list) -> None:
+        """Ajoute à `chunks` l'encodage du payload."""
+        values = []
+        strings = []
+        for name, kind in zip(self.names, self.kinds):
+            value = payload[name]
+            if kind == 'q':
+                if type(value) is not int:
+                    raise TypeError(name)
+                values.append(value)
+            elif kind == 's':
+                data = value.encode('utf-8')
+                values.append(len(data))
+                strings.append(data)
+            elif kind == 'Q':
+                if any(type(item) is not int for item in value):
+                    raise TypeError(name)
+                values.append(len(value))
+                strings.append(struct.pack(f"!{len(value)}q", *value))
+            else:
+                joined = "\0".join(value)
+                if joined.count("\0") != max(len(value) - 1, 0):
+                    raise TypeError(name)
+                data = joined.encode('utf-8')
+                values.append(len(value))
+                values.append(len(data))
+                strings.append(data)
+        chunks.append(self.fixed.pack(*values))
+        chunks.extend(strings)
+
+    def decode(self, data: bytes, offset: int) -> dict:
+        """Décode le payload qui commence à `offset`."""
+        values = iter(self.fixed.unpack_from(data, offset))
+        offset += self.fixed.size
+        payload = {}
+        for name, kind in zip(self.names, self.kinds):
+            value = next(values)
+            if kind == 'q':
+                payload[name] = value
+            elif kind == 's':
+                payload[name] = str(data[offset:offset + value], 'utf-8')
+                offset += value
+            elif kind == 'Q':
+                payload[name] = list(struct.unpack_from(f"!{value}q", data, offset))
+                offset += 8 * value
+            else:
+                size = next(values)
+                items = str(data[offset:offset + size], 'utf-8').split("\0")
+                offset += size
+                if len(items) != max(value, 1) or (not value and items != [""]):
+                    raise CodecError("Invalid string list")
+                payload[name] = items if value else []
+        if offset != len(data):
+            raise CodecError("Trailing data after payload")
+        return payload
+
+
+_COMPILED = [_Schema(tag, fields) for tag, fields in enumerate(_SCHEMAS, start=1)]
+_BY_TAG = {schema.tag: schema for schema in _COMPILED}
+_BY_KEYS = {frozenset(schema.names): schema for schema in _COMPILED}
+
+
+def _envelope(message: dict, tag: int) -> bytes:
+    """Encode l'entête, l'identifiant de requête et le gabarit du payload."""
+    request_id = message.get("request_id")
+    if request_id is None:
+        return _ENVELOPE.pack(message["header"], tag)
+    return (_ENVELOPE.pack(message["header"] | _HAS_REQUEST_ID, tag)
+            + _REQUEST_ID.pack(request_id))
+
+
+def _encode_binary(message: dict) -> bytes:
+    """Encode un GloMessage avec l'encodage BINARY."""
+    payload = message.get("payload")
+    if payload is None:
+        return _envelope(message, _NO_PAYLOAD)
+    schema = _BY_KEYS.get(frozenset(payload))
+    if schema is not None:
+        chunks = [_envelope(message, schema.tag)]
+        try:
+            schema.encode(payload, chunks)
+            return b"".join(chunks)
+        except (TypeError, AttributeError, struct.error):
+            pass
+    return _envelope(message, _JSON_PAYLOAD) + json.dumps(payload).encode('utf-8')
+
+
+def _decode_binary(data: bytes) -> dict:
+    """Décode un GloMessage encodé avec l'encodage BINARY."""
+    header, tag = _ENVELOPE.unpack_from(data)
+    offset = _ENVELOPE.size
+    message = {"header": header & ~_HAS_REQUEST_ID}
+    if header & _HAS_REQUEST_ID:
+        message["request_id"], = _REQUEST_ID.unpack_from(data, offset)
+        offset += _REQUEST_ID.size
+    if tag == _JSON_PAYLOAD:
+        message["payload"] = json.loads(data[offset:])
+    elif tag != _NO_PAYLOAD:
+        schema = _BY_TAG.get(tag)
+        if schema is None:
+            raise CodecError(f"Unknown payload tag {tag}")
+        message["payload"] = schema.decode(data, offset)
+    return message
+
+
+def encode(message: dict, codec: str = JSON) -> bytes:
+    """Encode un GloMessage avec l'encodage demandé."""
+    if codec == BINARY:
+        return _encode_binary(message)
+    return json.dumps(message).encode('utf-8')
+
+
+def decode(data: bytes, codec: str = JSON) -> dict:
+    """
+    Décode un GloMessage reçu avec l'encodage demandé.
+
+    Lève une exception CodecError si les données sont invalides.
+    """
+    try:
+        if codec == BINARY:
+            return _decode_binary(data)
+        message = json.loads(data)
+    except (ValueError, struct.error, IndexError) as ex:
+        raise CodecError("The received data is not a valid message") from ex
+    if not isinstance(message, dict):
+        raise CodecError("The received data is not a valid message")
+    return message
+
+
+def choose(offered: list) -> str:
+    """Retourne l'encodage préféré parmi ceux proposés par le client."""
+    for codec in CODECS:
+        if codec in offered:
+            return codec
+    return JSON
+
+
+def _benchmark() -> None:
+    """Compare le coût et la taille des deux encodages."""
+    email = {"header": 1, "payload": {
+        "sender": "alice@glo2000.ca", "destination": "bob@glo2000.ca",
+        "subject": "Réunion de lundi", "date": "Mon, 05 Oct 2026 14:03:11 +0000",
+        "content": "Bonjour,\nvoici le compte rendu de la réunion. " * 200}}
+    email_list = {"header": 1, "payload": {
+        "email_list": [f"#{i} alice@glo2000.ca - Sujet numéro {i} "
+                       "Mon, 05 Oct 2026 14:03:11 +0000" for i in range(1, 21)],
+        "offset": 0, "total": 4821}}
+    stats = {"header": 1, "payload": {"count": 4821, "size": 91234567}}
+    print(f"{'message':<12}{'codec':<8}{'octets':>8}{'encode µs':>12}{'decode µs':>12}")
+    for name, message in (("email", email), ("email_list", email_list),
+                          ("stats", stats)):
+        for codec in (JSON, BINARY):
+            data = encode(message, codec)
+            assert decode(data, codec) == message
+            number = 20000
+            enc = timeit.timeit(lambda: encode(message, codec), number=number)
+            dec = timeit.timeit(lambda: decode(data, codec), number=number)
+            print(f"{name:<12}{codec:<8}{len(data):>8}"
+                  f"{enc / number * 1e6:>12.2f}{dec / number * 1e6:>12.2f}")
+
+
+if __name__ == '__main__':
+    sys.exit(_benchmark())
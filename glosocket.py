@@ -1,9 +1,45 @@
 """\
 Module fournissant les fonctions d'envoi et de réception
 de messages de taille arbitraire pour les sockets Python.
+
+Les messages sont reçus directement dans un tampon de la taille annoncée
+(socket.recv_into) et envoyés sans concaténer l'entête et les données
+(socket.sendmsg), pour éviter les copies inutiles sur les gros messages.
+
+Le bit de poids fort de l'entête de longueur indique un message compressé
+avec zlib (voir `compress_mesg`), que les fonctions de réception
+décompressent d'elles-mêmes, ou laissent tel quel avec `decompress=False`
+pour que l'appelant vérifie qu'il l'a accepté (voir `decompress_mesg`). Seul
+un pair qui l'a accepté lors de la négociation doit en recevoir ; la
+longueur d'un message est donc limitée à 2 Gio.
+
+La longueur annoncée n'est pas digne de confiance : les fonctions de
+réception refusent, avant d'allouer quoi que ce soit, les messages de plus
+de `max_size` octets (MAX_MESSAGE_SIZE par défaut), une fois décompressés
+le cas échéant. Les gros corps de courriels sont transmis en plusieurs
+messages EMAIL_CHUNK.
+
+Des messages déjà préfixés de leur longueur peuvent aussi être conservés
+bout à bout dans un fichier (voir `frame_mesg` et `read_mesg_bytes`), puis
+transmis tels quels du fichier au socket avec os.sendfile (voir FileFrames).
 """
+import asyncio
+import collections
+import itertools
+import mmap
+import os
 import socket
 import struct
+import zlib
+
+CHUNK_SIZE = 65536
+COMPRESSION = "zlib"
+COMPRESS_THRESHOLD = 1024  # En deçà, les messages sont transmis tels quels.
+_LENGTH_FORMAT = "!I"
+_LENGTH_SIZE = struct.calcsize(_LENGTH_FORMAT)
+_COMPRESSED_FLAG = 0x80000000
+_MAX_BUFFERS = 64  # Nombre de tampons transmis par appel à sendmsg.
+MAX_MESSAGE_SIZE = 8 * 1024 * 1024  # Longueur maximale d'un message reçu.
 
 
 class GLOSocketError(Exception):
@@ -13,55 +49,548 @@ class GLOSocketError(Exception):
     """
 
 
-def _recvall(source: socket.socket, size: int) -> bytes:
+def _recvall(source: socket.socket, size: int) -> bytearray:
     """
     Fonction utilitaire pour recv_mesg.
 
-    Applique socket.recv en boucle pour jusqu'à la
-    réception d'un message de la taille voulue.
+    Prépare un tampon de la taille voulue et le remplit en appliquant
+    socket.recv_into en boucle, par morceaux d'au plus CHUNK_SIZE octets.
     """
-    msg = b""
-    while size > 0:
-        chunk_size = min(size, 4096)
+    msg = bytearray(size)
+    view = memoryview(msg)
+    received = 0
+    while received < size:
         try:
-            buffer = source.recv(chunk_size)
+            count = source.recv_into(view[received:], min(size - received, CHUNK_SIZE))
         except OSError as ex:
             raise GLOSocketError("The source socket is closed.") from ex
-        if not buffer:
+        if not count:
             raise GLOSocketError("The other socket is closed.")
-        msg += buffer
-        size -= len(buffer)
+        received += count
     return msg
 
 
-def snd_mesg(dest_soc: socket.socket, message: str) -> None:
+def _sendall(dest_soc: socket.socket, buffers: list) -> None:
     """
-    Encode le message puis le transmet à la destination.
+    Fonction utilitaire pour snd_mesg.
+
+    Transmet les tampons bout à bout avec socket.sendmsg, sans les
+    concaténer, en reprenant après chaque envoi partiel.
+    """
+    if not hasattr(dest_soc, "sendmsg"):
+        for buffer in buffers:
+            dest_soc.sendall(buffer)
+        return
+    views = collections.deque(memoryview(buffer).cast('B') for buffer in buffers)
+    while views:
+        sent = dest_soc.sendmsg(list(itertools.islice(views, _MAX_BUFFERS)))
+        _consume(views, sent)
+
+
+def _consume(views: collections.deque, sent: int) -> None:
+    """Retire `sent` octets du début de la file de tampons."""
+    while sent:
+        if sent >= len(views[0]):
+            sent -= len(views.popleft())
+        else:
+            views[0] = views[0][sent:]
+            sent = 0
+    while views and not len(views[0]):
+        views.popleft()
+
+
+class CompressedMesg(bytes):
+    """Message compressé par `compress_mesg`, annoncé comme tel à l'envoi."""
+
+
+def compress_mesg(data: bytes, threshold: int = COMPRESS_THRESHOLD) -> bytes:
+    """
+    Compresse un message déjà encodé s'il fait au moins `threshold` octets
+    et que la compression le réduit. Le résultat, un CompressedMesg, peut
+    être passé à toutes les fonctions d'envoi du module.
+    """
+    if len(data) < threshold:
+        return data
+    compressed = zlib.compress(data, 1)
+    return CompressedMesg(compressed) if len(compressed) < len(data) else data
+
+
+def _length_prefix(data: bytes) -> bytes:
+    """Retourne l'entête annonçant la longueur des données."""
+    if len(data) & _COMPRESSED_FLAG:
+        raise GLOSocketError("The message is too long to be sent")
+    if isinstance(data, CompressedMesg):
+        return struct.pack(_LENGTH_FORMAT, len(data) | _COMPRESSED_FLAG)
+    return struct.pack(_LENGTH_FORMAT, len(data))
+
+
+def _parse_length(header: bytes) -> tuple[int, bool]:
+    """Retourne la longueur annoncée par l'entête et si le message est compressé."""
+    length, = struct.unpack(_LENGTH_FORMAT, header)
+    return length & ~_COMPRESSED_FLAG, bool(length & _COMPRESSED_FLAG)
+
+
+def _check_length(length: int, max_size: int | None) -> None:
+    """Refuse un message annoncé plus long que `max_size` octets (None : sans limite)."""
+    if max_size is not None and length > max_size:
+        raise GLOSocketError(f"The announced message is too long ({length} bytes)")
+
+
+def decompress_mesg(data: bytes, max_size: int | None = MAX_MESSAGE_SIZE) -> bytes:
+    """
+    Décompresse un message reçu avec le bit de compression (voir
+    CompressedMesg), sans jamais produire plus de `max_size` octets
+    (None : sans limite).
+
+    Lève une exception GLOSocketError si le message est invalide ou qu'il
+    dépasse `max_size` octets une fois décompressé.
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        message = decompressor.decompress(data, max_size or 0)
+    except zlib.error as ex:
+        raise GLOSocketError("The received data is not a valid"
+                             " compressed message") from ex
+    if decompressor.unconsumed_tail:
+        raise GLOSocketError("The decompressed message is too long")
+    if not decompressor.eof:
+        raise GLOSocketError("The received data is not a valid"
+                             " compressed message")
+    return message
+
+
+def _decompress(data: bytes, max_size: int | None, decompress: bool) -> bytes:
+    """
+    Retourne un message reçu avec le bit de compression, décompressé si
+    `decompress` est vrai, sinon tel quel en CompressedMesg.
+    """
+    if decompress:
+        return decompress_mesg(data, max_size)
+    return CompressedMesg(data)
+
+
+def frame_mesg(data: bytes) -> bytes:
+    """
+    Retourne des données déjà encodées préfixées de leur longueur, telles
+    qu'elles sont transmises, pour être conservées dans un fichier.
+    """
+    return _length_prefix(data) + data
+
+
+def read_mesg_bytes(source_file) -> bytes | None:
+    """
+    Lit un message conservé par `frame_mesg` dans un fichier binaire et le
+    retourne décompressé s'il y a lieu, ou None à la fin du fichier.
+
+    Lève une exception GLOSocketError si le message est tronqué ou que sa
+    compression est invalide.
+    """
+    header = source_file.read(_LENGTH_SIZE)
+    if not header:
+        return None
+    if len(header) < _LENGTH_SIZE:
+        raise GLOSocketError("The stored message is truncated")
+    length, compressed = _parse_length(header)
+    _check_length(length, MAX_MESSAGE_SIZE)
+    data = source_file.read(length)
+    if len(data) < length:
+        raise GLOSocketError("The stored message is truncated")
+    return decompress_mesg(data) if compressed else data
+
+
+class FileFrames:
+    """
+    Messages conservés bout à bout par `frame_mesg` dans les `count` octets
+    d'un fichier ouvert, à partir de la position `offset`.
+
+    Les fonctions d'envoi les transmettent tels quels, du fichier au socket,
+    avec os.sendfile : ils ne passent jamais par la mémoire du processus.
+    Le fichier est fermé une fois les messages transmis, ou par `close`.
+    """
+
+    def __init__(self, file, offset: int, count: int) -> None:
+        self.file = file
+        self.offset = offset
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def sendfile(self, dest_soc: socket.socket) -> int:
+        """
+        Transmet au socket autant d'octets que possible et retourne leur
+        nombre. Le socket peut être non bloquant.
+        """
+        sent = os.sendfile(dest_soc.fileno(), self.file.fileno(),
+                           self.offset, self.count)
+        if not sent:
+            raise GLOSocketError("The stored messages are truncated")
+        self.offset += sent
+        self.count -= sent
+        return sent
+
+    def map(self) -> memoryview:
+        """
+        Retourne les messages sous la forme d'une vue sur le fichier projeté
+        en mémoire (mmap), pour les plateformes sans os.sendfile, et ferme le
+        fichier : la projection lui survit.
+        """
+        with self.file:
+            mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped)[self.offset:self.offset + self.count]
+
+    def close(self) -> None:
+        """Ferme le fichier, même si les messages n'ont pas été transmis."""
+        self.file.close()
+
+
+def encode_mesg(message: str) -> bytes:
+    """Encode le message et le préfixe de sa longueur."""
+    data = message.encode(encoding='utf-8')
+    return _length_prefix(data) + data
+
+
+def snd_mesgs_bytes(dest_soc: socket.socket, messages: list[bytes]) -> None:
+    """
+    Transmet plusieurs messages déjà encodés à la destination, en un
+    minimum d'appels système.
 
     Lève une exception GLOSocketError en cas de problème
     de communication.
     """
-    data = message.encode(encoding='utf-8')
-    data_length = struct.pack("!I", len(data))
+    buffers = []
+    for data in messages:
+        buffers.append(_length_prefix(data))
+        buffers.append(data)
     try:
-        dest_soc.sendall(data_length + data)
+        _sendall(dest_soc, buffers)
     except OSError as ex:
         raise GLOSocketError("Cannot send data with socket") from ex
 
 
-def recv_mesg(source_soc: socket.socket) -> str:
+def snd_mesg_bytes(dest_soc: socket.socket, data: bytes) -> None:
     """
-    Récupère un message de la source et le décode.
+    Transmet des données déjà encodées à la destination.
 
     Lève une exception GLOSocketError en cas de problème
     de communication.
     """
-    data_length = _recvall(source_soc, 4)
+    snd_mesgs_bytes(dest_soc, [data])
+
+
+def snd_mesg(dest_soc: socket.socket, message: str) -> None:
+    """
+    Encode le message puis le transmet à la destination.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication.
+    """
+    snd_mesg_bytes(dest_soc, message.encode(encoding='utf-8'))
+
+
+def recv_mesg_bytes(source_soc: socket.socket,
+                    max_size: int | None = MAX_MESSAGE_SIZE,
+                    decompress: bool = True) -> bytes:
+    """
+    Récupère un message de la source sans le décoder, décompressé s'il y a
+    lieu (ou tel quel en CompressedMesg si `decompress` est faux). Le tampon
+    retourné peut être passé tel quel à json.loads.
+
+    Lève une exception GLOSocketError en cas de problème de communication,
+    ou si le message annoncé dépasse `max_size` octets (None : sans limite).
+    """
+    data_length = _recvall(source_soc, _LENGTH_SIZE)
     try:
-        length, = struct.unpack("!I", data_length)
+        length, compressed = _parse_length(data_length)
     except struct.error as ex:
         raise GLOSocketError("The received data was"
                              " not the message's length") from ex
+    _check_length(length, max_size)
 
     data = _recvall(source_soc, length)
-    return data.decode('utf-8')
+    return _decompress(data, max_size, decompress) if compressed else data
+
+
+def recv_mesg(source_soc: socket.socket) -> str:
+    """
+    Récupère un message de la source et le décode.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication.
+    """
+    return recv_mesg_bytes(source_soc).decode('utf-8')
+
+
+async def async_snd_mesgs_bytes(writer: asyncio.StreamWriter,
+                                messages: list[bytes]) -> None:
+    """
+    Version asyncio de snd_mesgs_bytes : transmet plusieurs messages déjà
+    encodés sur le flux, puis attend une seule fois que le tampon d'envoi
+    se vide.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication.
+    """
+    try:
+        for data in messages:
+            writer.writelines([_length_prefix(data), data])
+        await writer.drain()
+    except (OSError, RuntimeError) as ex:
+        raise GLOSocketError("Cannot send data with socket") from ex
+
+
+async def async_snd_file(writer: asyncio.StreamWriter, frames: FileFrames) -> None:
+    """
+    Version asyncio de l'envoi des messages conservés dans un fichier :
+    attend que le flux soit vide, puis les transmet avec os.sendfile (ou en
+    les lisant, si le transport ne le permet pas). Le fichier est ensuite
+    fermé. Aucun autre message ne peut être écrit sur le flux entre-temps.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication.
+    """
+    try:
+        with frames.file:
+            await writer.drain()
+            await asyncio.get_running_loop().sendfile(
+                writer.transport, frames.file, frames.offset, frames.count)
+    except (OSError, RuntimeError) as ex:
+        raise GLOSocketError("Cannot send data with socket") from ex
+
+
+async def async_snd_mesg_bytes(writer: asyncio.StreamWriter, data: bytes) -> None:
+    """
+    Version asyncio de snd_mesg_bytes : transmet des données déjà encodées
+    sur le flux, en attendant que le tampon d'envoi se vide.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication.
+    """
+    await async_snd_mesgs_bytes(writer, [data])
+
+
+def write_mesg_bytes(writer: asyncio.StreamWriter, data: bytes) -> None:
+    """
+    Place des données déjà encodées sur le flux sans attendre leur
+    transmission. Doit être appelée depuis la boucle d'événements du flux.
+
+    Lève une exception GLOSocketError si le message est trop long.
+    """
+    writer.writelines([_length_prefix(data), data])
+
+
+async def async_snd_mesg(writer: asyncio.StreamWriter, message: str) -> None:
+    """
+    Version asyncio de snd_mesg : encode le message puis le transmet
+    sur le flux, en attendant que le tampon d'envoi se vide.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication.
+    """
+    await async_snd_mesg_bytes(writer, message.encode(encoding='utf-8'))
+
+
+async def async_recv_mesg_bytes(reader: asyncio.StreamReader,
+                                max_size: int | None = MAX_MESSAGE_SIZE,
+                                decompress: bool = True) -> bytes:
+    """
+    Version asyncio de recv_mesg_bytes : récupère un message du flux sans
+    le décoder, décompressé s'il y a lieu (ou tel quel en CompressedMesg si
+    `decompress` est faux).
+
+    Lève une exception GLOSocketError en cas de problème de communication,
+    ou si le message annoncé dépasse `max_size` octets (None : sans limite).
+    """
+    try:
+        data_length = await reader.readexactly(_LENGTH_SIZE)
+        length, compressed = _parse_length(data_length)
+        _check_length(length, max_size)
+        data = await reader.readexactly(length)
+    except asyncio.IncompleteReadError as ex:
+        raise GLOSocketError("The other socket is closed.") from ex
+    except OSError as ex:
+        raise GLOSocketError("The source socket is closed.") from ex
+    return _decompress(data, max_size, decompress) if compressed else data
+
+
+async def async_recv_mesg(reader: asyncio.StreamReader) -> str:
+    """
+    Version asyncio de recv_mesg : récupère un message du flux et le décode.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication.
+    """
+    return (await async_recv_mesg_bytes(reader)).decode('utf-8')
+
+
+class MessageReader:
+    """
+    Décodeur incrémental de messages pour un socket non bloquant.
+
+    Chaque appel à `read` ne consomme que les octets déjà disponibles et
+    conserve le message incomplet dans un tampon jusqu'à l'appel suivant,
+    si bien qu'un pair lent ne bloque jamais l'appelant.
+
+    Dès que son entête est reçue, un message dispose d'un tampon de la
+    taille annoncée. Les petits messages y sont copiés depuis un tampon de
+    lecture de CHUNK_SIZE octets, qui peut en contenir plusieurs ; les gros
+    y sont reçus directement avec socket.recv_into. Les messages compressés
+    sont décompressés une fois complets, ou retournés tels quels en
+    CompressedMesg si `decompress` est faux. Un message annoncé plus long
+    que `max_size` octets est refusé avant toute allocation.
+    """
+
+    def __init__(self, source_soc: socket.socket,
+                 max_size: int | None = MAX_MESSAGE_SIZE,
+                 decompress: bool = True) -> None:
+        self._source = source_soc
+        self._max_size = max_size
+        self._decompress = decompress
+        self._chunk = memoryview(bytearray(CHUNK_SIZE))
+        self._header = bytearray()
+        self._body: bytearray | None = None
+        self._view: memoryview | None = None
+        self._received = 0
+        self._compressed = False
+
+    def _recv_into(self, view: memoryview) -> int:
+        """Reçoit dans `view` les octets disponibles et retourne leur nombre."""
+        try:
+            count = self._source.recv_into(view)
+        except (BlockingIOError, InterruptedError):
+            return 0
+        except OSError as ex:
+            raise GLOSocketError("The source socket is closed.") from ex
+        if not count:
+            raise GLOSocketError("The other socket is closed.")
+        return count
+
+    def read(self) -> list[bytes]:
+        """
+        Lit les octets disponibles et retourne les messages complets reçus,
+        dans l'ordre et sans les décoder. La liste est vide si aucun message
+        n'est encore complet.
+
+        Lève une exception GLOSocketError si le pair a fermé la connexion,
+        qu'un message est trop long ou qu'un message compressé est invalide.
+        """
+        messages = []
+        if self._body is not None and len(self._body) - self._received >= CHUNK_SIZE:
+            self._received += self._recv_into(self._view[self._received:])
+            if self._received == len(self._body):
+                messages.append(self._complete())
+            return messages
+
+        count = self._recv_into(self._chunk)
+        data = self._chunk[:count]
+        offset = 0
+        while offset < count:
+            if self._body is None:
+                needed = _LENGTH_SIZE - len(self._header)
+                self._header += data[offset:offset + needed]
+                offset += min(needed, count - offset)
+                if len(self._header) < _LENGTH_SIZE:
+                    break
+                length, self._compressed = _parse_length(self._header)
+                _check_length(length, self._max_size)
+                self._header.clear()
+                self._body = bytearray(length)
+                self._view = memoryview(self._body)
+                self._received = 0
+            size = min(len(self._body) - self._received, count - offset)
+            self._view[self._received:self._received + size] = data[offset:offset + size]
+            self._received += size
+            offset += size
+            if self._received == len(self._body):
+                messages.append(self._complete())
+        return messages
+
+    def _complete(self) -> bytes:
+        """Retourne le message courant, complet, et prépare le suivant."""
+        body = self._body
+        self._view.release()
+        self._body = self._view = None
+        if self._compressed:
+            return _decompress(body, self._max_size, self._decompress)
+        return body
+
+
+class MessageWriter:
+    """
+    Tampon d'envoi pour un socket non bloquant.
+
+    Les messages sont ajoutés avec `queue` puis transmis par `flush` au
+    rythme où le socket les accepte. Les tampons sont conservés tels quels
+    et transmis ensemble par socket.sendmsg, sans être concaténés ; les
+    messages conservés dans un fichier (`queue_file`) le sont avec
+    os.sendfile.
+    """
+
+    def __init__(self, dest_soc: socket.socket) -> None:
+        self._dest = dest_soc
+        self._views = collections.deque()
+
+    @property
+    def pending(self) -> bool:
+        """Indique s'il reste des octets à transmettre."""
+        return bool(self._views)
+
+    def queue_bytes(self, data: bytes) -> None:
+        """Ajoute au tampon d'envoi un message déjà encodé."""
+        self._views.append(memoryview(_length_prefix(data)))
+        if data:
+            self._views.append(memoryview(data).cast('B'))
+
+    def queue(self, message: str) -> None:
+        """Encode le message et l'ajoute au tampon d'envoi."""
+        self.queue_bytes(message.encode(encoding='utf-8'))
+
+    def queue_file(self, frames: FileFrames) -> None:
+        """
+        Ajoute au tampon d'envoi des messages conservés dans un fichier, qui
+        est fermé une fois qu'ils sont transmis. Sans os.sendfile, ils sont
+        transmis depuis le fichier projeté en mémoire.
+        """
+        if not frames.count:
+            frames.close()
+        elif hasattr(os, "sendfile"):
+            self._views.append(frames)
+        else:
+            self._views.append(frames.map())
+
+    def close(self) -> None:
+        """Abandonne le tampon d'envoi et ferme les fichiers qu'il contient."""
+        for view in self._views:
+            if isinstance(view, FileFrames):
+                view.close()
+        self._views.clear()
+
+    def flush(self) -> bool:
+        """
+        Transmet autant d'octets du tampon que le socket en accepte et
+        retourne True si le tampon est vide.
+
+        Lève une exception GLOSocketError en cas de problème
+        de communication.
+        """
+        while self._views:
+            head = self._views[0]
+            try:
+                if isinstance(head, FileFrames):
+                    head.sendfile(self._dest)
+                    if not head.count:
+                        head.close()
+                        self._views.popleft()
+                    continue
+                if hasattr(self._dest, "sendmsg"):
+                    sent = self._dest.sendmsg(list(itertools.takewhile(
+                        lambda view: not isinstance(view, FileFrames),
+                        itertools.islice(self._views, _MAX_BUFFERS))))
+                else:
+                    sent = self._dest.send(head)
+            except (BlockingIOError, InterruptedError):
+                return False
+            except OSError as ex:
+                raise GLOSocketError("Cannot send data with socket") from ex
+            _consume(self._views, sent)
+        return True
@@ -0,0 +1,1460 @@
+"""\
+Module fournissant le stockage des courriels des dossiers utilisateurs.
+
+Deux moteurs sont disponibles :
+- FileStore, le format historique : un fichier JSON par courriel dans le
+  dossier de l'utilisateur ;
+- SegmentStore, un journal en ajout seul : les courriels d'un dossier sont
+  écrits bout à bout dans des segments de taille bornée et un index compact
+  associe à chaque numéro de séquence la position du courriel.
+
+Les données d'au moins `compress_threshold` octets sont compressées avec
+zlib lorsque cela les réduit ; la lecture les décompresse de façon
+transparente. Un flux zlib commence toujours par l'octet 0x78 ('x'), ce qui
+le distingue des documents JSON conservés sans compression.
+
+Les corps livrés à plusieurs dossiers sont conservés une seule fois par
+BlobStore, un stockage adressé par le contenu avec comptes de références :
+le courriel de chaque dossier ne contient alors que l'empreinte du corps.
+Les courriels reçus en continu y sont aussi écrits, morceau par morceau
+(voir BlobWriter), même lorsqu'ils n'ont qu'un destinataire, sous la forme
+des messages glosocket qui transmettent leur corps : le serveur peut ainsi
+les envoyer tels quels, du fichier au socket.
+
+SearchIndex tient, pour chaque dossier, un index inversé des termes de ses
+courriels, conservé dans un journal en ajout seul.
+
+Les dossiers des utilisateurs sont répartis sous SERVER_USERS_DIR selon
+l'empreinte de leur nom (voir `user_dir`), pour qu'aucun répertoire ne
+compte des millions d'entrées.
+
+Dans les deux cas, chaque courriel d'un dossier reçoit un numéro de séquence
+croissant, à partir de 1. Les opérations qui modifient un dossier (`append`,
+`recover`, `import_legacy`, `compact`) doivent être appelées sous le verrou
+de ce dossier ; les lectures peuvent l'être depuis n'importe quel fil.
+
+Exécuter ce module donne accès aux outils hors ligne, à lancer serveur
+arrêté :
+    python glostorage.py migrate [utilisateur ...]
+        importe les dossiers au format historique dans le journal ;
+    python glostorage.py compact [utilisateur ...]
+        réécrit les journaux en segments pleins, sans données orphelines ;
+    python glostorage.py gc
+        recompte les références des corps partagés à partir de tous les
+        dossiers et supprime les corps qui ne sont plus référencés.
+migrate et compact suppriment aussi les liens laissés par shard, et
+compressent les courriels selon --compress-threshold, à régler comme celui
+du serveur.
+La commande suivante peut, elle, être lancée serveur en marche :
+    python glostorage.py shard [utilisateur ...]
+        déplace les dossiers de l'ancienne arborescence à plat, directement
+        sous SERVER_DATA_DIR, vers leur emplacement réparti.
+"""
+import argparse
+import array
+import bisect
+import codecs
+import collections
+import contextlib
+import datetime
+import email.utils
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import zlib
+
+import glosocket
+import gloutils
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SEGMENT_SIZE = 16 * 1024 * 1024
+LOG_DIRNAME = "log"
+_INDEX_FILENAME = "index"
+_SEGMENT_FORMAT = "{:08d}.seg"
+_RECORD = struct.Struct("!IQI")  # Longueur, séquence, CRC32 des données.
+_INDEX_ENTRY = struct.Struct("!QIQI")  # Séquence, segment, position, longueur.
+
+COMPRESS_THRESHOLD = 1024  # En deçà, les données sont conservées telles quelles.
+_ZLIB_MAGIC = b"\x78"
+BLOB_FIELD = "blob"  # Empreinte du corps partagé dans le courriel d'un dossier.
+BLOB_THRESHOLD = 512  # En deçà, une référence coûte autant qu'une copie.
+_REFS_FILENAME = "refs"
+_FRAMES_MAGIC = b"GLOF"  # Début d'un corps conservé en messages (voir BlobWriter).
+_END_FRAME = glosocket.frame_mesg(b"")
+_REF = struct.Struct("!32sq")  # Empreinte SHA-256 du corps, variation du compte.
+_SEARCH_RECORD = struct.Struct("!QdII")  # Séquence, date, longueur et CRC32 des termes.
+_TERM = re.compile(r"\w+")
+MAX_TERM_LENGTH = 64  # Les mots plus longs (empreintes, données encodées) sont ignorés.
+_sharded_dirs = {}  # (root, utilisateur) -> dossier trouvé à l'emplacement réparti.
+
+
+def user_dir(root: str, username: str) -> str:
+    """
+    Retourne le dossier de l'utilisateur dans le dossier de données `root` :
+    `<root>/USERS/ab/cd/<username>`, où abcd sont les quatre premiers
+    chiffres hexadécimaux de l'empreinte SHA-256 du nom.
+
+    Tant que la commande `shard` ne l'a pas déplacé, le dossier d'un compte
+    créé avant la répartition reste à l'ancien emplacement `<root>/<username>`,
+    qui est alors retourné. Les dossiers trouvés à leur emplacement réparti
+    sont retenus : ils ne sont plus cherchés sur le disque.
+    """
+    path = _sharded_dirs.get((root, username))
+    if path is not None:
+        return path
+    path = _sharded_dir(root, username)
+    if os.path.isdir(path):
+        _sharded_dirs[(root, username)] = path
+        return path
+    flat_path = os.path.join(root, username)
+    return flat_path if os.path.lexists(flat_path) else path
+
+
+def _sharded_dir(root: str, username: str) -> str:
+    """Retourne l'emplacement réparti du dossier de l'utilisateur."""
+    digest = hashlib.sha256(username.encode('utf-8')).hexdigest()
+    return os.path.join(root, gloutils.SERVER_USERS_DIR, digest[:2], digest[2:4], username)
+
+
+class StorageError(OSError):
+    """Erreur levée lorsqu'un courriel est introuvable ou corrompu."""
+
+
+def write_unique_file(directory: str, prefix: str, data,
+                      sync: bool = False) -> str:
+    """
+    Écrit `data` dans un nouveau fichier `<prefix>_<horodatage>.json` du
+    dossier et retourne son nom. Si un fichier a déjà été écrit dans la
+    même seconde, un suffixe est ajouté plutôt que de l'écraser. Avec
+    `sync`, le fichier est forcé sur le disque.
+
+    `data` est un bytes, ou un itérable de morceaux écrits à la suite.
+    """
+    timestamp = int(datetime.datetime.now().timestamp())
+    filename = f"{prefix}_{timestamp}.json"
+    duplicate = 0
+    while True:
+        try:
+            fd = os.open(os.path.join(directory, filename),
+                         os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            break
+        except FileExistsError:
+            duplicate += 1
+            filename = f"{prefix}_{timestamp}_{duplicate:04d}.json"
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in (data,) if isinstance(data, bytes) else data:
+            f.write(chunk)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    return filename
+
+
+def _fsync_dir(directory: str) -> None:
+    """Force sur le disque les entrées du dossier (fichiers créés)."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _compress(data: bytes, threshold: int) -> bytes:
+    """
+    Retourne les données compressées si elles font au moins `threshold`
+    octets (0 : jamais) et que la compression les réduit, sinon telles quelles.
+    """
+    if not threshold or len(data) < threshold:
+        return data
+    compressed = zlib.compress(data)
+    return compressed if len(compressed) < len(data) else data
+
+
+def _decompress(data: bytes) -> bytes:
+    """
+    Retourne les données lues du disque, décompressées s'il y a lieu.
+
+    Lève une exception StorageError si elles sont corrompues.
+    """
+    if data[:1] != _ZLIB_MAGIC:
+        return data
+    try:
+        return zlib.decompress(data)
+    except zlib.error as ex:
+        raise StorageError("Données compressées corrompues") from ex
+
+
+def _legacy_files(user_dir: str) -> list[str]:
+    """Retourne, dans l'ordre de livraison, les courriels au format historique."""
+    return sorted(f for f in os.listdir(user_dir) if f.endswith('.json'))
+
+
+class MailStore:
+    """
+    Interface commune des moteurs de stockage.
+
+    `root` est le dossier de données du serveur. En mode `shared`, d'autres
+    processus modifient les mêmes dossiers : les lectures doivent alors
+    tenir compte des courriels qu'ils ont ajoutés. Les courriels d'au moins
+    `compress_threshold` octets sont compressés (0 : jamais).
+    """
+
+    def __init__(self, root: str, shared: bool = False,
+                 compress_threshold: int = COMPRESS_THRESHOLD) -> None:
+        self._root = root
+        self._shared = shared
+        self._compress_threshold = compress_threshold
+
+    def _user_dir(self, username: str) -> str:
+        return user_dir(self._root, username)
+
+    def append(self, username: str, datas: list[bytes],
+               sync: bool = False) -> list[tuple[int, int]]:
+        """
+        Ajoute des courriels au dossier, dans l'ordre, et retourne pour
+        chacun son numéro de séquence et sa taille sur le disque. Avec
+        `sync`, ils sont forcés sur le disque avant le retour.
+        """
+        raise NotImplementedError
+
+    def read(self, username: str, seq: int) -> bytes:
+        """
+        Retourne le courriel portant le numéro `seq`.
+
+        Lève une exception StorageError s'il est introuvable ou corrompu.
+        """
+        raise NotImplementedError
+
+    def scan(self, username: str, after: int = 0):
+        """
+        Parcourt, du plus ancien au plus récent, les courriels dont le
+        numéro de séquence dépasse `after` et produit des paires
+        (numéro, données).
+        """
+        raise NotImplementedError
+
+    def usage(self, username: str) -> tuple[int, int]:
+        """
+        Retourne le nombre de courriels du dossier et leur taille totale
+        sur le disque, après compression.
+        """
+        raise NotImplementedError
+
+    def recover(self, username: str) -> None:
+        """Ramène le dossier dans un état cohérent après un arrêt brutal."""
+
+
+class FileStore(MailStore):
+    """
+    Stockage historique : un fichier `email_<horodatage>.json` par courriel.
+
+    Le numéro de séquence d'un courriel est sa position dans la liste des
+    fichiers, triée par nom au premier accès puis complétée dans l'ordre
+    où les nouveaux fichiers apparaissent.
+    """
+
+    def __init__(self, root: str, shared: bool = False,
+                 compress_threshold: int = COMPRESS_THRESHOLD) -> None:
+        super().__init__(root, shared, compress_threshold)
+        self._listings = {}
+        self._guard = threading.Lock()
+
+    def _listing(self, username: str, refresh: bool = False) -> list[str]:
+        """Retourne la liste des fichiers du dossier, dans l'ordre des numéros."""
+        with self._guard:
+            listing = self._listings.get(username)
+            if listing is not None and not (self._shared or refresh):
+                return listing
+            listing = list(listing or [])
+            known = set(listing)
+            listing.extend(name for name in _legacy_files(self._user_dir(username))
+                           if name not in known)
+            self._listings[username] = listing
+            return listing
+
+    def append(self, username: str, datas: list[bytes],
+               sync: bool = False) -> list[tuple[int, int]]:
+        # Un fichier par courriel : chacun doit être synchronisé, seul le
+        # dossier l'est une fois pour tout le lot.
+        user_dir = self._user_dir(username)
+        self._listing(username)
+        stored = [_compress(data, self._compress_threshold) for data in datas]
+        filenames = [write_unique_file(user_dir, "email", data, sync) for data in stored]
+        if sync:
+            _fsync_dir(user_dir)
+        with self._guard:
+            listing = self._listings[username]
+            listing.extend(filenames)
+            first = len(listing) - len(filenames) + 1
+            return [(seq, len(data)) for seq, data in enumerate(stored, start=first)]
+
+    def read(self, username: str, seq: int) -> bytes:
+        listing = self._listing(username)
+        if not 1 <= seq <= len(listing):
+            listing = self._listing(username, refresh=True)
+            if not 1 <= seq <= len(listing):
+                raise StorageError(f"Courriel {seq} introuvable")
+        with open(os.path.join(self._user_dir(username), listing[seq - 1]), 'rb') as f:
+            return _decompress(f.read())
+
+    def scan(self, username: str, after: int = 0):
+        user_dir = self._user_dir(username)
+        listing = self._listing(username)
+        for seq in range(after + 1, len(listing) + 1):
+            with open(os.path.join(user_dir, listing[seq - 1]), 'rb') as f:
+                yield seq, _decompress(f.read())
+
+    def usage(self, username: str) -> tuple[int, int]:
+        user_dir = self._user_dir(username)
+        listing = self._listing(username)
+        return len(listing), sum(os.path.getsize(os.path.join(user_dir, name))
+                                 for name in listing)
+
+
+class SegmentStore(MailStore):
+    """
+    Journal en ajout seul, dans le sous-dossier LOG_DIRNAME de chaque dossier.
+
+    Chaque courriel y est un enregistrement (longueur, séquence, CRC32,
+    données) ajouté à la fin du segment courant ; un nouveau segment est
+    ouvert lorsque le courant dépasserait `segment_size` octets. Le fichier
+    index contient une entrée de taille fixe (séquence, segment, position,
+    longueur) par courriel et n'est complété qu'une fois l'enregistrement
+    écrit : un courriel indexé est toujours lisible.
+
+    Après un arrêt brutal, `recover` indexe les enregistrements complets qui
+    ne l'étaient pas encore et tronque le premier enregistrement incomplet
+    ou corrompu ainsi que tout ce qui le suit.
+    """
+
+    def __init__(self, root: str, shared: bool = False,
+                 compress_threshold: int = COMPRESS_THRESHOLD,
+                 segment_size: int = SEGMENT_SIZE) -> None:
+        super().__init__(root, shared, compress_threshold)
+        self._segment_size = segment_size
+        self._indexes = {}
+        self._recovered = set()
+        self._guard = threading.Lock()
+
+    def _log_dir(self, username: str) -> str:
+        return os.path.join(self._user_dir(username), LOG_DIRNAME)
+
+    def _entries(self, username: str) -> list[tuple]:
+        """
+        Retourne l'index du dossier, trié par numéro de séquence. Il est lu
+        une seule fois puis complété par `append` ; en mode partagé, les
+        entrées ajoutées par les autres processus sont lues à chaque appel.
+        """
+        index_path = os.path.join(self._log_dir(username), _INDEX_FILENAME)
+        with self._guard:
+            entries = self._indexes.get(username)
+            if entries is not None and not self._shared:
+                return entries
+            entries = self._indexes.setdefault(username, [])
+            try:
+                with open(index_path, 'rb') as f:
+                    f.seek(len(entries) * _INDEX_ENTRY.size)
+                    data = f.read()
+            except FileNotFoundError:
+                return entries
+            usable = len(data) - len(data) % _INDEX_ENTRY.size
+            entries.extend(_INDEX_ENTRY.iter_unpack(data[:usable]))
+            return entries
+
+    def _extend(self, username: str, new_entries: list[tuple]) -> None:
+        """
+        Ajoute à l'index en mémoire les entrées qui viennent d'être écrites.
+        En mode partagé, un autre fil a pu les lire sur le disque entre-temps :
+        seules celles qui suivent la dernière entrée connue sont ajoutées.
+        """
+        with self._guard:
+            entries = self._indexes.setdefault(username, [])
+            for entry in new_entries:
+                if not entries or entry[0] > entries[-1][0]:
+                    entries.append(entry)
+
+    def _forget(self, username: str) -> None:
+        """Oublie l'index en mémoire d'un dossier réécrit sur le disque."""
+        with self._guard:
+            self._indexes.pop(username, None)
+
+    def append(self, username: str, datas: list[bytes],
+               sync: bool = False) -> list[tuple[int, int]]:
+        # Tout le lot est écrit d'un bloc : une seule synchronisation par
+        # segment touché, puis une pour l'index.
+        self.recover(username)
+        entries = self._entries(username)
+        first = entries[-1][0] + 1 if entries else 1
+        segment = entries[-1][1] if entries else 1
+        records = [(seq, _compress(data, self._compress_threshold))
+                   for seq, data in enumerate(datas, start=first)]
+        log_dir = self._log_dir(username)
+        created = not os.path.isdir(log_dir)
+        os.makedirs(log_dir, exist_ok=True)
+        self._extend(username, _append_records(log_dir, records, segment,
+                                               self._segment_size, sync))
+        if sync and created:
+            _fsync_dir(self._user_dir(username))
+        return [(seq, len(data)) for seq, data in records]
+
+    def read(self, username: str, seq: int) -> bytes:
+        entries = self._entries(username)
+        i = bisect.bisect_left(entries, (seq,))
+        if i == len(entries) or entries[i][0] != seq:
+            raise StorageError(f"Courriel {seq} introuvable")
+        _, segment, offset, length = entries[i]
+        path = os.path.join(self._log_dir(username), _SEGMENT_FORMAT.format(segment))
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return _decompress(_check_record(f.read(_RECORD.size + length), seq))
+
+    def scan(self, username: str, after: int = 0):
+        entries = self._entries(username)
+        log_dir = self._log_dir(username)
+        f = None
+        current = None
+        try:
+            for seq, segment, offset, length in entries[
+                    bisect.bisect_left(entries, (after + 1,)):]:
+                if segment != current:
+                    if f is not None:
+                        f.close()
+                    f = open(os.path.join(log_dir, _SEGMENT_FORMAT.format(segment)), 'rb')
+                    current = segment
+                f.seek(offset)
+                yield seq, _decompress(_check_record(f.read(_RECORD.size + length), seq))
+        finally:
+            if f is not None:
+                f.close()
+
+    def usage(self, username: str) -> tuple[int, int]:
+        entries = self._entries(username)
+        return len(entries), sum(entry[3] for entry in entries)
+
+    def recover(self, username: str) -> None:
+        """
+        Ramène le journal dans un état cohérent après un arrêt brutal.
+
+        Au premier appel pour un dossier, termine ou annule une compaction
+        interrompue et importe les courriels au format historique. Ensuite,
+        seule la fin du journal est vérifiée, ce qui ne coûte que quelques
+        appels à os.stat lorsqu'elle est intacte.
+        """
+        log_dir = self._log_dir(username)
+        if username not in self._recovered:
+            _finish_swap(log_dir)
+            if not os.path.isdir(log_dir):
+                self.import_legacy(username)
+            self._recovered.add(username)
+        if not os.path.isdir(log_dir):
+            return
+
+        index_path = os.path.join(log_dir, _INDEX_FILENAME)
+        try:
+            index_size = os.path.getsize(index_path)
+        except FileNotFoundError:
+            index_size = 0
+        if index_size % _INDEX_ENTRY.size:
+            # Entrée d'index incomplète : l'enregistrement sera réindexé.
+            os.truncate(index_path, index_size - index_size % _INDEX_ENTRY.size)
+            self._forget(username)
+
+        entries = self._entries(username)
+        if entries:
+            seq, segment, offset, length = entries[-1]
+            end = offset + _RECORD.size + length
+        else:
+            seq, segment, end = 0, 1, 0
+        path = os.path.join(log_dir, _SEGMENT_FORMAT.format(segment))
+        next_path = os.path.join(log_dir, _SEGMENT_FORMAT.format(segment + 1))
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size == end and not os.path.exists(next_path):
+            return
+
+        recovered = []
+        while True:
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    f.seek(end)
+                    data = f.read()
+                position = 0
+                while position + _RECORD.size <= len(data):
+                    record_length, record_seq, _ = _RECORD.unpack_from(data, position)
+                    record_end = position + _RECORD.size + record_length
+                    if record_seq != seq + 1 or record_end > len(data):
+                        break
+                    try:
+                        _check_record(data[position:record_end], seq + 1)
+                    except StorageError:
+                        break
+                    seq += 1
+                    recovered.append((seq, segment, end + position, record_length))
+                    position = record_end
+                if position < len(data):
+                    # Enregistrement incomplet ou corrompu : il n'a jamais été
+                    # confirmé, et rien de ce qui suit ne peut l'avoir été.
+                    os.truncate(path, end + position)
+                    _remove_segments_after(log_dir, segment)
+                    break
+            if not os.path.exists(next_path):
+                break
+            segment += 1
+            end = 0
+            path = next_path
+            next_path = os.path.join(log_dir, _SEGMENT_FORMAT.format(segment + 1))
+
+        if recovered:
+            with open(index_path, 'ab') as f:
+                f.write(b"".join(_INDEX_ENTRY.pack(*entry) for entry in recovered))
+            self._extend(username, recovered)
+
+    def import_legacy(self, username: str) -> int:
+        """
+        Importe dans le journal, dans l'ordre, les courriels du dossier au
+        format historique, puis les supprime. Retourne leur nombre.
+
+        Le journal est construit à côté puis mis en place d'un seul coup :
+        un import interrompu est simplement recommencé.
+        """
+        user_dir = self._user_dir(username)
+        log_dir = self._log_dir(username)
+        legacy = _legacy_files(user_dir)
+        if not legacy or os.path.isdir(log_dir):
+            return 0
+
+        def records():
+            for seq, filename in enumerate(legacy, start=1):
+                with open(os.path.join(user_dir, filename), 'rb') as f:
+                    yield seq, f.read()
+
+        new_dir = log_dir + ".new"
+        shutil.rmtree(new_dir, ignore_errors=True)
+        os.makedirs(new_dir)
+        _append_records(new_dir, records(), 1, self._segment_size, sync=True)
+        os.rename(new_dir, log_dir)
+        self._forget(username)
+        for filename in legacy:
+            os.remove(os.path.join(user_dir, filename))
+        return len(legacy)
+
+    def compact(self, username: str) -> tuple[int, int]:
+        """
+        Réécrit le journal du dossier en segments pleins, sans les octets qui
+        ne sont référencés par aucune entrée de l'index, en compressant les
+        courriels qui ne l'étaient pas. Retourne la taille du journal avant
+        et après.
+        """
+        self.recover(username)
+        log_dir = self._log_dir(username)
+        if not os.path.isdir(log_dir):
+            return 0, 0
+        before = _disk_usage(log_dir)
+        new_dir = log_dir + ".new"
+        shutil.rmtree(new_dir, ignore_errors=True)
+        os.makedirs(new_dir)
+        records = ((seq, _compress(data, self._compress_threshold))
+                   for seq, data in self.scan(username))
+        _append_records(new_dir, records, 1, self._segment_size, sync=True)
+        os.rename(log_dir, log_dir + ".old")
+        os.rename(new_dir, log_dir)
+        shutil.rmtree(log_dir + ".old")
+        self._forget(username)
+        return before, _disk_usage(log_dir)
+
+
+class BlobStore:
+    """
+    Stockage adressé par le contenu des corps partagés entre dossiers.
+
+    Chaque corps est écrit une seule fois dans le dossier SERVER_BLOBS_DIR,
+    dans un fichier nommé d'après son empreinte SHA-256, quel que soit le
+    nombre de dossiers qui y font référence. Les comptes de références sont
+    tenus dans un journal en ajout seul d'enregistrements (empreinte,
+    variation) ; un corps dont le compte retombe à zéro est supprimé.
+    L'empreinte est celle du corps, qui est compressé comme les courriels
+    des dossiers.
+
+    Les références sont journalisées avant l'écriture des dossiers qui les
+    contiennent : après un arrêt brutal, un compte peut être trop élevé,
+    jamais trop bas. `collect` les recompte à partir des dossiers.
+    """
+
+    def __init__(self, root: str, shared: bool = False,
+                 compress_threshold: int = COMPRESS_THRESHOLD) -> None:
+        self._dir = os.path.join(root, gloutils.SERVER_BLOBS_DIR)
+        self._shared = shared
+        self._compress_threshold = compress_threshold
+        self._counts = collections.Counter()
+        self._journal_size = None
+        self._guard = threading.Lock()
+        os.makedirs(self._dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._dir, key)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Exclut les autres fils et, en mode partagé, les autres processus,
+        puis met à jour les comptes avec la fin du journal.
+        """
+        with self._guard:
+            fd = None
+            if self._shared and fcntl is not None:
+                fd = os.open(os.path.join(self._dir, gloutils.LOCK_FILENAME),
+                             os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if self._journal_size is None or self._shared:
+                    self._load()
+                yield
+            finally:
+                if fd is not None:
+                    os.close(fd)
+
+    def _load(self) -> None:
+        """Applique aux comptes les enregistrements du journal non encore lus."""
+        path = os.path.join(self._dir, _REFS_FILENAME)
+        try:
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if self._journal_size is None or size < self._journal_size:
+                    # Premier accès, ou journal réécrit par `collect`.
+                    self._counts.clear()
+                    self._journal_size = 0
+                f.seek(self._journal_size)
+                data = f.read()
+        except FileNotFoundError:
+            self._counts.clear()
+            self._journal_size = 0
+            return
+        usable = len(data) - len(data) % _REF.size
+        for digest, delta in _REF.iter_unpack(data[:usable]):
+            self._counts[digest.hex()] += delta
+        self._journal_size += usable
+        if usable < len(data):
+            # Enregistrement incomplet : sa variation n'a jamais été confirmée.
+            os.truncate(path, self._journal_size)
+
+    def _journal(self, deltas: collections.Counter, sync: bool) -> None:
+        """Ajoute les variations au journal et aux comptes en mémoire."""
+        data = b"".join(_REF.pack(bytes.fromhex(key), delta)
+                        for key, delta in deltas.items() if delta)
+        fd = os.open(os.path.join(self._dir, _REFS_FILENAME),
+                     os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            _write_all(fd, [data])
+            if sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._journal_size += len(data)
+        self._counts.update(deltas)
+
+    def put(self, blobs: list[tuple[bytes, int]], sync: bool = False) -> list[str]:
+        """
+        Conserve les corps (données, nombre de références) et retourne leurs
+        empreintes. Un corps déjà présent n'est pas réécrit, seul son compte
+        augmente. Avec `sync`, corps et comptes sont forcés sur le disque.
+        """
+        keys = [hashlib.sha256(data).hexdigest() for data, _ in blobs]
+        deltas = collections.Counter()
+        with self._locked():
+            created = False
+            for key, (data, refs) in zip(keys, blobs):
+                deltas[key] += refs
+                path = self._path(key)
+                if os.path.exists(path):
+                    continue
+                fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    _write_all(fd, [_compress(data, self._compress_threshold)])
+                    if sync:
+                        os.fsync(fd)
+                finally:
+                    os.close(fd)
+                os.replace(path + ".tmp", path)
+                created = True
+            if sync and created:
+                _fsync_dir(self._dir)
+            self._journal(deltas, sync)
+        return keys
+
+    def read(self, key: str) -> bytes:
+        """
+        Retourne le corps d'empreinte `key`.
+
+        Lève une exception StorageError s'il est introuvable ou corrompu.
+        """
+        return b"".join(self.read_chunks(key))
+
+    def read_chunks(self, key: str):
+        """
+        Retourne un itérateur sur le corps d'empreinte `key`, décompressé
+        par morceaux d'au plus EMAIL_CHUNK_SIZE octets au fil de la lecture,
+        sans jamais le charger en entier. L'empreinte est vérifiée une fois
+        le dernier morceau produit.
+
+        Lève une exception StorageError si le corps est introuvable, ou en
+        cours d'itération s'il est corrompu.
+        """
+        try:
+            f = open(self._path(key), 'rb')
+        except FileNotFoundError as ex:
+            raise StorageError(f"Corps {key} introuvable") from ex
+        return _read_chunks(f, key)
+
+    def open_email(self, key: str) -> tuple:
+        """
+        Retourne les champs, sans `content`, du courriel d'empreinte `key`
+        et un itérateur sur son corps, décodé par morceaux au fil de la
+        lecture (voir `read_chunks` et `load_email`).
+
+        Lève une exception StorageError si le corps est introuvable ou
+        corrompu, ou ValueError si ses champs sont illisibles.
+        """
+        chunks = self.read_chunks(key)
+        head = []
+        for chunk in chunks:
+            head.append(chunk)
+            if b"\n" in chunk:
+                break
+        fields, separator, rest = b"".join(head).partition(b"\n")
+        if not separator:
+            # Corps partagé conservé en un seul document (voir `put`).
+            email_data = json.loads(fields)
+            return email_data, text_chunks(email_data.pop('content'))
+        return json.loads(fields), _decode_chunks(itertools.chain((rest,), chunks))
+
+    def open_frames(self, key: str) -> tuple | None:
+        """
+        Retourne les champs, sans `content`, du courriel d'empreinte `key` et
+        son corps tel qu'il est conservé par BlobWriter : des messages
+        glosocket à transmettre tels quels (voir glosocket.FileFrames), qui
+        ne sont ni lus ni vérifiés. Retourne None si le corps est conservé
+        sous une autre forme (voir `open_email`).
+
+        Lève une exception StorageError si le corps est introuvable ou
+        tronqué, ou ValueError si ses champs sont illisibles.
+        """
+        try:
+            f = open(self._path(key), 'rb')
+        except FileNotFoundError as ex:
+            raise StorageError(f"Corps {key} introuvable") from ex
+        try:
+            if f.read(len(_FRAMES_MAGIC)) != _FRAMES_MAGIC:
+                f.close()
+                return None
+            fields = json.loads(_read_frame(f, key))
+            offset = f.tell()
+            size = os.fstat(f.fileno()).st_size
+            f.seek(size - len(_END_FRAME))
+            if size - offset < len(_END_FRAME) or f.read() != _END_FRAME:
+                raise StorageError(f"Corps {key} tronqué")
+        except BaseException:
+            f.close()
+            raise
+        return fields, glosocket.FileFrames(f, offset, size - offset)
+
+    def writer(self, fields: dict) -> "BlobWriter":
+        """
+        Commence l'écriture en continu d'un courriel dont les champs, sans
+        `content`, sont `fields` ; son corps est ensuite ajouté morceau par
+        morceau (voir BlobWriter).
+        """
+        return BlobWriter(self, fields)
+
+    def _adopt(self, path: str, key: str, refs: int, sync: bool) -> None:
+        """
+        Range sous l'empreinte `key` le corps écrit dans le fichier
+        temporaire `path` (voir BlobWriter) et lui ajoute `refs` références.
+        """
+        with self._locked():
+            target = self._path(key)
+            if os.path.exists(target):
+                os.remove(path)
+            else:
+                os.replace(path, target)
+                if sync:
+                    _fsync_dir(self._dir)
+            self._journal(collections.Counter({key: refs}), sync)
+
+    def release(self, keys: list[str], sync: bool = False) -> None:
+        """
+        Retire une référence à chacun des corps (une par occurrence dans
+        `keys`) et supprime ceux qui ne sont plus référencés.
+        """
+        with self._locked():
+            deltas = collections.Counter()
+            for key in keys:
+                deltas[key] -= 1
+            self._journal(deltas, sync)
+            for key in deltas:
+                if self._counts[key] <= 0:
+                    del self._counts[key]
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(self._path(key))
+
+    def collect(self, references: dict) -> tuple[int, int]:
+        """
+        Remplace les comptes par `references`, le nombre de références de
+        chaque corps relevé dans les dossiers, et supprime les corps qui n'y
+        figurent pas. Retourne le nombre de corps supprimés et leur taille.
+        """
+        removed = freed = 0
+        with self._locked():
+            for entry in os.scandir(self._dir):
+                if entry.name.endswith(".tmp"):
+                    os.remove(entry.path)
+                elif _is_blob_key(entry.name) and references.get(entry.name, 0) <= 0:
+                    freed += entry.stat().st_size
+                    removed += 1
+                    os.remove(entry.path)
+            counts = collections.Counter(
+                {key: count for key, count in references.items() if count > 0})
+            path = os.path.join(self._dir, _REFS_FILENAME)
+            with open(path + ".tmp", 'wb') as f:
+                f.write(b"".join(_REF.pack(bytes.fromhex(key), count)
+                                 for key, count in counts.items()))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            self._counts = counts
+            self._journal_size = len(counts) * _REF.size
+        return removed, freed
+
+
+class BlobWriter:
+    """
+    Courriel écrit en continu dans un BlobStore (voir `BlobStore.writer`).
+
+    Le courriel est conservé sous la forme d'une suite de messages
+    glosocket, préfixés de leur longueur (voir glosocket.frame_mesg) : ses
+    champs en JSON, puis son corps en UTF-8, par morceaux d'au plus
+    EMAIL_CHUNK_SIZE octets compressés chacun comme les messages du réseau,
+    puis un message vide. Le corps peut ainsi être transmis tel quel (voir
+    `BlobStore.open_frames`).
+
+    Les morceaux sont écrits et hachés au fil de l'eau dans un fichier
+    temporaire, que `commit` renomme d'après l'empreinte obtenue, celle des
+    champs et du corps séparés par un saut de ligne (voir `load_email`). Le
+    corps n'est ainsi jamais en entier en mémoire. `size` est le nombre
+    d'octets écrits, avant compression.
+    """
+
+    def __init__(self, store: BlobStore, fields: dict) -> None:
+        self._store = store
+        fd, self._path = tempfile.mkstemp(suffix=".tmp", dir=store._dir)
+        os.fchmod(fd, 0o644)
+        self._file = os.fdopen(fd, 'wb')
+        self._pending = bytearray()
+        try:
+            line = json.dumps(fields).encode('utf-8')
+            self._file.write(_FRAMES_MAGIC + glosocket.frame_mesg(line))
+        except BaseException:
+            self.abort()
+            raise
+        self._digest = hashlib.sha256(line + b"\n")
+        self.size = len(line) + 1
+
+    def write(self, data: bytes) -> None:
+        """Ajoute un morceau au courriel."""
+        self._digest.update(data)
+        self.size += len(data)
+        self._pending += data
+        size = gloutils.EMAIL_CHUNK_SIZE
+        if len(self._pending) >= size:
+            end = len(self._pending) - len(self._pending) % size
+            for start in range(0, end, size):
+                self._write_frame(self._pending[start:start + size])
+            del self._pending[:end]
+
+    def _write_frame(self, chunk: bytes) -> None:
+        """Écrit un morceau du corps sous la forme d'un message glosocket."""
+        threshold = self._store._compress_threshold
+        if threshold:
+            chunk = glosocket.compress_mesg(bytes(chunk), threshold)
+        self._file.write(glosocket.frame_mesg(chunk))
+
+    def commit(self, refs: int, sync: bool = False) -> str:
+        """
+        Termine le courriel, lui attribue `refs` références et retourne son
+        empreinte. Un corps identique déjà conservé n'est pas remplacé, seul
+        son compte augmente. Avec `sync`, corps et comptes sont forcés sur
+        le disque. En cas d'échec, le fichier temporaire est supprimé.
+        """
+        try:
+            if self._pending:
+                self._write_frame(self._pending)
+            self._file.write(_END_FRAME)
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+            self._file.close()
+            key = self._digest.hexdigest()
+            self._store._adopt(self._path, key, refs, sync)
+        except BaseException:
+            self.abort()
+            raise
+        return key
+
+    def abort(self) -> None:
+        """Abandonne le courriel et supprime son fichier temporaire."""
+        with contextlib.suppress(OSError, ValueError):
+            self._file.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path)
+
+
+def _read_chunks(f, key: str):
+    """Produit les morceaux décompressés du corps ouvert `f` (voir `BlobStore.read_chunks`)."""
+    digest = hashlib.sha256()
+    with f:
+        if f.read(len(_FRAMES_MAGIC)) == _FRAMES_MAGIC:
+            chunks = _read_frames(f, key)
+        else:
+            f.seek(0)
+            chunks = _read_stream(f, key)
+        for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+    if digest.hexdigest() != key:
+        raise StorageError(f"Corps {key} corrompu")
+
+
+def _read_frame(f, key: str) -> bytes:
+    """
+    Lit le prochain message du corps ouvert `f`, conservé par BlobWriter.
+
+    Lève une exception StorageError s'il est tronqué ou corrompu.
+    """
+    try:
+        data = glosocket.read_mesg_bytes(f)
+    except glosocket.GLOSocketError as ex:
+        raise StorageError(f"Corps {key} corrompu") from ex
+    if data is None:
+        raise StorageError(f"Corps {key} tronqué")
+    return data
+
+
+def _read_frames(f, key: str):
+    """
+    Produit les champs, suivis d'un saut de ligne, puis les morceaux du
+    corps ouvert `f`, conservé par BlobWriter.
+    """
+    yield _read_frame(f, key) + b"\n"
+    while chunk := _read_frame(f, key):
+        yield chunk
+
+
+def _read_stream(f, key: str):
+    """Produit les morceaux d'un corps conservé en un seul flux, compressé ou non."""
+    size = gloutils.EMAIL_CHUNK_SIZE
+    data = f.read(size)
+    decompressor = zlib.decompressobj() if data[:1] == _ZLIB_MAGIC else None
+    try:
+        while data:
+            if decompressor is None:
+                yield data
+            else:
+                # La taille des morceaux produits est bornée, quel que
+                # soit le taux de compression.
+                while data:
+                    chunk = decompressor.decompress(data, size)
+                    data = decompressor.unconsumed_tail
+                    if chunk:
+                        yield chunk
+            data = f.read(size)
+        if decompressor is not None:
+            chunk = decompressor.flush()
+            if chunk:
+                yield chunk
+            if not decompressor.eof:
+                raise StorageError(f"Corps {key} tronqué")
+    except zlib.error as ex:
+        raise StorageError(f"Corps {key} corrompu") from ex
+
+
+def _decode_chunks(chunks):
+    """Décode en UTF-8 des morceaux d'octets, même coupés au milieu d'un caractère."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def text_chunks(text: str):
+    """Produit les morceaux d'au plus EMAIL_CHUNK_SIZE caractères d'un texte."""
+    size = gloutils.EMAIL_CHUNK_SIZE
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+def load_email(data: bytes) -> dict:
+    """
+    Décode un courriel conservé par BlobStore : un document JSON (voir
+    `BlobStore.put`), ou ses champs suivis de son corps (voir BlobWriter).
+
+    Lève ValueError si le courriel est illisible.
+    """
+    fields, separator, content = data.partition(b"\n")
+    email_data = json.loads(fields)
+    if separator:
+        email_data['content'] = str(content, 'utf-8')
+    return email_data
+
+
+def search_terms(text: str) -> set[str]:
+    """Retourne les termes d'un texte : ses mots, en minuscules."""
+    return {term for term in _TERM.findall(text.casefold())
+            if len(term) <= MAX_TERM_LENGTH}
+
+
+def email_terms(email_data: dict, body=None) -> set[str]:
+    """
+    Retourne les termes de l'expéditeur, du sujet et du corps d'un
+    courriel. Le corps est `content`, ou à défaut l'itérable `body` de ses
+    morceaux, qui n'est jamais chargé en entier.
+    """
+    if body is None:
+        return search_terms(" ".join((email_data['sender'], email_data['subject'],
+                                      email_data['content'])))
+    terms = search_terms(" ".join((email_data['sender'], email_data['subject'])))
+    tail = ""
+    for chunk in body:
+        text = tail + chunk
+        # Le dernier mot d'un morceau peut se poursuivre dans le suivant.
+        end = len(text)
+        while end and (text[end - 1].isalnum() or text[end - 1] == "_"):
+            end -= 1
+        terms |= search_terms(text[:end])
+        # Un mot trop long pour être un terme le reste, même tronqué.
+        tail = text[end:][-(MAX_TERM_LENGTH + 1):]
+    terms |= search_terms(tail)
+    return terms
+
+
+def _email_time(date: str) -> float:
+    """Retourne la date d'un courriel en secondes Unix, ou 0 si elle est invalide."""
+    try:
+        return email.utils.parsedate_to_datetime(date).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return 0.0
+
+
+class SearchIndex:
+    """
+    Index inversé des courriels d'un dossier : associe chaque terme de
+    l'expéditeur, du sujet et du corps aux numéros des courriels qui le
+    contiennent, et chaque courriel à sa date.
+
+    L'index est conservé dans un journal en ajout seul d'enregistrements
+    (numéro, date, termes), relu au premier accès puis à chaque `refresh`
+    pour y trouver les courriels indexés par les autres processus. Un
+    enregistrement incomplet ou corrompu est retiré du journal avec ceux
+    qui le suivent : ces courriels manquent alors à l'index (voir
+    `__contains__`) et doivent y être ajoutés à nouveau.
+
+    Les méthodes qui lisent ou modifient le journal doivent être appelées
+    sous le verrou du dossier.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._postings = {}
+        self._times = {}
+        self._order = []  # Numéros des courriels, du plus ancien au plus récent.
+        self._journal_size = 0
+
+    def __len__(self) -> int:
+        return len(self._times)
+
+    def __contains__(self, seq: int) -> bool:
+        return seq in self._times
+
+    @staticmethod
+    def _records(emails: list[tuple[int, str, set]]) -> bytes:
+        """Encode les enregistrements du journal des courriels (numéro, date, termes)."""
+        chunks = []
+        for seq, date, terms in emails:
+            data = "\0".join(terms).encode('utf-8')
+            chunks.append(_SEARCH_RECORD.pack(seq, _email_time(date),
+                                              len(data), zlib.crc32(data)))
+            chunks.append(data)
+        return b"".join(chunks)
+
+    @classmethod
+    def append(cls, path: str, emails: list[tuple[int, str, set]]) -> None:
+        """
+        Ajoute les courriels (numéro, date, termes obtenus par `email_terms`)
+        au journal `path` sans charger l'index.
+        """
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            _write_all(fd, [cls._records(emails)])
+        finally:
+            os.close(fd)
+
+    def add(self, emails: list[tuple[int, str, set]]) -> None:
+        """Ajoute les courriels (numéro, date, termes) au journal et à l'index."""
+        self.refresh()
+        self.append(self._path, emails)
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Applique à l'index les enregistrements du journal non encore lus."""
+        try:
+            with open(self._path, 'rb') as f:
+                f.seek(self._journal_size)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        offset = 0
+        added = []
+        unsorted = set()
+        while offset + _SEARCH_RECORD.size <= len(data):
+            seq, when, length, crc = _SEARCH_RECORD.unpack_from(data, offset)
+            start = offset + _SEARCH_RECORD.size
+            terms = data[start:start + length]
+            if len(terms) != length or zlib.crc32(terms) != crc:
+                break
+            offset = start + length
+            if seq in self._times:
+                continue
+            self._times[seq] = when
+            added.append(seq)
+            for term in str(terms, 'utf-8').split("\0") if terms else ():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = array.array('q')
+                elif postings[-1] > seq:
+                    unsorted.add(term)
+                postings.append(seq)
+        self._journal_size += offset
+        if offset < len(data):
+            # Écriture interrompue : les courriels qui suivent seront réindexés.
+            os.truncate(self._path, self._journal_size)
+        for term in unsorted:
+            self._postings[term] = array.array('q', sorted(self._postings[term]))
+        if added:
+            added.sort(key=self._rank)
+            # Les courriels arrivent presque toujours dans l'ordre des dates.
+            late = self._order and self._rank(added[0]) < self._rank(self._order[-1])
+            self._order.extend(added)
+            if late:
+                self._order.sort(key=self._rank)
+
+    def _rank(self, seq: int) -> tuple[float, int]:
+        """Clé de tri des courriels par date, puis par numéro."""
+        return self._times[seq], seq
+
+    def search(self, query: str, offset: int = 0,
+               limit: int | None = None) -> tuple[list[int], int]:
+        """
+        Retourne les numéros des courriels qui contiennent tous les termes
+        de `query`, du plus récent au plus ancien selon leur date, en sautant
+        les `offset` premiers et en s'arrêtant à `limit`, ainsi que le nombre
+        total de courriels trouvés.
+        """
+        terms = search_terms(query)
+        if not terms:
+            return [], 0
+        # Les listes de numéros sont triées : les plus courtes, parcourues
+        # en premier, sont cherchées par dichotomie dans les plus longues.
+        postings = sorted((self._postings.get(term, ()) for term in terms), key=len)
+        matches = postings[0]
+        for other in postings[1:]:
+            if not matches:
+                break
+            if len(matches) * 16 < len(other):
+                matches = [seq for seq in matches if _sorted_contains(other, seq)]
+            else:
+                matches = set(matches).intersection(other)
+        matches = set(matches)
+        count = len(matches)
+        end = count if limit is None else min(offset + limit, count)
+        if count * 16 >= len(self._order):
+            # Résultats nombreux : le parcours des courriels du plus récent
+            # au plus ancien les trouve vite.
+            ranked = []
+            for seq in reversed(self._order):
+                if len(ranked) == end:
+                    break
+                if seq in matches:
+                    ranked.append(seq)
+        else:
+            ranked = heapq.nlargest(end, matches, key=self._rank)
+        return ranked[offset:], count
+
+
+def _sorted_contains(items, value) -> bool:
+    """Indique si la séquence triée `items` contient `value`."""
+    i = bisect.bisect_left(items, value)
+    return i < len(items) and items[i] == value
+
+
+def _is_blob_key(name: str) -> bool:
+    """Indique si un nom de fichier est une empreinte de corps."""
+    return len(name) == 64 and all(c in "0123456789abcdef" for c in name)
+
+
+def _blob_reference(data: bytes) -> str | None:
+    """Retourne l'empreinte du corps partagé d'un courriel, s'il y en a un."""
+    try:
+        email = json.loads(data)
+    except ValueError:
+        return None
+    return email.get(BLOB_FIELD) if isinstance(email, dict) else None
+
+
+def _check_record(raw: bytes, seq: int) -> bytes:
+    """Vérifie un enregistrement lu d'un segment et retourne ses données."""
+    if len(raw) < _RECORD.size:
+        raise StorageError(f"Courriel {seq} tronqué")
+    length, record_seq, crc = _RECORD.unpack_from(raw)
+    data = raw[_RECORD.size:]
+    if record_seq != seq or len(data) != length or zlib.crc32(data) != crc:
+        raise StorageError(f"Courriel {seq} corrompu")
+    return data
+
+
+def _write_all(fd: int, buffers: list) -> None:
+    """Écrit les tampons bout à bout, en reprenant après une écriture partielle."""
+    views = [memoryview(buffer) for buffer in buffers if len(buffer)]
+    while views:
+        written = os.writev(fd, views)
+        while written and written >= len(views[0]):
+            written -= len(views.pop(0))
+        if written:
+            views[0] = views[0][written:]
+
+
+def _append_records(log_dir: str, records, segment: int, segment_size: int,
+                    sync: bool = False) -> list[tuple]:
+    """
+    Ajoute les enregistrements (séquence, données) à la fin du journal, à
+    partir du segment `segment`, puis leurs entrées à l'index, et retourne
+    ces entrées. Avec `sync`, les fichiers sont forcés sur le disque.
+    """
+    entries = []
+    path = os.path.join(log_dir, _SEGMENT_FORMAT.format(segment))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        offset = os.fstat(fd).st_size
+        created = not offset
+        for seq, data in records:
+            size = _RECORD.size + len(data)
+            if offset and offset + size > segment_size:
+                if sync:
+                    os.fsync(fd)
+                os.close(fd)
+                segment += 1
+                path = os.path.join(log_dir, _SEGMENT_FORMAT.format(segment))
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                offset = os.fstat(fd).st_size
+                created = True
+            _write_all(fd, [_RECORD.pack(len(data), seq, zlib.crc32(data)), data])
+            entries.append((seq, segment, offset, len(data)))
+            offset += size
+        if sync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    index_fd = os.open(os.path.join(log_dir, _INDEX_FILENAME),
+                       os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        _write_all(index_fd, [b"".join(_INDEX_ENTRY.pack(*entry) for entry in entries)])
+        if sync:
+            os.fsync(index_fd)
+    finally:
+        os.close(index_fd)
+    if sync and created:
+        _fsync_dir(log_dir)
+    return entries
+
+
+def _remove_segments_after(log_dir: str, segment: int) -> None:
+    """Supprime les segments qui suivent `segment`."""
+    while True:
+        segment += 1
+        try:
+            os.remove(os.path.join(log_dir, _SEGMENT_FORMAT.format(segment)))
+        except FileNotFoundError:
+            return
+
+
+def _finish_swap(log_dir: str) -> None:
+    """
+    Termine la mise en place d'un journal réécrit si l'arrêt est survenu
+    entre les deux renommages, sinon abandonne le journal en construction.
+    """
+    new_dir, old_dir = log_dir + ".new", log_dir + ".old"
+    if os.path.isdir(new_dir):
+        if not os.path.isdir(log_dir) and os.path.isdir(old_dir):
+            os.rename(new_dir, log_dir)
+        else:
+            shutil.rmtree(new_dir)
+    if os.path.isdir(old_dir):
+        shutil.rmtree(old_dir)
+
+
+def _disk_usage(directory: str) -> int:
+    """Retourne la taille totale des fichiers du dossier."""
+    return sum(entry.stat().st_size for entry in os.scandir(directory))
+
+
+STORES = {"segments": SegmentStore, "files": FileStore}
+DEFAULT_STORE = "segments"
+
+
+def list_users(root: str) -> list[str]:
+    """
+    Retourne les noms des utilisateurs du dossier de données `root`, que
+    leur dossier soit à son emplacement réparti ou encore à l'ancien.
+    """
+    users_dir = os.path.join(root, gloutils.SERVER_USERS_DIR)
+    directories = [root]
+    if os.path.isdir(users_dir):
+        directories.extend(
+            os.path.join(users_dir, first, second)
+            for first in os.listdir(users_dir)
+            for second in os.listdir(os.path.join(users_dir, first)))
+    return sorted(
+        entry.name for directory in directories for entry in os.scandir(directory)
+        if entry.is_dir(follow_symlinks=False) and os.path.isfile(
+            os.path.join(entry.path, gloutils.PASSWORD_FILENAME)))
+
+
+@contextlib.contextmanager
+def _locked_mailbox(username: str):
+    """Verrouille le dossier, pour exclure les processus serveurs en mode partagé."""
+    lock_fd = os.open(os.path.join(user_dir(gloutils.SERVER_DATA_DIR, username),
+                                   gloutils.LOCK_FILENAME),
+                      os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(lock_fd)
+
+
+def _count_references(store: SegmentStore) -> collections.Counter:
+    """
+    Relève les références aux corps partagés de tous les dossiers, qu'ils
+    soient au format historique ou dans un journal.
+    """
+    legacy = FileStore(gloutils.SERVER_DATA_DIR)
+    references = collections.Counter()
+    for username in list_users(gloutils.SERVER_DATA_DIR):
+        with _locked_mailbox(username):
+            log_dir = store._log_dir(username)
+            _finish_swap(log_dir)
+            if os.path.isdir(log_dir):
+                # Réindexe les courriels écrits mais pas encore indexés.
+                store.recover(username)
+            for mailbox in (store, legacy):
+                for _, data in mailbox.scan(username):
+                    key = _blob_reference(data)
+                    if key is not None:
+                        references[key] += 1
+    return references
+
+
+def _shard(username: str) -> bool:
+    """
+    Déplace, sous son verrou, le dossier de l'utilisateur de l'ancien
+    emplacement vers l'emplacement réparti. Un lien symbolique le remplace
+    à l'ancien emplacement, pour les opérations en cours qui l'auraient déjà
+    résolu ; il n'est supprimé que serveur arrêté (voir `_remove_shard_links`).
+    Retourne faux si le dossier n'était pas à l'ancien emplacement.
+    """
+    old_dir = os.path.join(gloutils.SERVER_DATA_DIR, username)
+    if os.path.islink(old_dir) or not os.path.isdir(old_dir):
+        return False
+    with _locked_mailbox(username):
+        new_dir = _sharded_dir(gloutils.SERVER_DATA_DIR, username)
+        os.makedirs(os.path.dirname(new_dir), exist_ok=True)
+        os.rename(old_dir, new_dir)
+        os.symlink(os.path.relpath(new_dir, gloutils.SERVER_DATA_DIR), old_dir)
+    return True
+
+
+def _remove_shard_links() -> int:
+    """
+    Supprime les liens laissés à l'ancien emplacement par `_shard` et
+    retourne leur nombre. Serveur en marche, une lecture qui a résolu un
+    lien peut l'utiliser à tout moment, même sans le verrou du dossier :
+    ils ne sont donc supprimés que par les outils hors ligne.
+    """
+    prefix = gloutils.SERVER_USERS_DIR + os.sep
+    links = [entry.path for entry in os.scandir(gloutils.SERVER_DATA_DIR)
+             if entry.is_symlink() and os.readlink(entry.path).startswith(prefix)]
+    for link in links:
+        os.remove(link)
+    return len(links)
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Outils du stockage des dossiers (serveur arrêté, sauf shard).")
+    parser.add_argument("command", choices=("migrate", "compact", "gc", "shard"),
+                        help="migrate : importe les dossiers au format historique ; "
+                             "compact : réécrit les journaux ; "
+                             "gc : supprime les corps partagés orphelins ; "
+                             "shard : répartit les dossiers de l'ancienne "
+                             "arborescence à plat.")
+    parser.add_argument("usernames", nargs="*",
+                        help="Utilisateurs à traiter (tous par défaut, "
+                             "toujours tous pour gc).")
+    parser.add_argument("--compress-threshold", action="store",
+                        dest="compress_threshold", type=int,
+                        default=COMPRESS_THRESHOLD,
+                        help="Taille, en octets, à partir de laquelle migrate "
+                             "et compact compressent les courriels (0 : "
+                             "jamais) ; donner celle du serveur.")
+    args = parser.parse_args(sys.argv[1:])
+    store = SegmentStore(gloutils.SERVER_DATA_DIR,
+                         compress_threshold=args.compress_threshold)
+    if args.command == "gc":
+        removed, freed = BlobStore(gloutils.SERVER_DATA_DIR).collect(
+            _count_references(store))
+        print(f"{removed} corps supprimé(s), {freed} octets libérés.")
+        return 0
+    if args.command == "shard":
+        usernames = args.usernames or list_users(gloutils.SERVER_DATA_DIR)
+        moved = sum(_shard(username) for username in usernames)
+        print(f"{moved} dossier(s) déplacé(s).")
+        return 0
+    for username in args.usernames or list_users(gloutils.SERVER_DATA_DIR):
+        with _locked_mailbox(username):
+            if args.command == "migrate":
+                _finish_swap(store._log_dir(username))
+                count = store.import_legacy(username)
+                print(f"{username} : {count} courriel(s) importé(s).")
+            else:
+                before, after = store.compact(username)
+                print(f"{username} : {before} -> {after} octets.")
+    print(f"{_remove_shard_links()} lien(s) de shard supprimé(s).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
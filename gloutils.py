@@ -9,8 +9,15 @@ import datetime
 APP_PORT = 9672
 SERVER_DATA_DIR = "glo_server_data"
 SERVER_LOST_DIR = "LOST"
+SERVER_WORKERS_DIR = "WORKERS"
+SERVER_BLOBS_DIR = "BLOBS"
+SERVER_USERS_DIR = "USERS"
+SERVER_SESSIONS_DIR = "SESSIONS"
 SERVER_DOMAIN = "glo2000.ca"
 PASSWORD_FILENAME = "pass"  # nosec:B105
+STATS_FILENAME = "stats"
+LOCK_FILENAME = "lock"
+SEARCH_FILENAME = "search"
 
 CLIENT_AUTH_CHOICE = """Menu de connexion
 1. Créer un compte
@@ -20,9 +27,16 @@ CLIENT_USE_CHOICE = """Menu principal
 1. Consultation de courriels
 2. Envoi de courriels
 3. Statistiques
-4. Se déconnecter"""
+4. Se déconnecter
+5. Exporter les courriels
+6. Rechercher des courriels"""
 
 SUBJECT_DISPLAY = "#{number} {sender} - {subject} {date}"
+INBOX_PAGE_SIZE = 20
+INBOX_SYNC_BATCH = 1000
+EMAIL_CHUNK_SIZE = 64 * 1024  # Caractères par morceau d'un corps transmis en continu.
+INBOX_PAGE_PROMPT = ("Entrez le numéro du courriel à lire "
+                     "(s: page suivante, p: page précédente) : ")
 
 EMAIL_DISPLAY = """De : {sender}
 À : {to}
@@ -33,7 +47,17 @@ Date : {date}
 """
 
 STATS_DISPLAY = """Nombre de messages : {count}
-Taille du dossier : {size} octets"""
+Taille du dossier : {size} octets
+Taille sur le disque : {stored_size} octets"""
+
+SERVER_STATS_DISPLAY = """Processus serveurs : {workers}
+Connexions ouvertes : {connections}
+Connexions acceptées : {accepted}
+Requêtes traitées : {requests}
+Cache des courriels : {cache_hits} succès, {cache_misses} échecs, \
+{cache_evictions} évictions"""
+
+NEW_EMAIL_DISPLAY = "Nouveau courriel de {sender} : {subject} {date}"
 
 
 class Headers(enum.IntEnum):
@@ -55,6 +79,22 @@ class Headers(enum.IntEnum):
 
     STATS_REQUEST = enum.auto()
 
+    HELLO = enum.auto()
+
+    AUTH_RESUME = enum.auto()
+
+    SUBSCRIBE = enum.auto()
+    NEW_EMAIL = enum.auto()
+
+    INBOX_SYNC = enum.auto()
+    INBOX_READING_BATCH = enum.auto()
+
+    SEARCH = enum.auto()
+
+    EMAIL_STREAM_START = enum.auto()
+    EMAIL_CHUNK = enum.auto()
+    EMAIL_STREAM_END = enum.auto()
+
 
 class ErrorPayload(TypedDict, total=True):
     """Payload pour les messages d'erreurs."""
@@ -67,6 +107,25 @@ class AuthPayload(TypedDict, total=True):
     password: str
 
 
+class SessionPayload(TypedDict, total=True):
+    """
+    Payload du succès d'une requête LOGIN/REGISTER.
+
+    `token` identifie la session ouverte, jusqu'au moment `expires`
+    (secondes depuis l'époque Unix) ou jusqu'à la requête LOGOUT.
+    """
+    token: str
+    expires: int
+
+
+class ResumePayload(TypedDict, total=True):
+    """
+    Payload pour la requête AUTH_RESUME, qui rattache une nouvelle connexion à
+    la session `token` sans renvoyer les identifiants.
+    """
+    token: str
+
+
 class EmailContentPayload(TypedDict, total=True):
     """Payload pour les transferts de courriels."""
     sender: str
@@ -76,20 +135,226 @@ class EmailContentPayload(TypedDict, total=True):
     content: str
 
 
+class EmailSendingPayload(EmailContentPayload, total=False):
+    """
+    Payload pour l'envoi d'un courriel à plusieurs destinataires.
+
+    `destinations` liste les adresses auxquelles livrer le courriel en une
+    seule requête ; `destination` n'est alors que le champ « À » affiché.
+    Sans cette liste, le courriel est livré à `destination`.
+    """
+    destinations: list[str]
+
+
+class EmailStreamPayload(TypedDict, total=False):
+    """
+    Payload de l'entête EMAIL_STREAM_START, qui commence l'envoi d'un
+    courriel dont le corps suit en plusieurs messages EMAIL_CHUNK, terminés
+    par l'entête EMAIL_STREAM_END.
+
+    Les champs sont ceux d'EmailSendingPayload, sans `content`. Seul
+    EMAIL_STREAM_END reçoit une réponse, celle d'EMAIL_SENDING.
+    """
+    sender: str
+    destination: str
+    destinations: list[str]
+    subject: str
+    date: str
+
+
+class ChunkPayload(TypedDict, total=True):
+    """
+    Payload de l'entête EMAIL_CHUNK : un morceau d'au plus EMAIL_CHUNK_SIZE
+    caractères du corps d'un courriel transmis en continu.
+    """
+    data: str
+
+
+class DeliveryReportPayload(TypedDict, total=True):
+    """
+    Payload de la réponse à un envoi avec `destinations`.
+
+    `results` donne, dans l'ordre des destinataires, le message d'erreur de
+    chacun, ou une chaîne vide si le courriel lui a été livré.
+    """
+    results: list[str]
+
+
+class EmailListRequestPayload(TypedDict, total=False):
+    """
+    Payload optionnel pour la requête INBOX_READING_REQUEST.
+
+    `offset` est le nombre de courriels (les plus récents) à sauter et
+    `limit` le nombre maximal de courriels à retourner. Sans payload, la
+    liste complète est retournée.
+    """
+    offset: int
+    limit: int
+
+
 class EmailListPayload(TypedDict, total=True):
-    """Payload pour les consulation de courriel."""
+    """
+    Payload pour les consulation de courriel.
+
+    `email_list` ne contient que la fenêtre demandée, `offset` sa position
+    et `total` le nombre de courriels dans le dossier.
+    """
     email_list: list[str]
+    offset: int
+    total: int
+
+
+class SyncRequestPayload(TypedDict, total=False):
+    """
+    Payload pour la requête INBOX_SYNC.
+
+    Demande les entêtes des courriels dont le numéro (`seq`, croissant à
+    partir de 1 dans chaque dossier) dépasse `after`, au plus `limit` à la
+    fois. Sans `after`, tous les courriels sont retournés.
+    """
+    after: int
+    limit: int
+
 
+class SyncPayload(TypedDict, total=True):
+    """
+    Payload de la réponse à INBOX_SYNC.
+
+    Les listes `seqs`, `senders`, `subjects` et `dates` décrivent, dans
+    l'ordre des numéros, les courriels demandés. `last_seq` est le numéro
+    du plus récent courriel du dossier (0 s'il est vide) : le client est à
+    jour lorsqu'il l'a reçu.
+    """
+    seqs: list[int]
+    senders: list[str]
+    subjects: list[str]
+    dates: list[str]
+    last_seq: int
 
-class EmailChoicePayload(TypedDict, total=True):
-    """Payload pour le choix du courriel à consulter."""
+
+class EmailChoicePayload(TypedDict, total=False):
+    """
+    Payload pour le choix du courriel à consulter.
+
+    Avec `stream`, le courriel est transmis en continu : une réponse OK
+    contenant ses champs sans `content`, puis son corps en plusieurs
+    messages EMAIL_CHUNK, terminés par EMAIL_STREAM_END, ou par ERROR si
+    la lecture échoue en cours de route.
+
+    Avec `raw` en plus, le serveur peut transmettre le corps tel qu'il le
+    conserve, s'il en a la possibilité et que le client a accepté la
+    compression des messages : la réponse OK contient alors `raw`, et le
+    corps suit en messages bruts (octets UTF-8, sans entête ni encodage)
+    terminés par un message vide. Aucun message n'est poussé au client
+    pendant une transmission en continu.
+    """
     choice: int
+    stream: bool
+    raw: bool
+
+
+class EmailBatchRequestPayload(TypedDict, total=False):
+    """
+    Payload pour la requête INBOX_READING_BATCH.
+
+    Demande le contenu des courriels dont le numéro (voir SyncRequestPayload)
+    figure dans `seqs`, ou à défaut de ceux dont le numéro dépasse `after`,
+    au plus `limit`.
+    """
+    seqs: list[int]
+    after: int
+    limit: int
+
+
+class EmailBatchPayload(TypedDict, total=True):
+    """
+    Payload de la réponse à INBOX_READING_BATCH.
+
+    Les listes décrivent, dans l'ordre demandé, les courriels retournés. Le
+    serveur borne la taille de la réponse : s'il manque des courriels, le
+    client redemande ceux qui suivent le dernier reçu. `last_seq` est le
+    numéro du plus récent courriel du dossier.
+    """
+    seqs: list[int]
+    senders: list[str]
+    destinations: list[str]
+    subjects: list[str]
+    dates: list[str]
+    contents: list[str]
+    last_seq: int
+
+
+class SearchRequestPayload(TypedDict, total=False):
+    """
+    Payload pour la requête SEARCH.
+
+    `query` est une liste de mots, recherchés sans égard à la casse dans
+    l'expéditeur, le sujet et le corps des courriels. `offset` est le nombre
+    de résultats (les plus récents) à sauter et `limit` le nombre maximal
+    de résultats à retourner.
+    """
+    query: str
+    offset: int
+    limit: int
+
+
+class SearchPayload(TypedDict, total=True):
+    """
+    Payload de la réponse à SEARCH.
+
+    `seqs` donne les numéros (voir SyncRequestPayload) des courriels qui
+    contiennent tous les mots recherchés, du plus récent au plus ancien
+    selon leur date, et `total` le nombre de courriels trouvés.
+    """
+    seqs: list[int]
+    total: int
 
 
 class StatsPayload(TypedDict, total=True):
-    """Payload pour les statistiques."""
+    """
+    Payload pour les statistiques.
+
+    `size` est la taille des courriels du dossier et `stored_size` la place
+    qu'ils y occupent après compression, sans les courriels partagés avec
+    d'autres dossiers, conservés une seule fois hors du dossier.
+    """
     count: int
     size: int
+    stored_size: int
+
+
+class NotificationPayload(TypedDict, total=True):
+    """
+    Payload de l'entête NEW_EMAIL, que le serveur pousse sans requête (donc
+    sans `request_id`) aux sockets inscrits avec l'entête SUBSCRIBE dès
+    qu'un courriel est livré à leur dossier.
+
+    `seq` est le numéro du courriel dans le dossier, croissant à partir de 1.
+    """
+    seq: int
+    sender: str
+    subject: str
+    date: str
+
+
+class CodecPayload(TypedDict, total=False):
+    """
+    Payload pour la négociation de l'encodage (entête HELLO).
+
+    Le client propose ses `codecs` par ordre de préférence et le serveur
+    répond avec le `codec` retenu, utilisé dans les deux sens dès le message
+    suivant. La négociation est encodée avec l'encodage en vigueur, JSON
+    pour la première ; une nouvelle négociation l'est donc avec le `codec`
+    retenu par la précédente, de même que sa réponse.
+
+    De même, le client peut proposer des `compressions` ; le serveur répond
+    avec la `compression` retenue, s'il y en a une, et les deux pairs
+    peuvent dès lors compresser leurs messages (voir glosocket).
+    """
+    codecs: list[str]
+    codec: str
+    compressions: list[str]
+    compression: str
 
 
 class GloMessage(TypedDict, total=False):
@@ -98,10 +363,21 @@ class GloMessage(TypedDict, total=False):
 
     Les classes *Payload correspondent à des entêtes spécifiques
     certaines entêtes n'ont pas besoin de payload.
+
+    Le champ facultatif `request_id` est recopié tel quel dans la réponse,
+    ce qui permet au client d'envoyer plusieurs requêtes sans attendre
+    leurs réponses et de les apparier ensuite.
     """
     header: Headers
-    payload: Union[ErrorPayload, AuthPayload, EmailContentPayload,
-                   EmailListPayload, EmailChoicePayload, StatsPayload]
+    request_id: int
+    payload: Union[ErrorPayload, AuthPayload, SessionPayload, ResumePayload,
+                   EmailContentPayload, EmailSendingPayload, EmailStreamPayload,
+                   ChunkPayload, DeliveryReportPayload,
+                   EmailListRequestPayload, EmailListPayload,
+                   SyncRequestPayload, SyncPayload, EmailChoicePayload,
+                   EmailBatchRequestPayload, EmailBatchPayload,
+                   SearchRequestPayload, SearchPayload, StatsPayload,
+                   NotificationPayload, CodecPayload]
 
 
 def get_current_utc_time() -> str:
@@ -0,0 +1,154 @@
+"""\
+Tests du stockage des dossiers (glostorage), à lancer depuis la racine du
+dépôt avec `python -m unittest discover -s tests` ou `python -m pytest`.
+"""
+import json
+import os
+import tempfile
+import unittest
+
+import glostorage
+import gloutils
+
+
+def _email(content: str) -> bytes:
+    return json.dumps({"sender": "alice@glo2000.ca", "subject": "sujet",
+                       "content": content}).encode('utf-8')
+
+
+class SegmentStoreTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+        os.makedirs(glostorage.user_dir(self.root, "bob"))
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def _log_dir(self) -> str:
+        return os.path.join(glostorage.user_dir(self.root, "bob"), glostorage.LOG_DIRNAME)
+
+    def _segment(self, segment: int) -> str:
+        return os.path.join(self._log_dir(), glostorage._SEGMENT_FORMAT.format(segment))
+
+    def test_append_read(self) -> None:
+        store = glostorage.SegmentStore(self.root)
+        datas = [_email("court"), _email("x" * 10000), _email("fin")]
+        written = store.append("bob", datas)
+        self.assertEqual([seq for seq, _ in written], [1, 2, 3])
+        self.assertLess(written[1][1], len(datas[1]))  # Compressé.
+        self.assertEqual(store.append("bob", [_email("suite")])[0][0], 4)
+
+        reopened = glostorage.SegmentStore(self.root)
+        for seq, data in enumerate(datas, start=1):
+            self.assertEqual(reopened.read("bob", seq), data)
+        self.assertEqual([seq for seq, _ in reopened.scan("bob", after=2)], [3, 4])
+        with self.assertRaises(glostorage.StorageError):
+            reopened.read("bob", 5)
+
+    def test_segments_rollover(self) -> None:
+        store = glostorage.SegmentStore(self.root, compress_threshold=0,
+                                        segment_size=200)
+        datas = [_email(str(i) * 50) for i in range(10)]
+        store.append("bob", datas[:4])
+        store.append("bob", datas[4:])
+        self.assertTrue(os.path.exists(self._segment(2)))
+        reopened = glostorage.SegmentStore(self.root, segment_size=200)
+        self.assertEqual([data for _, data in reopened.scan("bob")], datas)
+
+    def test_recover_truncated_tail(self) -> None:
+        store = glostorage.SegmentStore(self.root)
+        datas = [_email(str(i)) for i in range(3)]
+        store.append("bob", datas)
+        # Arrêt brutal pendant l'écriture du troisième courriel : son
+        # enregistrement est incomplet et il n'est pas indexé.
+        index_path = os.path.join(self._log_dir(), glostorage._INDEX_FILENAME)
+        os.truncate(index_path, 2 * glostorage._INDEX_ENTRY.size + 5)
+        os.truncate(self._segment(1), os.path.getsize(self._segment(1)) - 4)
+
+        recovered = glostorage.SegmentStore(self.root)
+        recovered.recover("bob")
+        self.assertEqual(recovered.usage("bob")[0], 2)
+        self.assertEqual([data for _, data in recovered.scan("bob")], datas[:2])
+        self.assertEqual(os.path.getsize(index_path), 2 * glostorage._INDEX_ENTRY.size)
+        self.assertEqual(recovered.append("bob", [_email("nouveau")])[0][0], 3)
+        self.assertEqual(recovered.read("bob", 3), _email("nouveau"))
+
+    def test_recover_unindexed_record(self) -> None:
+        store = glostorage.SegmentStore(self.root)
+        datas = [_email(str(i)) for i in range(3)]
+        store.append("bob", datas)
+        # Arrêt brutal après l'écriture du courriel, avant celle de l'index.
+        index_path = os.path.join(self._log_dir(), glostorage._INDEX_FILENAME)
+        os.truncate(index_path, 2 * glostorage._INDEX_ENTRY.size)
+
+        recovered = glostorage.SegmentStore(self.root)
+        recovered.recover("bob")
+        self.assertEqual([data for _, data in recovered.scan("bob")], datas)
+
+    def test_compact(self) -> None:
+        store = glostorage.SegmentStore(self.root, compress_threshold=0,
+                                        segment_size=4096)
+        datas = [_email(str(i) * 2000) for i in range(5)]
+        for data in datas:
+            store.append("bob", [data])
+
+        compacting = glostorage.SegmentStore(self.root)
+        before, after = compacting.compact("bob")
+        self.assertLess(after, before)
+        self.assertFalse(os.path.exists(self._segment(2)))
+        self.assertEqual([data for _, data in compacting.scan("bob")], datas)
+        self.assertEqual(compacting.append("bob", [_email("suite")])[0][0], 6)
+
+        reopened = glostorage.SegmentStore(self.root)
+        self.assertEqual([seq for seq, _ in reopened.scan("bob")], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(reopened.read("bob", 2), datas[1])
+
+
+class BlobStoreTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def _exists(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.root, gloutils.SERVER_BLOBS_DIR, key))
+
+    def test_put_release(self) -> None:
+        blobs = glostorage.BlobStore(self.root)
+        body = _email("x" * 10000)
+        key, = blobs.put([(body, 2)])
+        self.assertEqual(blobs.put([(body, 1)]), [key])
+        self.assertEqual(blobs.read(key), body)
+
+        blobs.release([key, key])
+        self.assertTrue(self._exists(key))
+        # Les comptes sont relus du journal par une nouvelle instance.
+        reopened = glostorage.BlobStore(self.root)
+        reopened.release([key])
+        self.assertFalse(self._exists(key))
+        with self.assertRaises(glostorage.StorageError):
+            reopened.read(key)
+
+    def test_collect(self) -> None:
+        blobs = glostorage.BlobStore(self.root)
+        kept, orphan = blobs.put([(_email("gardé"), 1), (_email("orphelin"), 3)])
+        removed, freed = blobs.collect({kept: 2})
+        self.assertEqual(removed, 1)
+        self.assertGreater(freed, 0)
+        self.assertFalse(self._exists(orphan))
+        self.assertEqual(blobs.read(kept), _email("gardé"))
+
+        reopened = glostorage.BlobStore(self.root)
+        reopened.release([kept])
+        self.assertTrue(self._exists(kept))
+        reopened.release([kept])
+        self.assertFalse(self._exists(kept))
+
+
+if __name__ == '__main__':
+    unittest.main()